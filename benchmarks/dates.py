@@ -0,0 +1,86 @@
+#!/bin/python
+# dates
+# Micro-benchmark of the DATE conversion of reference tables in qapi-export.py
+#
+# A synthetic DATE column is converted cell by cell the way parse_json/jsonify
+# did it (fromtimestamp/strftime and strptime/timestamp) and by batches with
+# DateConverter, the results are compared and the timings printed.
+#
+# Usage:
+#       >   python3 benchmarks/dates.py
+#       >   python3 benchmarks/dates.py --cells 2000000 --distinct 50000 --dateformat "%d.%m.%Y %H:%M"
+#
+import argparse
+import datetime
+import importlib.util
+import os
+import random
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QAPI_EXPORT = os.path.join(REPO_ROOT, 'network-hierarchy-to-elk', 'qapi-export.py')
+
+
+def load_qapi_export():
+    # The file name has a dash, so it is loaded by path
+    spec = importlib.util.spec_from_file_location('qapi_export', QAPI_EXPORT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def column(cells, distinct, seed=1):
+    # Milliseconds of the last year, every value is repeated cells/distinct times on average
+    random.seed(seed)
+    now = int(time.time()) * 1000
+    values = [str(now - random.randint(0, 365 * 86400 * 1000)) for _ in range(distinct)]
+    return [random.choice(values) for _ in range(cells)]
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-cell and batched DATE conversion')
+    parser.add_argument('--cells', type=int, default=500000, help='number of DATE cells')
+    parser.add_argument('--distinct', type=int, default=100000, help='number of distinct values')
+    parser.add_argument('--dateformat', default='%Y-%m-%d %H:%M:%S', help='format of the dates')
+    args = parser.parse_args()
+
+    qapi = load_qapi_export()
+    values = column(args.cells, args.distinct)
+    dateformat = args.dateformat
+
+    def old_to_text(values):
+        return [datetime.datetime.fromtimestamp(int(value)/1000).strftime(dateformat) for value in values]
+
+    def old_to_timestamp(texts):
+        return ['{:.0f}'.format(datetime.datetime.timestamp(datetime.datetime.strptime(text, dateformat))*1000)
+                for text in texts]
+
+    def batched(method, values):
+        return getattr(qapi.DateConverter(dateformat), method)(values)
+
+    texts, old_text_time = timed(old_to_text, values)
+    stamps, old_stamp_time = timed(old_to_timestamp, texts)
+    rows = [('to text, per cell', old_text_time, True),
+            ('to timestamp, per cell', old_stamp_time, True)]
+    result, elapsed = timed(batched, 'to_text', values)
+    rows.append(('to text, batched', elapsed, result == texts))
+    result, elapsed = timed(batched, 'to_timestamp', texts)
+    rows.append(('to timestamp, batched', elapsed, result == stamps))
+
+    print('{} cells, {} distinct values, format "{}"'.format(args.cells, args.distinct, dateformat))
+    print('{:<30} {:>10} {:>9} {:>6}'.format('conversion', 'time, s', 'speedup', 'same'))
+    for name, elapsed, same in rows:
+        base = old_text_time if 'to text' in name else old_stamp_time
+        print('{:<30} {:>10.3f} {:>8.1f}x {:>6}'.format(name, elapsed, base / elapsed if elapsed else 0, 'yes' if same else 'NO'))
+    if not all(same for name, elapsed, same in rows):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
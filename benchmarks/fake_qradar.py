@@ -0,0 +1,559 @@
+#!/bin/python
+# fake_qradar
+# Local stand-in for the QRadar API and the UserVentory plugin used by the scripts
+# of this repository, for load and regression benchmarks without a live console.
+#
+# Implemented endpoints (under /api/):
+#       config/network_hierarchy/networks, config/network_hierarchy/staged_networks
+#       asset_model/assets, asset_model/assets/{id}, asset_model/properties
+#       reference_data/{sets,maps,map_of_sets,tables}[/{name}], .../bulk_load/{name}
+#       reference_data/sets/{name}/{value}, reference_data/tables/{name}/{key}/{field}
+#       ariel/searches, ariel/searches/{id}, ariel/searches/{id}/results
+# and the plugin endpoints (under /console/plugins/{id}/app_proxy:nodeserver/api/):
+#       table/data, table/status, logs/errors, connectors[/{id}]
+# plus GET /__stats and POST /__reset for the benchmark harness.
+#
+# Range: items=x-y is honoured for lists and answered with Content-Range,
+# fields=a,b(c,d) projects the answers of GET requests.
+# --compress answers gzip to clients that accept it, --bandwidth slows the answers down to a WAN link.
+#
+# Usage:
+#       >   python3 benchmarks/fake_qradar.py --port 8443 --assets 100000 --properties 200
+#       >   python3 benchmarks/fake_qradar.py --latency 50 --jitter 20 --error-rate 0.01
+#
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+PLUGIN_PATH = re.compile(r'^/console/plugins/\d+/app_proxy:nodeserver/api/')
+RANGE = re.compile(r'items=(\d+)-(\d+)')
+FILTER_NAME = re.compile(r'name\s*=\s*"([^"]*)"')
+FIELDS_TOKEN = re.compile(r'\s*([^,()\s]+|[,()])')
+
+BASE_TIME = 1600000000000  # ms, first_seen/last_seen and DATE values are generated from it
+
+ASSET_PROPERTIES = ['Unified Name', 'Given Name', 'Description', 'Location', 'Business Owner',
+                    'Business Contact', 'Technical Owner', 'Technical Contact', 'Asset Type', 'CVSS Availability Requirement']
+
+
+def generated_ip(index, v6=False):
+    if v6:
+        return '2001:db8:{:x}:{:x}::1'.format((index >> 16) & 0xffff, index & 0xffff)
+    return '10.{}.{}.{}'.format((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+
+
+class FakeData:
+    """Deterministic data sets of configurable size.
+
+    Networks, reference collections and the change log are kept in memory,
+    assets, events and UserVentory users are built from their index on request,
+    so large data sets cost no memory in the server.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.networks = [self.network(i) for i in range(args.networks)]
+        self.staged_networks = []
+        self.properties = [{'id': 1001 + i, 'name': ASSET_PROPERTIES[i] if i < len(ASSET_PROPERTIES) else 'Custom Property {}'.format(i)}
+                           for i in range(args.properties)]
+        self.asset_updates = {}
+        self.sets = {}
+        self.maps = {}
+        self.mapsets = {}
+        self.tables = {}
+        for n in range(args.refsets):
+            name = 'Fake Set {}'.format(n)
+            self.sets[name] = {'element_type': 'IP', 'data': {generated_ip(i): self.element(i) for i in range(args.refset_size)}}
+            name = 'Fake Map {}'.format(n)
+            self.maps[name] = {'element_type': 'ALN', 'data': {'key{}'.format(i): self.element(i, 'value{}'.format(i)) for i in range(args.refset_size)}}
+            name = 'Fake MapOfSets {}'.format(n)
+            self.mapsets[name] = {'element_type': 'ALN', 'data': {'key{}'.format(i): [self.element(i, 'value{}'.format(j)) for j in range(3)]
+                                                                  for i in range(args.refset_size)}}
+            name = 'Fake Table {}'.format(n)
+            self.tables[name] = self.table(args.table_rows, args.table_columns)
+        self.searches = {}
+
+    def network(self, i):
+        group = 'Region{}.Site{}'.format(i % 7, i % 53)
+        flags = ('<{}>'.format(100 + i % 900) if i % 3 else '') + ('[Critical VLAN]' if i % 11 == 0 else '') + ('[Wireless]' if i % 13 == 0 else '')
+        prefix = 24 if i % 5 else 16
+        base = (i * 256) if prefix == 24 else (i * 65536)
+        cidr = '10.{}.{}.0/{}'.format((base >> 16) & 0xff, (base >> 8) & 0xff, prefix) if i % 17 else \
+            '2001:db8:{:x}::/48'.format(i)
+        network = {'id': i + 1, 'group': group, 'name': 'net_{}'.format(i), 'cidr': cidr, 'domain_id': 0,
+                   'description': flags + 'Street {}'.format(i)}
+        if i % 4:
+            network['location'] = {'type': 'Point', 'coordinates': [round(30 + (i % 100) / 10.0, 4), round(50 + (i % 70) / 10.0, 4)]}
+            network['country_code'] = 'UA'
+        return network
+
+    def element(self, i, value=None):
+        element = {'source': 'fake', 'first_seen': BASE_TIME + i * 1000, 'last_seen': BASE_TIME + i * 2000}
+        if value is not None:
+            element['value'] = value
+        return element
+
+    def table(self, rows, columns):
+        types = {}
+        for c in range(columns):
+            types['Column {}'.format(c)] = 'DATE' if c % 3 == 2 else ('NUM' if c % 3 == 1 else 'ALN')
+        data = {}
+        for i in range(rows):
+            row = {}
+            for c, (field, kind) in enumerate(types.items()):
+                if kind == 'DATE':
+                    value = str(BASE_TIME + (i % 1000) * 86400000)
+                elif kind == 'NUM':
+                    value = str(i * (c + 1))
+                else:
+                    value = 'text {} {}'.format(i, c)
+                row[field] = self.element(i, value)
+            data[generated_ip(i)] = row
+        return {'element_type': 'ALN', 'key_label': 'IP', 'key_name_types': types, 'data': data}
+
+    def asset(self, i):
+        asset = {'id': 1000 + i, 'domain_id': 0,
+                 'interfaces': [{'id': i, 'mac_address': '00:00:00:{:02x}:{:02x}:{:02x}'.format((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff),
+                                 'ip_addresses': [{'id': i, 'type': 'IPV4', 'value': generated_ip(i)},
+                                                  {'id': i, 'type': 'IPV6', 'value': generated_ip(i, v6=True)}]}],
+                 'properties': [{'name': p['name'], 'type_id': p['id'], 'value': '{} {}'.format(p['name'], i)}
+                                for p in self.properties[:self.args.asset_properties]]}
+        for update in self.asset_updates.get(asset['id'], []):
+            for prop in update.get('properties', []):
+                asset['properties'].append({'type_id': prop.get('type_id'), 'value': prop.get('value'),
+                                            'name': next((p['name'] for p in self.properties if p['id'] == prop.get('type_id')), '')})
+        return asset
+
+    def event(self, i):
+        return {'starttime': BASE_TIME + i * 100, 'sourceip': generated_ip(i), 'destinationip': generated_ip(i * 7),
+                'qid': 1000 + i % 50, 'username': 'user{}'.format(i % 1000), 'eventcount': 1 + i % 5}
+
+    def users(self, filters):
+        # User names depend on the filter set, so different sources return different users
+        digest = int(hashlib.md5('|'.join(sorted(filters)).encode()).hexdigest()[:8], 16)
+        count = self.args.users
+        domain = 'hq'
+        for item in filters:
+            if item.startswith('domain='):
+                domain = item[len('domain='):]
+        return count, lambda i: {'name': {'default': 'user{}_{}@{}'.format(digest % 1000, i, domain)},
+                                 'domain': domain, 'sAMAccountName': 'user{}_{}'.format(digest % 1000, i)}
+
+    def collection(self, kind):
+        return {'sets': self.sets, 'maps': self.maps, 'map_of_sets': self.mapsets, 'tables': self.tables}[kind]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors_injected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.by_endpoint = {}
+
+    def record(self, method, template, bytes_in, bytes_out, injected):
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if injected:
+                self.errors_injected += 1
+            key = method + ' ' + template
+            self.by_endpoint[key] = self.by_endpoint.get(key, 0) + 1
+
+    def as_dict(self):
+        with self.lock:
+            return {'uptime': round(time.time() - self.started, 3), 'requests': self.requests,
+                    'errors_injected': self.errors_injected, 'bytes_in': self.bytes_in,
+                    'bytes_out': self.bytes_out, 'by_endpoint': dict(self.by_endpoint)}
+
+
+def parse_fields(text):
+    """{field: nested fields or None} of the fields= parameter: id,interfaces(ip_addresses(value))"""
+    tokens = [token for token in FIELDS_TOKEN.findall(text)]
+    position = 0
+
+    def level():
+        nonlocal position
+        fields = {}
+        while position < len(tokens) and tokens[position] != ')':
+            name = tokens[position]
+            position += 1
+            if name == ',':
+                continue
+            fields[name] = None
+            if position < len(tokens) and tokens[position] == '(':
+                position += 1
+                fields[name] = level()
+                position += 1
+        return fields
+    return level()
+
+
+def project(value, fields):
+    """Keep only the fields of dicts, lists are projected item by item"""
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, fields) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], nested) for name, nested in fields.items() if name in value}
+    return value
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeQRadar/1.0'
+    # Headers and body are written separately, without this keep-alive clients wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    # Request plumbing
+
+    def dispatch(self, method):
+        args = self.server.args
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        self.template = '?'
+
+        rnd = self.server.data.rnd
+        if args.latency or args.jitter:
+            time.sleep((args.latency + rnd.uniform(0, args.jitter)) / 1000.0)
+
+        injected = False
+        if url.path.startswith('/__'):
+            status, payload, headers = self.control(method, url.path)
+        elif args.error_rate and rnd.random() < args.error_rate:
+            injected = True
+            status, payload, headers = rnd.choice([429, 503]), {'message': 'injected error'}, {'Retry-After': str(args.retry_after)}
+        else:
+            try:
+                status, payload, headers = self.route(method, url.path)
+                if method == 'GET' and status == 200 and self.query.get('fields'):
+                    payload = project(payload, parse_fields(self.query['fields'][0]))
+            except KeyError as e:
+                status, payload, headers = 404, {'http_response': {'code': 404}, 'message': 'Not found: {}'.format(e)}, {}
+            except (ValueError, TypeError) as e:
+                status, payload, headers = 422, {'http_response': {'code': 422}, 'message': str(e)}, {}
+
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        if args.compress and len(body) > 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=6)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if method != 'HEAD' and args.bandwidth:
+            step = 16384
+            for offset in range(0, len(body), step):
+                self.wfile.write(body[offset:offset + step])
+                time.sleep(len(body[offset:offset + step]) / (args.bandwidth * 1024.0))
+        elif method != 'HEAD':
+            self.wfile.write(body)
+        if not url.path.startswith('/__'):
+            self.server.stats.record(method, self.template, length, len(body), injected)
+
+    def control(self, method, path):
+        if path == '/__stats':
+            return 200, self.server.stats.as_dict(), {}
+        if path == '/__reset' and method == 'POST':
+            self.server.stats.reset()
+            return 200, {'reset': True}, {}
+        return 404, {'message': 'unknown control endpoint'}, {}
+
+    def window(self, items):
+        # Slice a list by the Range header, returns (slice, headers)
+        total = len(items) if not isinstance(items, int) else items
+        match = RANGE.search(self.headers.get('Range', ''))
+        if not match:
+            return (0, total), {}
+        first = int(match.group(1))
+        last = min(int(match.group(2)), total - 1)
+        return (first, max(last + 1, first)), {'Content-Range': 'items {}-{}/{}'.format(first, last, total)}
+
+    def json_body(self):
+        return json.loads(self.body.decode('utf-8')) if self.body else None
+
+    # API
+
+    def route(self, method, path):
+        data = self.server.data
+        plugin = PLUGIN_PATH.match(path)
+        if plugin:
+            return self.plugin(method, path[plugin.end():])
+        if not path.startswith('/api/'):
+            raise KeyError(path)
+        parts = [unquote(part) for part in path[len('/api/'):].split('/')]
+
+        if parts[:2] == ['config', 'network_hierarchy']:
+            self.template = 'config/network_hierarchy/' + parts[2]
+            if parts[2] == 'networks' and method == 'GET':
+                (first, last), headers = self.window(data.networks)
+                return 200, data.networks[first:last], headers
+            if parts[2] == 'staged_networks':
+                if method == 'PUT':
+                    with data.lock:
+                        data.staged_networks = self.json_body()
+                    return 200, data.staged_networks, {}
+                return 200, data.staged_networks, {}
+
+        if parts[0] == 'asset_model':
+            if parts[1] == 'properties':
+                self.template = 'asset_model/properties'
+                return 200, data.properties, {}
+            if parts[1] == 'assets' and len(parts) == 2:
+                self.template = 'asset_model/assets'
+                (first, last), headers = self.window(self.server.args.assets)
+                return 200, [data.asset(i) for i in range(first, last)], headers
+            if parts[1] == 'assets' and method == 'POST':
+                self.template = 'asset_model/assets/{id}'
+                with data.lock:
+                    data.asset_updates.setdefault(int(parts[2]), []).append(self.json_body())
+                return 202, b'', {}
+
+        if parts[0] == 'reference_data':
+            return self.reference_data(method, parts[1:])
+
+        if parts[:2] == ['ariel', 'searches']:
+            return self.ariel(method, parts[2:])
+
+        raise KeyError(path)
+
+    def reference_data(self, method, parts):
+        data = self.server.data
+        kind = parts[0]
+        collection = data.collection(kind)
+        if len(parts) == 1:
+            self.template = 'reference_data/' + kind
+            names = sorted(collection)
+            name_filter = FILTER_NAME.search(self.query.get('filter', [''])[0])
+            if name_filter:
+                names = [name for name in names if name == name_filter.group(1)]
+            listing = [self.describe(kind, name, collection[name]) for name in names]
+            (first, last), headers = self.window(listing)
+            return 200, listing[first:last], headers
+
+        if parts[1] == 'bulk_load':
+            self.template = 'reference_data/' + kind + '/bulk_load/{name}'
+            name = parts[2]
+            payload = self.json_body()
+            with data.lock:
+                target = collection.setdefault(name, {'element_type': 'ALN', 'data': {}})
+                if kind == 'sets':
+                    for value in payload:
+                        target['data'][str(value)] = data.element(0)
+                elif kind == 'tables':
+                    for key, row in payload.items():
+                        stored = target['data'].setdefault(key, {})
+                        for field, value in row.items():
+                            stored[field] = data.element(0, str(value))
+                else:
+                    for key, value in payload.items():
+                        target['data'][key] = data.element(0, value)
+            return 200, self.describe(kind, name, target), {}
+
+        name = parts[1]
+        if len(parts) == 2:
+            self.template = 'reference_data/' + kind + '/{name}'
+            if method == 'GET':
+                return self.collection_content(kind, name, collection[name])
+            if method == 'POST':
+                value = self.query.get('value', [''])[0]
+                with data.lock:
+                    target = collection.setdefault(name, {'element_type': 'ALN', 'data': {}})
+                    target['data'][value] = data.element(0)
+                return 200, self.describe(kind, name, target), {}
+            if method == 'DELETE':
+                with data.lock:
+                    del collection[name]
+                return 202, {'status': 'QUEUED'}, {}
+
+        if kind == 'sets' and method == 'DELETE':
+            self.template = 'reference_data/sets/{name}/{value}'
+            with data.lock:
+                collection[name]['data'].pop(parts[2], None)
+            return 200, self.describe(kind, name, collection[name]), {}
+        if kind == 'tables' and method == 'DELETE' and len(parts) == 4:
+            self.template = 'reference_data/tables/{name}/{key}/{field}'
+            with data.lock:
+                collection[name]['data'].get(parts[2], {}).pop(parts[3], None)
+            return 200, self.describe(kind, name, collection[name]), {}
+        raise KeyError('/'.join(parts))
+
+    def describe(self, kind, name, collection):
+        item = {'name': name, 'element_type': collection['element_type'], 'number_of_elements': len(collection['data']),
+                'creation_time': BASE_TIME, 'timeout_type': 'LAST_SEEN'}
+        if kind == 'tables':
+            item['key_label'] = collection['key_label']
+            item['key_name_types'] = collection['key_name_types']
+        return item
+
+    def collection_content(self, kind, name, collection):
+        content = self.describe(kind, name, collection)
+        keys = list(collection['data'])
+        (first, last), headers = self.window(keys)
+        if kind == 'sets':
+            content['data'] = [dict(collection['data'][key], value=key) for key in keys[first:last]]
+        else:
+            content['data'] = {key: collection['data'][key] for key in keys[first:last]}
+        return 200, content, headers
+
+    def ariel(self, method, parts):
+        data = self.server.data
+        if not parts and method == 'POST':
+            self.template = 'ariel/searches'
+            if not (self.query.get('query_expression') or self.query.get('saved_search_id')):
+                raise ValueError('query_expression or saved_search_id is required')
+            search_id = str(uuid.uuid4())
+            with data.lock:
+                data.searches[search_id] = {'polls': 0}
+            return 201, {'search_id': search_id, 'status': 'WAIT', 'progress': 0}, {}
+        search = data.searches[parts[0]]
+        if len(parts) == 1:
+            self.template = 'ariel/searches/{id}'
+            search['polls'] += 1
+            done = search['polls'] >= self.server.args.aql_polls
+            return 200, {'search_id': parts[0], 'status': 'COMPLETED' if done else 'EXECUTE',
+                         'progress': 100 if done else 50, 'query_execution_time': 1234,
+                         'record_count': self.server.args.events}, {}
+        self.template = 'ariel/searches/{id}/results'
+        (first, last), headers = self.window(self.server.args.events)
+        return 200, {'events': [data.event(i) for i in range(first, last)]}, headers
+
+    # UserVentory / inventory plugin
+
+    def plugin(self, method, path):
+        data = self.server.data
+        args = self.server.args
+        if path == 'table/data':
+            self.template = 'plugin/table/data'
+            total, user = data.users(self.query.get('filter', []))
+            start = int(self.query.get('start', ['0'])[0])
+            size = int(self.query.get('size', ['100'])[0])
+            return 200, {'total': total, 'items': [user(i) for i in range(start, min(start + size, total))]}, {}
+        if path == 'table/status':
+            self.template = 'plugin/table/status'
+            return 200, {'connectorsCount': args.connectors, 'status': 'ready'}, {}
+        if path == 'logs/errors':
+            self.template = 'plugin/logs/errors'
+            return 200, [{'_id': '{:024x}-'.format(i), 'name': 'Connector {}'.format(i), 'error': 'Timeout while reading data from source {}'.format(i)}
+                         for i in range(args.connector_errors)], {}
+        if path.startswith('connectors'):
+            self.template = 'plugin/connectors'
+            if path == 'connectors':
+                return 200, [{'_id': '{:024x}-'.format(i), 'query': 'query {}'.format(i)} for i in range(args.connectors)], {}
+            return 200, {'_id': path.split('/', 1)[1], 'status': 'ok'}, {}
+        raise KeyError(path)
+
+
+def self_signed_certificate(folder):
+    cert = os.path.join(folder, 'fake_qradar.crt')
+    key = os.path.join(folder, 'fake_qradar.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local fake QRadar API and UserVentory plugin')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8443, help='port to listen on, 0 - any free port')
+    parser.add_argument('--plain', action='store_true', help='serve plain HTTP instead of HTTPS')
+    parser.add_argument('--cert', help='TLS certificate, a self-signed one is generated if missing')
+    parser.add_argument('--key', help='TLS private key')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the generated data')
+    parser.add_argument('--networks', type=int, default=1000, help='number of networks')
+    parser.add_argument('--assets', type=int, default=1000, help='number of assets')
+    parser.add_argument('--properties', type=int, default=50, help='number of asset properties defined')
+    parser.add_argument('--asset-properties', dest='asset_properties', type=int, default=10, help='number of properties set on each asset')
+    parser.add_argument('--refsets', type=int, default=2, help='number of collections of every reference data type')
+    parser.add_argument('--refset-size', dest='refset_size', type=int, default=1000, help='elements in every set, map and map of sets')
+    parser.add_argument('--table-rows', dest='table_rows', type=int, default=1000, help='rows in every reference table')
+    parser.add_argument('--table-columns', dest='table_columns', type=int, default=6, help='columns in every reference table, every third is DATE')
+    parser.add_argument('--events', type=int, default=10000, help='rows returned by every Ariel search')
+    parser.add_argument('--aql-polls', dest='aql_polls', type=int, default=1, help='status polls before a search completes')
+    parser.add_argument('--users', type=int, default=100, help='UserVentory users returned for every filter set')
+    parser.add_argument('--connectors', type=int, default=20, help='number of inventory connectors')
+    parser.add_argument('--connector-errors', dest='connector_errors', type=int, default=2, help='connectors in error state')
+    parser.add_argument('--latency', type=float, default=0, help='added latency of every request, ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra latency up to this value, ms')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0, help='fraction of requests answered with 429/503')
+    parser.add_argument('--retry-after', dest='retry_after', type=int, default=1, help='Retry-After of injected errors, s')
+    parser.add_argument('--compress', action='store_true', help='gzip answers above 1 KB when the client accepts gzip')
+    parser.add_argument('--bandwidth', type=float, default=0, help='send answers at this rate, KB/s, 0 - no limit')
+    parser.add_argument('-v', dest='verbose', action='store_true', help='log every request to stderr')
+    return parser.parse_args(argv)
+
+
+def make_server(args):
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.args = args
+    server.data = FakeData(args)
+    server.stats = Stats()
+    if not args.plain:
+        cert, key = args.cert, args.key
+        if not cert:
+            cert, key = self_signed_certificate(tempfile.mkdtemp(prefix='fake_qradar'))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def main():
+    args = parse_args()
+    server = make_server(args)
+    # The harness reads the actual port from this line
+    print('Listening on {}://{}:{}'.format('http' if args.plain else 'https', args.host, server.server_address[1]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
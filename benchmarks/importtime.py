@@ -0,0 +1,121 @@
+#!/bin/python
+# importtime
+# Import-time benchmark for the operational scripts of this repository
+#
+# Every entry point is loaded in a fresh interpreter started with -X importtime
+# (the module code runs, main() does not), the report is parsed and the total
+# startup cost plus the most expensive imports are printed.
+#
+# Usage:
+#       >   python3 benchmarks/importtime.py
+#       >   python3 benchmarks/importtime.py --top 5 --save importtime.json
+#       >   python3 benchmarks/importtime.py --baseline importtime.json --threshold 0.2
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry points that are started by cron or by other scripts
+ENTRY_POINTS = [
+    'uc87/uc87.py',
+    'itsventory-connectors-check/itsventory-connectors-check.py',
+    'usrventory-connectors-check/usrventory-connectors-check.py',
+    'network-hierarchy-to-elk/qapi-export.py',
+    'network-hierarchy-to-elk/networkhierarchy_latest.py',
+    'network-hierarchy-to-elk/refmirror.py',
+]
+
+# The module body is executed under a name different from __main__, everything
+# reported before the marker belongs to the interpreter and the loader itself
+MARKER = '# importtime start'
+LOADER = ('import sys, importlib.util\n'
+          'spec = importlib.util.spec_from_file_location("importtime", sys.argv[1])\n'
+          'module = importlib.util.module_from_spec(spec)\n'
+          'sys.stderr.write("' + MARKER + '\\n")\n'
+          'spec.loader.exec_module(module)\n')
+
+
+def measure(script):
+    """Load script in a child interpreter and return its parsed importtime report."""
+    path = os.path.join(REPO_ROOT, script)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', LOADER, path],
+                          cwd=os.path.dirname(path), stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    modules = []
+    errors = []
+    lines = proc.stderr.splitlines()
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+    for line in lines:
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # header line
+        modules.append({'module': parts[2].rstrip(),
+                        'self_us': int(parts[0]),
+                        'cumulative_us': int(parts[1])})
+    # Top level imports are the ones without indentation in the report
+    total = sum(m['cumulative_us'] for m in modules if not m['module'].startswith('  '))
+    return {'script': script,
+            'returncode': proc.returncode,
+            'total_us': total,
+            'modules': modules,
+            'error': errors[-1] if proc.returncode and errors else ''}
+
+
+def print_report(results, top):
+    for result in results:
+        print('{}: {:.1f} ms{}'.format(result['script'], result['total_us'] / 1000,
+                                      ' (FAILED: ' + result['error'] + ')' if result['error'] else ''))
+        heaviest = sorted(result['modules'], key=lambda m: m['cumulative_us'], reverse=True)
+        for module in heaviest[:top]:
+            print('    {:>10.1f} ms  {}'.format(module['cumulative_us'] / 1000, module['module'].strip()))
+
+
+def compare(results, baseline_file, threshold):
+    """Return the list of scripts whose startup grew more than threshold compared to baseline."""
+    with open(baseline_file, mode='r', encoding='utf-8') as f:
+        baseline = {item['script']: item['total_us'] for item in json.load(f)}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['script'])
+        if before and result['total_us'] > before * (1 + threshold):
+            regressions.append(result['script'])
+            print('REGRESSION {}: {:.1f} ms -> {:.1f} ms'.format(
+                result['script'], before / 1000, result['total_us'] / 1000))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure import time of the repository scripts')
+    parser.add_argument('scripts', nargs='*', default=ENTRY_POINTS,
+                        help='scripts to measure, relative to the repository root')
+    parser.add_argument('--top', dest='top', type=int, default=10,
+                        help='number of the heaviest imports to show per script')
+    parser.add_argument('--save', dest='save',
+                        help='save results as JSON to use as baseline later')
+    parser.add_argument('--baseline', dest='baseline',
+                        help='JSON file with previous results to compare with')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.2,
+                        help='allowed relative growth of startup time. Default - 0.2')
+    args = parser.parse_args()
+
+    results = [measure(script) for script in args.scripts]
+    print_report(results, args.top)
+    if args.save:
+        with open(args.save, mode='w', encoding='utf-8') as f:
+            json.dump([{'script': r['script'], 'total_us': r['total_us']} for r in results], f, indent=2)
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        exit(1)
+    exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/bin/python
+# run_scripts
+# Benchmark harness: starts benchmarks/fake_qradar.py, runs the scripts of this
+# repository against it and reports wall time, requests/s and peak RSS of every run.
+#
+# Usage:
+#       >   python3 benchmarks/run_scripts.py
+#       >   python3 benchmarks/run_scripts.py --only qapi-assets qapi-networks --server-args "--assets 100000 --latency 20"
+#       >   python3 benchmarks/run_scripts.py --save results.json --baseline baseline.json
+#
+import argparse
+import json
+import os
+import shlex
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_SERVER = os.path.join(REPO_ROOT, 'benchmarks', 'fake_qradar.py')
+PLUGIN_API = '/console/plugins/3351/app_proxy:nodeserver/api/'
+TOKEN = '00000000-0000-0000-0000-000000000000'
+
+
+def scenarios(host, workdir):
+    """(name, script, arguments, extra environment) of every benchmarked run."""
+    qapi = os.path.join(REPO_ROOT, 'network-hierarchy-to-elk', 'qapi-export.py')
+    connection = ['--host', host, '--token', TOKEN]
+    uc87_env = {'TEMP_PATH': workdir, 'LOGS_PATH': os.path.join(workdir, 'uc87.log'),
+                'SYSLOG_PROTO': 'tcp', 'SYSLOG_SRV': '127.0.0.1', 'SYSLOG_PORT': '9',
+                'SYSLOG_SCRIPT_NAME': 'refset_sync', 'SYSLOG_SCRIPT_PATH': workdir}
+    return [
+        ('qapi-networks', qapi, ['export', 'networks', '--csv', 'networks.csv'] + connection, {}),
+        ('qapi-assets', qapi, ['export', 'assets', '--csv', 'assets.csv'] + connection, {}),
+        ('qapi-assets-import', qapi, ['import', 'assets', '--csv', 'assets.csv', '--rate', '0', '--no-diff'] + connection, {}),
+        ('qapi-reftables', qapi, ['export', 'reftables', '--csv', 'reftables.csv'] + connection, {}),
+        ('qapi-reftable', qapi, ['export', 'reftable', '--name', 'Fake Table 0', '--csv', 'reftable.csv'] + connection, {}),
+        ('qapi-reftable-import', qapi, ['import', 'reftable', '--name', 'Fake Table 1', '--csv', 'reftable.csv'] + connection, {}),
+        ('qapi-refsets', qapi, ['export', 'refset', '--name', 'Fake Set 0,Fake Set 1', '--csv', 'refsets.csv'] + connection, {}),
+        ('qapi-count', qapi, ['count', 'assets,networks,reftables,reftable,refset'] + connection, {}),
+        ('qapi-events', qapi, ['export', 'events', '--aql', 'select * from events', '--csv', 'events.csv'] + connection, {}),
+        ('refset-sync', os.path.join(REPO_ROOT, 'uc87', 'refset_sync.py'),
+         ['--config', 'refsets.json', '--plan-dir', workdir], uc87_env),
+        ('itsventory-check', os.path.join(REPO_ROOT, 'itsventory-connectors-check', 'itsventory-connectors-check.py'), [],
+         {'CONNECTORS_CHECK_CONFIG': 'connectors.json'}),
+        ('usrventory-check', os.path.join(REPO_ROOT, 'usrventory-connectors-check', 'usrventory-connectors-check.py'), [],
+         {'CONNECTORS_CHECK_CONFIG': 'connectors.json'}),
+    ]
+
+
+def write_configs(host, workdir):
+    # Configs of the scripts that read their URLs from JSON files
+    refsets = {'base_url_qradar': 'https://' + host + '/api/',
+               'base_url_inventory': 'https://' + host + PLUGIN_API + 'table/data',
+               'SEC': TOKEN, 'source_user': '&source=benchmark', 'workers': 8,
+               'sources': {'hq': ['domain=hq', 'member_of_group=Domain Admins.Users'],
+                           'rc': ['domain=rc', 'member_of_group=Domain Admins.Users']},
+               'refsets': [{'name': 'Fake Set 0', 'sources': ['hq', 'rc'], 'max_delete_fraction': 1},
+                           {'name': 'Fake Set 1', 'sources': ['hq'], 'max_delete_fraction': 1}]}
+    connectors = {'inventory_base_url': 'https://' + host + PLUGIN_API, 'connectors_list_url': 'connectors?fields=query',
+                  'connector_status_url': 'connectors', 'worker_status_url': 'table/status',
+                  'connectors_error_status_url': 'logs/errors', 'zabbix_preffix': 'benchmark', 'SEC': TOKEN, 'exclude': ['none']}
+    for name, content in (('refsets.json', refsets), ('connectors.json', connectors)):
+        with open(os.path.join(workdir, name), 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=2)
+
+
+def control(host, path, method='GET'):
+    request = urllib.request.Request('https://' + host + path, method=method, data=b'' if method == 'POST' else None)
+    with urllib.request.urlopen(request, context=ssl._create_unverified_context()) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def start_server(server_args):
+    process = subprocess.Popen([sys.executable, FAKE_SERVER, '--port', '0'] + shlex.split(server_args),
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('Listening on'):
+        process.kill()
+        raise RuntimeError('Fake server did not start: ' + line)
+    return process, line.strip().rsplit('//', 1)[1]
+
+
+def run(name, script, arguments, env, host, workdir, timeout):
+    """Run one script as a child process and return its measurements."""
+    # Scripts derive their log/config names from argv[0], so they are started through a link in workdir
+    link = os.path.join(workdir, os.path.basename(script))
+    if not os.path.exists(link):
+        os.symlink(script, link)
+    control(host, '/__reset', 'POST')
+    child_env = dict(os.environ, **env)
+    child_env['PYTHONPATH'] = os.path.dirname(script) + os.pathsep + child_env.get('PYTHONPATH', '')
+    stderr_file = tempfile.TemporaryFile()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.basename(script)] + arguments, cwd=workdir, env=child_env,
+                               stdout=subprocess.DEVNULL, stderr=stderr_file)
+    deadline = started + timeout
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.perf_counter() > deadline:
+            process.kill()
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        time.sleep(0.01)
+    wall = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    stderr_file.seek(0)
+    stderr = stderr_file.read().decode('utf-8', 'replace').strip().splitlines()
+    stderr_file.close()
+    stats = control(host, '/__stats')
+    return {'scenario': name,
+            'returncode': process.returncode,
+            'wall_s': round(wall, 3),
+            'requests': stats['requests'],
+            'requests_per_s': round(stats['requests'] / wall, 1) if wall else 0,
+            'bytes_out': stats['bytes_out'],
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': round(usage.ru_maxrss / 1024.0, 1),
+            'error': stderr[-1] if process.returncode and stderr else ''}
+
+
+def print_report(results):
+    print('{:<22} {:>4} {:>9} {:>9} {:>10} {:>10}'.format('scenario', 'rc', 'wall, s', 'requests', 'req/s', 'RSS, MB'))
+    for r in results:
+        print('{:<22} {:>4} {:>9.3f} {:>9} {:>10.1f} {:>10.1f}'.format(
+            r['scenario'], r['returncode'], r['wall_s'], r['requests'], r['requests_per_s'], r['peak_rss_mb']))
+        if r['error']:
+            print('    ' + r['error'])
+
+
+def compare(results, baseline_file, threshold):
+    with open(baseline_file, mode='r', encoding='utf-8') as f:
+        baseline = {item['scenario']: item for item in json.load(f)}
+    regressions = []
+    for r in results:
+        before = baseline.get(r['scenario'])
+        if not before or r['returncode'] or before['returncode']:
+            continue
+        for key in ('wall_s', 'peak_rss_mb'):
+            if before[key] and r[key] > before[key] * (1 + threshold):
+                regressions.append(r['scenario'])
+                print('REGRESSION {} {}: {} -> {}'.format(r['scenario'], key, before[key], r[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the scripts against the fake QRadar server and measure them')
+    parser.add_argument('--only', nargs='*', help='scenarios to run, all by default')
+    parser.add_argument('--server-args', dest='server_args', default='',
+                        help='arguments for fake_qradar.py (data sizes, latency, errors)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every scenario, the fastest one is reported')
+    parser.add_argument('--timeout', type=float, default=600, help='timeout of one run, s')
+    parser.add_argument('--save', help='save results as JSON')
+    parser.add_argument('--baseline', help='JSON file with previous results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative growth of wall time and RSS')
+    args = parser.parse_args()
+
+    server, host = start_server(args.server_args)
+    workdir = tempfile.mkdtemp(prefix='qradar_bench')
+    results = []
+    try:
+        write_configs(host, workdir)
+        for name, script, arguments, env in scenarios(host, workdir):
+            if args.only and name not in args.only:
+                continue
+            runs = [run(name, script, arguments, env, host, workdir, args.timeout) for _ in range(args.repeat)]
+            results.append(min(runs, key=lambda r: r['wall_s']))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_report(results)
+    if args.save:
+        with open(args.save, mode='w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        exit(1)
+    exit(0)
+
+
+if __name__ == '__main__':
+    main()
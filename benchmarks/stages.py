@@ -0,0 +1,231 @@
+#!/bin/python
+# stages
+# Micro-benchmarks of the parsing and serialisation stages of qapi-export.py without the network
+#
+# Synthetic answers of networks, assets with N properties, reference tables with DATE columns
+# and Ariel event pages are built with the generators of fake_qradar.py, projected to the API fields the
+# export requests (as fake_qradar.py does for fields=), and put through
+# JsonStream (decoding of the answer by chunks), RestApiClient.parse_json, save_csv, load_csv, jsonify and getips.
+# Every stage is run twice: for rows per second and under tracemalloc for the peak memory and the memory
+# kept by its result. JsonStream is also checked against json.loads with chunks cut at every position
+# of a short answer, the run fails if they differ.
+#
+# Usage:
+#       >   python3 benchmarks/stages.py
+#       >   python3 benchmarks/stages.py --rows 100000 --asset-properties 50 --only assets reftable
+#       >   python3 benchmarks/stages.py --save stages.json, later --baseline stages.json to catch regressions
+#
+import argparse
+import gc
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QAPI_EXPORT = os.path.join(REPO_ROOT, 'network-hierarchy-to-elk', 'qapi-export.py')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+import fake_qradar
+
+OBJECTS = ['networks', 'assets', 'reftable', 'events']
+# Rows of the answer decoded by JsonStream with chunks of every size up to CHECK_CHUNK
+CHECK_ROWS = 20
+CHECK_CHUNK = 16
+# Numbers in the arrays and objects of the first two levels are decoded one by one, a chunk can end inside them
+CHECK_NUMBERS = '{"data": [1.5, -2.25e-3, 1E+5, 10, 0.125, true, null], "ratio": 0.75, "total": 12}'
+
+
+def load_qapi_export():
+    # The file name has a dash, so it is loaded by path
+    spec = importlib.util.spec_from_file_location('qapi_export', QAPI_EXPORT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def payload(data, objects, rows, fields=''):
+    """JSON answer of the export API for objects with the fields= projection"""
+    if objects == 'networks':
+        answer = [data.network(i) for i in range(rows)]
+    elif objects == 'assets':
+        answer = [data.asset(i) for i in range(rows)]
+    elif objects == 'reftable':
+        table = data.table(rows, data.args.table_columns)
+        answer = dict(table, name='Fake Table', number_of_elements=rows)
+    else:
+        answer = {'events': [data.event(i) for i in range(rows)]}
+    if fields:
+        answer = fake_qradar.project(answer, fake_qradar.parse_fields(fields))
+    return json.dumps(answer)
+
+
+def clients(qapi, data, objects, logger):
+    """(export client, import client or None) with the metadata of the synthetic data instead of API calls"""
+    table = data.table(1, data.args.table_columns)
+    qapi.RestApiClient.get_asset_properties = lambda self: data.properties
+    qapi.RestApiClient.get_ref_fields = lambda self, refname: [table]
+    found = {(endpoint['object'], endpoint['method']): endpoint for endpoint in qapi.endpoints}
+    export = qapi.RestApiClient('localhost', 'token', found[(objects, 'export')], logger, refname='Fake Table')
+    endpoint = found.get((objects, 'import'))
+    imported = qapi.RestApiClient('localhost', 'token', endpoint, logger, refname='Fake Table') if endpoint else None
+    return export, imported
+
+
+def check_stream(qapi, answer):
+    """Chunk sizes for which JsonStream decodes the answer not as json.loads does"""
+    expected = json.loads(answer)
+    encoded = answer.encode('utf-8')
+    failed = []
+    for size in range(1, CHECK_CHUNK + 1):
+        try:
+            same = qapi.JsonStream([encoded[first:first + size] for first in range(0, len(encoded), size)]).decode() == expected
+        except ValueError:
+            same = False
+        if not same:
+            failed.append(size)
+    return failed
+
+
+def stages(qapi, export, imported, objects, answer, filename):
+    """(stage, setup, function) of every stage, the functions run on the state left by the previous stages"""
+    loaded = {}
+
+    def stream():
+        chunks = [encoded[first:first + qapi.STREAM_CHUNK] for first in range(0, len(encoded), qapi.STREAM_CHUNK)]
+        qapi.JsonStream(chunks).decode()
+
+    def parse():
+        export.result = answer
+        export.parse_json(objects)
+
+    def load():
+        imported.load_csv(filename)
+        loaded['rows'] = imported.dict
+
+    def rows():
+        # jsonify replaces the rows with API objects, every run starts from the loaded CSV again
+        imported.dict = loaded['rows']
+
+    def getips():
+        for asset in assets:
+            export.getips(asset.get('interfaces') or [])
+
+    assets = json.loads(answer) if objects == 'assets' else []
+    encoded = answer.encode('utf-8')
+    result = [('JsonStream', None, stream), ('parse_json', None, parse), ('save_csv', None, lambda: export.save_csv(filename))]
+    if imported:
+        result += [('load_csv', None, load), ('jsonify', rows, lambda: imported.jsonify(objects))]
+    if objects == 'assets':
+        result.append(('getips', None, getips))
+    return result
+
+
+def measure(setup, function, memory):
+    if setup:
+        setup()
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    kept = peak = 0
+    if memory:
+        kept, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak, kept
+
+
+def run(qapi, data, objects, rows, repeat, logger):
+    export, imported = clients(qapi, data, objects, logger)
+    answer = payload(data, objects, rows, export.api_fields(objects))
+    handle, filename = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    results = []
+    try:
+        for stage, setup, function in stages(qapi, export, imported, objects, answer, filename):
+            elapsed = min(measure(setup, function, False)[0] for _ in range(repeat))
+            peak, kept = measure(setup, function, True)[1:]
+            results.append({'objects': objects, 'stage': stage, 'rows': rows, 'time_s': round(elapsed, 4),
+                            'rows_per_s': round(rows / elapsed) if elapsed else 0,
+                            'peak_mb': round(peak / 1048576.0, 1), 'kept_mb': round(kept / 1048576.0, 1)})
+    finally:
+        os.remove(filename)
+    return results
+
+
+def print_report(results):
+    print('{:<10} {:<12} {:>9} {:>9} {:>12} {:>9} {:>9}'.format('objects', 'stage', 'rows', 'time, s', 'rows/s', 'peak, MB', 'kept, MB'))
+    for r in results:
+        print('{:<10} {:<12} {:>9} {:>9.3f} {:>12} {:>9.1f} {:>9.1f}'.format(
+            r['objects'], r['stage'], r['rows'], r['time_s'], r['rows_per_s'], r['peak_mb'], r.get('kept_mb', 0)))
+
+
+def compare(results, baseline_file, threshold):
+    with open(baseline_file, mode='r', encoding='utf-8') as f:
+        baseline = {(item['objects'], item['stage']): item for item in json.load(f)}
+    regressions = []
+    for r in results:
+        before = baseline.get((r['objects'], r['stage']))
+        if not before or before['rows'] != r['rows']:
+            continue
+        if r['rows_per_s'] < before['rows_per_s'] * (1 - threshold):
+            regressions.append(r)
+            print('REGRESSION {} {} rows/s: {} -> {}'.format(r['objects'], r['stage'], before['rows_per_s'], r['rows_per_s']))
+        if before['peak_mb'] and r['peak_mb'] > before['peak_mb'] * (1 + threshold):
+            regressions.append(r)
+            print('REGRESSION {} {} peak, MB: {} -> {}'.format(r['objects'], r['stage'], before['peak_mb'], r['peak_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure parse/serialise stages of qapi-export.py on synthetic data')
+    parser.add_argument('--only', nargs='*', choices=OBJECTS, help='object types to measure, all by default')
+    parser.add_argument('--rows', type=int, default=20000, help='rows of every object type')
+    parser.add_argument('--properties', type=int, default=50, help='number of asset properties defined')
+    parser.add_argument('--asset-properties', dest='asset_properties', type=int, default=10, help='number of properties set on each asset')
+    parser.add_argument('--table-columns', dest='table_columns', type=int, default=6, help='columns of the reference table, every third is DATE')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every stage, the fastest one is reported')
+    parser.add_argument('--save', help='save results as JSON')
+    parser.add_argument('--baseline', help='JSON file with previous results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative drop of rows/s and growth of peak memory')
+    args = parser.parse_args()
+
+    qapi = load_qapi_export()
+    logger = logging.getLogger('stages')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    # FakeData builds reference collections eagerly, none of them is needed here
+    data = fake_qradar.FakeData(argparse.Namespace(seed=1, networks=0, properties=args.properties,
+                                                   asset_properties=args.asset_properties, refsets=0, refset_size=0,
+                                                   table_rows=0, table_columns=args.table_columns))
+    results = []
+    broken = []
+    failed = check_stream(qapi, CHECK_NUMBERS)
+    if failed:
+        broken.append('numbers')
+        print('JsonStream decodes numbers differently with chunks of {} bytes'.format(failed))
+    for objects in OBJECTS:
+        if not args.only or objects in args.only:
+            results += run(qapi, data, objects, args.rows, args.repeat, logger)
+            export = clients(qapi, data, objects, logger)[0]
+            failed = check_stream(qapi, payload(data, objects, CHECK_ROWS, export.api_fields(objects)))
+            if failed:
+                broken.append(objects)
+                print('JsonStream decodes {} differently with chunks of {} bytes'.format(objects, failed))
+
+    print_report(results)
+    if args.save:
+        with open(args.save, mode='w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if broken or (args.baseline and compare(results, args.baseline, args.threshold)):
+        exit(1)
+    exit(0)
+
+
+if __name__ == '__main__':
+    main()
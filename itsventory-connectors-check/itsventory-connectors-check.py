@@ -1,16 +1,13 @@
-import psycopg2
-import pypyodbc
 import os
-from dotenv import load_dotenv
-import logging
-import logging.handlers
-from rfc5424logging import Rfc5424SysLogHandler
-import psycopg2.extras
+import sys
 import json
-import pyodbc
 import datetime
 import requests
 
+#throttle.py is shared by the scripts of the repository and lives in its root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import throttle
+
 __author__ = "Georgiy Akhaladze"
 __version__ = "0.1.0"
 __maintainer__ = "Georgiy Akhaladze"
@@ -19,6 +16,10 @@ __status__ = "Prod"
 
 date_now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
+#One connection pool for all the checks, 429/503 of the plugin are retried after Retry-After
+session = requests.Session()
+controller = throttle.Controller()
+
 #Inventory connectors check
 
 #- owerall status of inventory
@@ -28,25 +29,25 @@ date_now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
 
 def load_config():
-    with open('/home/user/soc_scripts/itsventory-connectors-check/config.json', 'r') as conf_data:
+    with open(os.getenv("CONNECTORS_CHECK_CONFIG", '/home/user/soc_scripts/itsventory-connectors-check/config.json'), 'r') as conf_data:
         conf_data = json.load(conf_data)
     return conf_data
 
 def get_connectors_list(inventory_base_url, connectors_list_url, sec):
     url = inventory_base_url + connectors_list_url
-    connectors_list = requests.get(url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+    connectors_list = controller.request(session, "GET", url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
     return connectors_list.json()
     
 def get_connector_status(inventory_base_url, connector_status_url, connector_id, sec):
     url = inventory_base_url + connector_status_url + '/' + connector_id
-    connector_status = requests.get(url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+    connector_status = controller.request(session, "GET", url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
     
     return connector_status.json()
     
 
 def get_connector_error_status(inventory_base_url, connectors_error_status_url, sec):
     url = inventory_base_url + connectors_error_status_url
-    connector_error_status = requests.get(url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+    connector_error_status = controller.request(session, "GET", url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
     return connector_error_status.json()
     
 def search_black_list (con_id, exclude):
@@ -63,7 +64,7 @@ def search_black_list (con_id, exclude):
         
 def get_worker_status(inventory_base_url, worker_status, sec):
     url = inventory_base_url + worker_status
-    worker_status = requests.get(url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+    worker_status = controller.request(session, "GET", url, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
     return worker_status.json()
 
 
@@ -0,0 +1,322 @@
+#!/bin/python
+# netindex
+# Longest-prefix-match index for the QRadar network hierarchy
+#
+# The hierarchy exported by qapi-export.py (CSV, or raw JSON of the networks
+# endpoint) is compiled into sorted arrays of disjoint address intervals, one per
+# address family. Every interval points to the most specific network covering it,
+# so a lookup is one binary search. The index is saved as a compact JSON file and
+# answers single lookups or enriches batches of IPs (e.g. an AQL CSV export).
+#
+# Usage:
+#       >   python3 qapi-export.py export networks --config prod --csv net.csv
+#       >   python3 netindex.py build --csv net.csv --out networks.idx
+#       >   python3 netindex.py lookup --index networks.idx 10.1.2.3 2001:db8::1
+#       >   python3 netindex.py enrich --index networks.idx --csv events.csv --column sourceip --out enriched.csv
+#
+import argparse
+import array
+import base64
+import bisect
+import csv
+import ipaddress
+import json
+import re
+import socket
+import sys
+
+INDEX_VERSION = 1
+RECORD_FIELDS = ['id', 'name', 'cidr', 'group', 'vlan', 'critical', 'wireless']
+
+# Same format of network description as parsed by qapi-export.py
+DESCRIPTION = re.compile(
+    r"^(?P<vlan>\<\d+\>)?\s*(?P<crit>\[Critical VLAN\])?\s*(?P<wf>\[Wireless\])?\s*(?P<address>.*)$")
+
+# 32-bit unsigned typecode for the IPv4 arrays
+V4_TYPECODE = 'I' if array.array('I').itemsize == 4 else 'L'
+
+# Batches smaller than this are searched with bisect, NumPy import costs more than it saves
+NUMPY_MIN_BATCH = 10000
+
+
+def load_numpy():
+    # NumPy is optional and loaded only for big batches
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def ip_to_int(ip):
+    """Address string to (version, integer), faster than ipaddress for bulk use."""
+    if ':' in ip:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    # inet_pton takes only dotted quads, inet_aton would read '10.1' as 10.0.0.1
+    return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+
+
+def network_record(item):
+    """Record of the index from a CSV row or a raw API network object."""
+    record = {field: item.get(field, '') for field in RECORD_FIELDS}
+    if 'vlan' not in item and item.get('description') is not None:
+        m = DESCRIPTION.match(item.get('description'))
+        if m:
+            vlan = m.group('vlan')
+            record['vlan'] = vlan[1:-1] if vlan else ''
+            record['critical'] = 1 if m.group('crit') else 0
+            record['wireless'] = 1 if m.group('wf') else 0
+    return record
+
+
+def flatten(intervals):
+    """Turn properly nested intervals (start, end, idx) into disjoint ones.
+
+    Every resulting interval carries the idx of the most specific (innermost)
+    interval that covers it. For duplicated intervals the first one wins.
+    """
+    intervals.sort(key=lambda x: (x[0], -x[1]))
+    starts, ends, idxs = [], [], []
+
+    def emit(start, end, idx):
+        if start > end:
+            return
+        if ends and ends[-1] + 1 == start and idxs[-1] == idx:
+            ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+            idxs.append(idx)
+
+    stack = []
+    cur = 0
+    for start, end, idx in intervals:
+        while stack and stack[-1][1] < start:
+            top = stack.pop()
+            emit(cur, top[1], top[2])
+            cur = top[1] + 1
+        if stack:
+            if stack[-1][0] == start and stack[-1][1] == end:
+                continue
+            emit(cur, start - 1, stack[-1][2])
+        cur = start
+        stack.append((start, end, idx))
+    while stack:
+        top = stack.pop()
+        emit(cur, top[1], top[2])
+        cur = top[1] + 1
+    return starts, ends, idxs
+
+
+class NetworkIndex:
+    """Sorted interval arrays of IPv4 and IPv6 networks with longest-prefix-match lookups."""
+
+    def __init__(self, records, v4, v6):
+        self.records = records
+        self.v4_starts, self.v4_ends, self.v4_idx = v4
+        self.v6_starts, self.v6_ends, self.v6_idx = v6
+
+    @classmethod
+    def build(cls, networks):
+        """Compile an iterable of network rows/objects with a 'cidr' field."""
+        records = []
+        intervals = {4: [], 6: []}
+        for item in networks:
+            try:
+                net = ipaddress.ip_network(item.get('cidr', '').strip(), strict=False)
+            except ValueError:
+                continue
+            intervals[net.version].append((int(net.network_address), int(net.broadcast_address), len(records)))
+            records.append(network_record(item))
+        v4 = flatten(intervals[4])
+        v4 = (array.array(V4_TYPECODE, v4[0]), array.array(V4_TYPECODE, v4[1]), array.array('I', v4[2]))
+        v6 = flatten(intervals[6])
+        v6 = (v6[0], v6[1], array.array('I', v6[2]))
+        return cls(records, v4, v6)
+
+    def find(self, ip):
+        """Index of the most specific network record containing ip, -1 if there is none."""
+        try:
+            version, value = ip_to_int(ip)
+        except (OSError, ValueError):
+            return -1
+        if version == 4:
+            starts, ends, idxs = self.v4_starts, self.v4_ends, self.v4_idx
+        else:
+            starts, ends, idxs = self.v6_starts, self.v6_ends, self.v6_idx
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return idxs[i]
+        return -1
+
+    def lookup(self, ip):
+        """Most specific network record containing ip, None if there is none."""
+        idx = self.find(ip)
+        return self.records[idx] if idx >= 0 else None
+
+    def lookup_many(self, ips):
+        """Record indexes (or -1) for a list of IP strings, in the same order.
+
+        IPv4 addresses are converted once and searched in bulk, with NumPy when
+        it is installed; invalid addresses give -1.
+        """
+        result = [-1] * len(ips)
+        v4_pos, v4_values = [], []
+        inet_pton, from_bytes, family = socket.inet_pton, int.from_bytes, socket.AF_INET
+        for pos, ip in enumerate(ips):
+            if ':' in ip:
+                result[pos] = self.find(ip)
+                continue
+            try:
+                v4_values.append(from_bytes(inet_pton(family, ip), 'big'))
+                v4_pos.append(pos)
+            except (OSError, TypeError):
+                pass
+        if not v4_values or not len(self.v4_starts):
+            return result
+        numpy = load_numpy() if len(v4_values) >= NUMPY_MIN_BATCH else None
+        if numpy is not None:
+            dtype = 'u{}'.format(self.v4_starts.itemsize)
+            starts = numpy.frombuffer(self.v4_starts, dtype=dtype)
+            ends = numpy.frombuffer(self.v4_ends, dtype=dtype)
+            idxs = numpy.frombuffer(self.v4_idx, dtype='u{}'.format(self.v4_idx.itemsize)).astype(numpy.int64)
+            values = numpy.array(v4_values, dtype=dtype)
+            i = numpy.searchsorted(starts, values, side='right') - 1
+            clipped = numpy.maximum(i, 0)
+            found = numpy.where((i >= 0) & (values <= ends[clipped]), idxs[clipped], -1)
+            for pos, idx in zip(v4_pos, found.tolist()):
+                result[pos] = idx
+        else:
+            starts, ends, idxs = self.v4_starts, self.v4_ends, self.v4_idx
+            bisect_right = bisect.bisect_right
+            for pos, value in zip(v4_pos, v4_values):
+                i = bisect_right(starts, value) - 1
+                if i >= 0 and value <= ends[i]:
+                    result[pos] = idxs[i]
+        return result
+
+    def save(self, filename):
+        content = {'version': INDEX_VERSION,
+                   'records': self.records,
+                   'v4': {name: base64.b64encode(self.portable(values)).decode('ascii')
+                          for name, values in (('starts', self.v4_starts), ('ends', self.v4_ends), ('idx', self.v4_idx))},
+                   'v6': {'starts': ['{:x}'.format(v) for v in self.v6_starts],
+                          'ends': ['{:x}'.format(v) for v in self.v6_ends],
+                          'idx': list(self.v6_idx)}}
+        with open(filename, mode='w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, mode='r', encoding='utf-8') as f:
+            content = json.load(f)
+        if content.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported index version {}'.format(content.get('version')))
+        v4 = tuple(cls.native(base64.b64decode(content['v4'][name]), typecode)
+                   for name, typecode in (('starts', V4_TYPECODE), ('ends', V4_TYPECODE), ('idx', 'I')))
+        v6 = ([int(v, 16) for v in content['v6']['starts']], [int(v, 16) for v in content['v6']['ends']],
+              array.array('I', content['v6']['idx']))
+        return cls(content['records'], v4, v6)
+
+    @staticmethod
+    def portable(values):
+        # Arrays are stored little-endian whatever the platform is
+        if sys.byteorder != 'little':
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+
+    @staticmethod
+    def native(data, typecode):
+        values = array.array(typecode)
+        values.frombytes(data)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def __len__(self):
+        return len(self.records)
+
+
+def load_networks(csv_filename=None, json_filename=None, separator=','):
+    if json_filename:
+        with open(json_filename, mode='r', encoding='utf-8') as f:
+            return json.load(f)
+    with open(csv_filename, mode='r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f, delimiter=separator))
+
+
+def enrich(index, in_filename, out_filename, column, separator=',', batch_size=100000):
+    """Add the fields of the containing network to every row of a CSV, batch by batch."""
+    added = ['network_' + field for field in RECORD_FIELDS]
+    empty = [''] * len(RECORD_FIELDS)
+    rows_total = matched = 0
+    with open(in_filename, mode='r', encoding='utf-8', newline='') as src, \
+            open(out_filename, mode='w', encoding='utf-8', newline='') as dst:
+        reader = csv.reader(src, delimiter=separator)
+        header = next(reader)
+        if column not in header:
+            raise ValueError('Column {} is not found in {}'.format(column, in_filename))
+        position = header.index(column)
+        writer = csv.writer(dst, delimiter=separator)
+        writer.writerow(header + added)
+        values = [[index.records[i].get(field, '') for field in RECORD_FIELDS] for i in range(len(index.records))]
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                matched += write_batch(index, writer, batch, position, values, empty)
+                rows_total += len(batch)
+                batch = []
+        if batch:
+            matched += write_batch(index, writer, batch, position, values, empty)
+            rows_total += len(batch)
+    return rows_total, matched
+
+
+def write_batch(index, writer, batch, position, values, empty):
+    found = index.lookup_many([row[position] if position < len(row) else '' for row in batch])
+    writer.writerows(row + (values[idx] if idx >= 0 else empty) for row, idx in zip(batch, found))
+    return sum(1 for idx in found if idx >= 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query the longest-prefix-match index of the network hierarchy')
+    parser.add_argument('operation', help='build, lookup, enrich')
+    parser.add_argument('ips', nargs='*', help='IP addresses to look up')
+    parser.add_argument('--csv', dest='csv_filename', help='networks CSV for build, rows to enrich for enrich')
+    parser.add_argument('--json', dest='json_filename', help='networks JSON (qapi-export --json) for build')
+    parser.add_argument('--index', dest='index_filename', help='index file to use')
+    parser.add_argument('--out', dest='out_filename', help='output file: index for build, CSV for enrich')
+    parser.add_argument('--column', dest='column', default='sourceip', help='IP column of the CSV to enrich. Default - sourceip')
+    parser.add_argument('-t', dest='tab', action='store_true', help='use <TAB> as separator in CSV')
+    args = parser.parse_intermixed_args()
+    separator = '\t' if args.tab else ','
+
+    if args.operation == 'build':
+        if not (args.csv_filename or args.json_filename) or not args.out_filename:
+            parser.error('build needs --csv or --json and --out')
+        index = NetworkIndex.build(load_networks(args.csv_filename, args.json_filename, separator))
+        index.save(args.out_filename)
+        print('{} networks, {} IPv4 and {} IPv6 intervals saved to {}'.format(
+            len(index), len(index.v4_starts), len(index.v6_starts), args.out_filename))
+    elif args.operation == 'lookup':
+        if not args.index_filename:
+            parser.error('lookup needs --index')
+        index = NetworkIndex.load(args.index_filename)
+        for ip in args.ips or [line.strip() for line in sys.stdin if line.strip()]:
+            record = index.lookup(ip)
+            print('{}\t{}'.format(ip, json.dumps(record, ensure_ascii=False) if record else '-'))
+    elif args.operation == 'enrich':
+        if not (args.index_filename and args.csv_filename and args.out_filename):
+            parser.error('enrich needs --index, --csv and --out')
+        index = NetworkIndex.load(args.index_filename)
+        rows, matched = enrich(index, args.csv_filename, args.out_filename, args.column, separator)
+        print('{} rows enriched, {} matched a network'.format(rows, matched))
+    else:
+        parser.error('Unknown operation ' + args.operation)
+    exit(0)
+
+
+if __name__ == '__main__':
+    main()
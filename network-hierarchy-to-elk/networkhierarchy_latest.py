@@ -1,26 +1,131 @@
 import csv
 import elasticsearch
+import elasticsearch.helpers
 import datetime
+import ipaddress
 import subprocess
 
 es = elasticsearch.Elasticsearch([{'host':'localhost', 'port':'9200'}])
 date_now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S+02:00')
 
 csvFilePath = 'net.csv'
+indexName = 'networkhierarchy_latest'
 
-subprocess.call(['python3', 'qapi-export.py', 'export', 'networks', '--host', 'siem.domain.com', '--token', 'TTTTTOOOOKKKEEENNN', '--csv', f'{csvFilePath}'])
+# Explicit mapping: "which network contains this IP" is a term query on the ip_range field
+# {"query": {"term": {"cidr": "10.1.2.3"}}, "sort": [{"prefix_length": "desc"}], "size": 1}
+indexTemplate = {
+    'index_patterns': [indexName],
+    'template': {
+        'settings': {'number_of_shards': 1},
+        'mappings': {
+            'dynamic': False,
+            'properties': {
+                '@timestamp': {'type': 'date'},
+                'id': {'type': 'long'},
+                'name': {'type': 'keyword'},
+                'cidr': {'type': 'ip_range'},
+                'cidr_text': {'type': 'keyword'},
+                'ip_version': {'type': 'byte'},
+                'prefix_length': {'type': 'short'},
+                'first_ip': {'type': 'ip'},
+                'last_ip': {'type': 'ip'},
+                'parent_id': {'type': 'long'},
+                'parent_cidr': {'type': 'keyword'},
+                'parent_name': {'type': 'keyword'},
+                'depth': {'type': 'short'},
+                'country_code': {'type': 'keyword'},
+                'group': {'type': 'keyword'},
+                'group_levels': {'type': 'keyword'},
+                'group_depth': {'type': 'short'},
+                'location': {'type': 'geo_point'},
+                'coord_x': {'type': 'float'},
+                'coord_y': {'type': 'float'},
+                'description': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}},
+                'address': {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}},
+                'vlan': {'type': 'integer'},
+                'critical': {'type': 'boolean'},
+                'wireless': {'type': 'boolean'},
+            }
+        }
+    }
+}
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_document(row):
+    # Typed document from a CSV row of qapi-export.py
+    doc = {'@timestamp': date_now, 'name': row.get('name'), 'cidr_text': row.get('cidr'),
+           'country_code': row.get('country_code') or None, 'description': row.get('description'),
+           'address': row.get('address'), 'critical': row.get('critical') == '1', 'wireless': row.get('wireless') == '1'}
+    if row.get('id'):
+        doc['id'] = int(row['id'])
+    if row.get('vlan'):
+        doc['vlan'] = int(row['vlan'])
+
+    network = ipaddress.ip_network(row.get('cidr', '').strip(), strict=False)
+    doc['cidr'] = str(network)
+    doc['ip_version'] = network.version
+    doc['prefix_length'] = network.prefixlen
+    doc['first_ip'] = str(network.network_address)
+    doc['last_ip'] = str(network.broadcast_address)
+
+    group = row.get('group') or ''
+    levels = group.split('.') if group else []
+    doc['group'] = group
+    doc['group_levels'] = ['.'.join(levels[:n + 1]) for n in range(len(levels))]
+    doc['group_depth'] = len(levels)
 
-data = {}
+    x, y = to_float(row.get('coord_x')), to_float(row.get('coord_y'))
+    doc['coord_x'], doc['coord_y'] = x, y
+    if x or y:
+        # QRadar keeps GeoJSON order: x is longitude, y is latitude
+        doc['location'] = {'lon': x, 'lat': y}
+    return doc, network
+
+
+def assign_parents(docs):
+    # Parent is the smallest other network containing the CIDR, found with one sweep over sorted intervals.
+    # Networks with the same CIDR are siblings, subnet_of is true for equal networks too.
+    order = sorted(range(len(docs)), key=lambda i: (docs[i][1].version, int(docs[i][1].network_address), -docs[i][1].num_addresses))
+    stack = []
+    for i in order:
+        doc, network = docs[i]
+        while stack and not (docs[stack[-1]][1].version == network.version and docs[stack[-1]][1] != network
+                             and network.subnet_of(docs[stack[-1]][1])):
+            stack.pop()
+        if stack:
+            parent = docs[stack[-1]][0]
+            doc['parent_id'] = parent.get('id')
+            doc['parent_cidr'] = parent['cidr']
+            doc['parent_name'] = parent['name']
+        doc['depth'] = len(stack)
+        stack.append(i)
+
+
+subprocess.call(['python3', 'qapi-export.py', 'export', 'networks', '--host', 'siem.domain.com', '--token', 'TTTTTOOOOKKKEEENNN', '--csv', f'{csvFilePath}'])
 
 try:
-    es.indices.delete(index='networkhierarchy_latest')
+    es.indices.delete(index=indexName)
 except:
     print ('wow')
 
+es.indices.put_index_template(name=indexName, body=indexTemplate)
+
+docs = []
 with open(csvFilePath) as csvFile:
     csvReader = csv.DictReader(csvFile)
     for rows in csvReader:
-        data.update(rows)
-        data.update({'@timestamp': date_now})
-        es.index(index='networkhierarchy_latest', body=data)
+        try:
+            docs.append(to_document(rows))
+        except ValueError as e:
+            print ('Skipped network {}: {}'.format(rows.get('cidr'), e))
+
+assign_parents(docs)
 
+elasticsearch.helpers.bulk(es, ({'_index': indexName, '_source': doc} for doc, network in docs))
@@ -7,8 +7,9 @@
 #
 # Prerequisites for script
 # 1. Install Python 3.6.5 or later
-# 2. Add requests, tabulate modules:
+# 2. Add requests, tabulate modules (tabulate is needed only for --screen, pyarrow only for --parquet):
 #       >   pip install requests tabulate
+#       >   pip install pyarrow
 # 3. Create the configuration file with the same name and .conf extention
 # 4. Use command line parameters or configuration file:
 #       QRADAR_IP = IBM QRadar SIEM server
@@ -16,33 +17,59 @@
 # 5. See the inline help with -h
 #
 # DONE: Add Delete operation for reftable objects
+# DONE: Flatten assets through a property-to-column map, --ip to choose the exported IP
+# DONE: Concurrent rate-limited import of assets, unchanged assets are skipped, --report with results
+# DONE: Networks import checks CIDRs and is skipped when the hierarchy is not changed (--force to stage anyway)
+# DONE: Add saving the last API request and all the data and restoring from lost position (--checkpoint, --resume)
+# DONE: DATE fields of reference tables are converted by columns with caching
+# DONE: CSV import is a pipeline of batches (read, convert, send), the file is not loaded into memory
+# DONE: Reference tables can be read from the local SQLite mirror of refmirror.py (--mirror)
+# DONE: Export from several consoles at once (--config hq,region or --config all), rows are tagged with the console
+# DONE: Requests are limited by the adaptive concurrency controller of throttle.py (--limits)
+# DONE: Profiling of the run by phases with cProfile, sampling or tracemalloc (--profile, see runprofile.py)
+# DONE: Telemetry of the API requests with latency histograms by endpoint (--metrics, JSON or Prometheus)
+# DONE: Operation "count": one item is requested and the total is read from Content-Range, reference data by number_of_elements
+# DONE: Only the API fields of the output columns are requested, filter is applied locally where the API does not take it
+# DONE: Answers are requested compressed and decoded while they arrive, without the text of the whole answer
+# DONE: Export of RefSet, RefMap, RefMapSet elements by pages to CSV, JSON Lines or Parquet, several collections at once
 # DONE: Add TAB separator to CSV
 # DONE: Added RefTables and RefTable objects
 #
 # TODO: Modify filter and fields functionality to be able to operate on incapsulated json parameters
 # TODO: Add Logsources operations
-# TODO: Add operation "count"
 # TODO: Add LSGroups operations
-# TODO: Add RefSets, RefMaps, RefMapSets operations. For them add Ref:_name_ notations as well
+# TODO: Add Ref:_name_ notations for reference data
 # TODO: Add AQL requests from command line
-# TODO: Add saving the last API request and all the data and restoring from lost position
 # TODO: Add Module wrapper for all options
 #
 import argparse
+import codecs
 import csv
 import json
 import logging
+import os
 import requests
-import socket
 import configparser
 import sys
 import datetime
+import ipaddress
 import time
+import threading
+import concurrent.futures
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
 import re
-from tabulate import tabulate
+import socket
+import atexit
+import functools
+import operator
+import itertools
 from http.client import responses
 
+# throttle.py is shared by the scripts of the repository and lives in its root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import throttle
+
 # Ignore SSL-warnings
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -58,15 +85,13 @@ endpoints = [{
     'object': 'networks',
     'method': 'export',
     'endpoint': 'config/network_hierarchy/networks',
-    'fields': ['id', 'name', 'cidr', 'country_code', 'description', 'group', 'coord_x', 'coord_y', 'vlan', 'critical', 'wireless', 'address'],
-    'filter_fields': ['id', 'name', 'cidr', 'country_code', 'description', 'group']
+    'fields': ['id', 'name', 'cidr', 'country_code', 'group', 'coord_x', 'coord_y', 'description', 'vlan', 'critical', 'wireless', 'address']
 },
     {
     'object': 'assets',
     'method': 'export',
     'endpoint': 'asset_model/assets',
-    'fields': ['id', 'IP'],
-    'filter_fields': ['id', 'IP']
+    'fields': ['id', 'IP']
 },
     {
     'object': 'networks',
@@ -119,6 +144,30 @@ endpoints = [{
     'fields': ['name', 'type', 'elements'],
     'id': 'name',
     'http': 'GET'
+},
+    {
+    'object': 'refset',
+    'method': 'export',
+    'endpoint': 'reference_data/sets/{id}',
+    'fields': ['value', 'source', 'first_seen', 'last_seen'],
+    'id': 'name',
+    'http': 'GET'
+},
+    {
+    'object': 'refmap',
+    'method': 'export',
+    'endpoint': 'reference_data/maps/{id}',
+    'fields': ['key', 'value', 'source', 'first_seen', 'last_seen'],
+    'id': 'name',
+    'http': 'GET'
+},
+    {
+    'object': 'refmapset',
+    'method': 'export',
+    'endpoint': 'reference_data/map_of_sets/{id}',
+    'fields': ['key', 'value', 'source', 'first_seen', 'last_seen'],
+    'id': 'name',
+    'http': 'GET'
 },
     {
     'object': 'reftable',
@@ -142,9 +191,162 @@ endpoints = [{
     'endpoint': 'ariel/searches',
     'fields': [],
     'http': 'GET'
+},
+    {
+    'object': 'networks',
+    'method': 'count',
+    'endpoint': 'config/network_hierarchy/networks?fields=id',
+    'fields': ['objects', 'name', 'count'],
+    'http': 'GET'
+},
+    {
+    'object': 'assets',
+    'method': 'count',
+    'endpoint': 'asset_model/assets?fields=id',
+    'fields': ['objects', 'name', 'count'],
+    'http': 'GET'
+},
+    {
+    'object': 'reftables',
+    'method': 'count',
+    'endpoint': 'reference_data/tables?fields=name',
+    'fields': ['objects', 'name', 'count'],
+    'http': 'GET'
+},
+    {
+    'object': 'refsets',
+    'method': 'count',
+    'endpoint': 'reference_data/sets?fields=name',
+    'fields': ['objects', 'name', 'count'],
+    'http': 'GET'
+},
+    {
+    'object': 'refmaps',
+    'method': 'count',
+    'endpoint': 'reference_data/maps?fields=name',
+    'fields': ['objects', 'name', 'count'],
+    'http': 'GET'
+},
+    {
+    'object': 'refmapsets',
+    'method': 'count',
+    'endpoint': 'reference_data/map_of_sets?fields=name',
+    'fields': ['objects', 'name', 'count'],
+    'http': 'GET'
+},
+    {
+    'object': 'reftable',
+    'method': 'count',
+    'endpoint': 'reference_data/tables/{id}?fields=number_of_elements',
+    'listing': 'reference_data/tables?fields=name,number_of_elements',
+    'fields': ['objects', 'name', 'count'],
+    'id': 'name',
+    'http': 'GET'
+},
+    {
+    'object': 'refset',
+    'method': 'count',
+    'endpoint': 'reference_data/sets/{id}?fields=number_of_elements',
+    'listing': 'reference_data/sets?fields=name,number_of_elements',
+    'fields': ['objects', 'name', 'count'],
+    'id': 'name',
+    'http': 'GET'
+},
+    {
+    'object': 'refmap',
+    'method': 'count',
+    'endpoint': 'reference_data/maps/{id}?fields=number_of_elements',
+    'listing': 'reference_data/maps?fields=name,number_of_elements',
+    'fields': ['objects', 'name', 'count'],
+    'id': 'name',
+    'http': 'GET'
+},
+    {
+    'object': 'refmapset',
+    'method': 'count',
+    'endpoint': 'reference_data/map_of_sets/{id}?fields=number_of_elements',
+    'listing': 'reference_data/map_of_sets?fields=name,number_of_elements',
+    'fields': ['objects', 'name', 'count'],
+    'id': 'name',
+    'http': 'GET'
 }]
 
-asset_property_names = []
+# Ways to choose the value of the IP column of assets
+IP_SELECT = ['first', 'all', 'ipv4']
+
+# Answers after which an asset update is sent again
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Rows in one batch of the import pipeline when --page-size is not set
+BATCH_SIZE = 1000
+
+# Reference data fields with decimal comma in CSV
+DECIMAL_COMMA_FIELDS = ['Average window', 'Average MB rate']
+
+# Columns of exported networks, vlan, critical, wireless and address are parsed from the description
+NETWORK_COLUMNS = ['id', 'name', 'cidr', 'country_code', 'group', 'coord_x', 'coord_y', 'description',
+                   'vlan', 'critical', 'wireless', 'address']
+NETWORK_DESCRIPTION = re.compile(
+    r"^(?P<vlan>\<\d+\>)?\s*(?P<crit>\[Critical VLAN\])?\s*(?P<wf>\[Wireless\])?\s*(?P<address>.*)$")
+
+# Columns of the lists of reference collections and the API fields they are taken from
+LISTING_COLUMNS = [('name', 'name'), ('type', 'element_type'), ('elements', 'number_of_elements')]
+
+# API fields of the output columns with other names, the other columns are API fields of the same name
+# and the columns of asset properties are taken from ASSET_PROPERTY_FIELDS. Objects missing here are not projected.
+LISTING_FIELDS = {'type': 'element_type', 'elements': 'number_of_elements'}
+EXPORT_FIELDS = {
+    'networks': {'coord_x': 'location', 'coord_y': 'location', 'vlan': 'description', 'critical': 'description',
+                 'wireless': 'description', 'address': 'description'},
+    'assets': {'id': 'id', 'IP': 'interfaces(ip_addresses(value))'},
+    'reftables': LISTING_FIELDS,
+    'refsets': LISTING_FIELDS,
+    'refmaps': LISTING_FIELDS,
+    'refmapsets': LISTING_FIELDS
+}
+ASSET_PROPERTY_FIELDS = 'properties(name,value)'
+
+# Reference collections exported by elements, first_seen/last_seen are dates in all of them
+ELEMENT_OBJECTS = ['refset', 'refmap', 'refmapset']
+ELEMENT_DATE_FIELDS = ['first_seen', 'last_seen']
+# Range window of the element export when --page-size is not set
+ELEMENT_PAGE_SIZE = 10000
+
+# Objects whose API does not take filter, the answer is filtered by the script
+LOCAL_FILTER_OBJECTS = ['networks']
+
+# Tokens of the filters applied by the script: string, number, comparison, name, bracket or comma
+FILTER_TOKEN = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|\'([^\']*)\'|(-?\d+(?:\.\d+)?)(?![\w.])|(<=|>=|!=|<>|=|<|>)|([A-Za-z_][\w.]*)|([(),]))')
+FILTER_COMPARISONS = {'=': operator.eq, '!=': operator.ne, '<>': operator.ne, '<': operator.lt, '>': operator.gt,
+                      '<=': operator.le, '>=': operator.ge}
+
+# Compression of the answers, decompressed by urllib3 chunk by chunk
+ACCEPT_ENCODING = 'gzip, deflate'
+# Bytes of the answer read at once by the JSON stream decoder
+STREAM_CHUNK = 65536
+JSON_SPACE = re.compile(r'[ \t\n\r]*')
+# Characters that can follow a part of a number, never a whole one
+JSON_NUMBER_TAIL = '.eE+-0123456789'
+
+# Upper bounds of the latency histograms of --metrics, s
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+# Profiler of the run, set by --profile
+profiler = None
+
+
+def phased(name):
+    """Time of the method is counted in the phase of the --profile report, nothing is done without --profile"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if profiler is None:
+                return function(*args, **kwargs)
+            with profiler.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
 
 
 def not_implemented(logger):
@@ -156,8 +358,721 @@ def error(logger, message):
     exit(1)
 
 
+def cidr_interval(cidr):
+    """(version, first, last) addresses of CIDR as integers, ValueError if it is not valid"""
+    address, _, prefix = cidr.strip().partition('/')
+    if ':' not in address and prefix.isdigit() and int(prefix) <= 32:
+        # Fast path for IPv4, ipaddress is used for everything else
+        try:
+            first = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+        except OSError:
+            raise ValueError('Invalid CIDR ' + cidr)
+        size = 1 << (32 - int(prefix))
+        first &= ~(size - 1)
+        return 4, first, first + size - 1
+    net = ipaddress.ip_network(cidr.strip(), strict=False)
+    first = int(net.network_address)
+    return net.version, first, first + net.num_addresses - 1
+
+
+def check_networks(networks):
+    """Find invalid, duplicate and nested CIDRs of the network hierarchy.
+    CIDRs are sorted as intervals once, nesting is found with one sweep over them.
+    Returns lists of invalid networks, pairs of duplicates and pairs of (outer, nested) networks."""
+    intervals = []
+    invalid = []
+    for network in networks:
+        try:
+            version, first, last = cidr_interval(str(network.get('cidr')))
+        except ValueError:
+            invalid.append(network)
+            continue
+        intervals.append((version, first, last, network))
+    intervals.sort(key=lambda interval: (interval[0], interval[1], -interval[2]))
+    duplicates = []
+    overlaps = []
+    stack = []
+    previous = None
+    for interval in intervals:
+        version, first, last, network = interval
+        if previous and previous[:3] == interval[:3]:
+            duplicates.append((previous[3], network))
+            continue
+        while stack and (stack[-1][0] != version or stack[-1][2] < first):
+            stack.pop()
+        if stack:
+            overlaps.append((stack[-1][3], network))
+        stack.append(interval)
+        previous = interval
+    return invalid, duplicates, overlaps
+
+
+def network_state(network):
+    # Fields of a network that are set by the import, in comparable form
+    location = network.get('location') or {}
+    return (network.get('name'), str(network.get('cidr')).strip(), network.get('country_code') or None, network.get('group'),
+            tuple(float(c) for c in location.get('coordinates') or ()), network.get('description') or '')
+
+
+def diff_networks(current, new):
+    """Ids of added, removed and changed networks of the new hierarchy"""
+    current = {network.get('id'): network_state(network) for network in current}
+    new = {network.get('id'): network_state(network) for network in new}
+    added = [id for id in new if id not in current]
+    removed = [id for id in current if id not in new]
+    changed = [id for id in new if id in current and new[id] != current[id]]
+    return added, removed, changed
+
+
+def filter_value(item, names):
+    """Value of the dotted field of the item, None if it is missing"""
+    for name in names:
+        if not isinstance(item, dict):
+            return None
+        item = item.get(name)
+    return item
+
+
+def filter_test(names, compare, value):
+    """Test of one comparison, text of the item is compared as a number with numbers and numbers as text with text"""
+    def test(item):
+        current = filter_value(item, names)
+        if isinstance(value, (int, float)) and isinstance(current, str):
+            try:
+                current = float(current)
+            except ValueError:
+                return False
+        elif isinstance(value, str) and isinstance(current, (int, float)):
+            current = str(current)
+        try:
+            return compare(current, value)
+        except TypeError:
+            return False
+    return test
+
+
+def compile_filter(text):
+    """Predicate of the items for a filter in the syntax of the QRadar API: comparisons =, !=, <, >, <=, >=,
+    in (...), between ... and ..., is [not] null joined by and, or, not and brackets. Dotted names are
+    fields of nested objects. The filter is parsed once, ValueError if it is not valid.
+    Returns (predicate, names of the fields the filter reads)."""
+    tokens = []
+    fields = []
+    position = 0
+    while text[position:].strip():
+        match = FILTER_TOKEN.match(text, position)
+        if not match:
+            raise ValueError('Unexpected filter text: ' + text[position:].strip())
+        double, single, number, comparison, name, bracket = match.groups()
+        if double is not None or single is not None:
+            tokens.append(('value', double.replace('\\"', '"') if double is not None else single))
+        elif number is not None:
+            tokens.append(('value', float(number) if '.' in number else int(number)))
+        elif comparison:
+            tokens.append(('comparison', comparison))
+        elif name:
+            tokens.append(('word', name))
+        else:
+            tokens.append(('bracket', bracket))
+        position = match.end()
+    index = 0
+
+    def peek(kind, value=None):
+        if index < len(tokens) and tokens[index][0] == kind:
+            return value is None or str(tokens[index][1]).lower() == value
+        return False
+
+    def take(kind, value=None):
+        nonlocal index
+        if not peek(kind, value):
+            found = tokens[index][1] if index < len(tokens) else 'end of filter'
+            raise ValueError('Expected {} in filter, found {}'.format(value or kind, found))
+        index += 1
+        return tokens[index - 1][1]
+
+    def literal():
+        if peek('word', 'true') or peek('word', 'false') or peek('word', 'null'):
+            return {'true': True, 'false': False, 'null': None}[take('word').lower()]
+        return take('value')
+
+    def condition():
+        if peek('word', 'not'):
+            take('word')
+            test = condition()
+            return lambda item: not test(item)
+        if peek('bracket', '('):
+            take('bracket', '(')
+            test = disjunction()
+            take('bracket', ')')
+            return test
+        name = take('word')
+        fields.append(name)
+        names = name.split('.')
+        if peek('comparison'):
+            return filter_test(names, FILTER_COMPARISONS[take('comparison')], literal())
+        if peek('word', 'is'):
+            take('word')
+            negated = peek('word', 'not')
+            if negated:
+                take('word')
+            take('word', 'null')
+            return lambda item: (filter_value(item, names) is None) != negated
+        if peek('word', 'between'):
+            take('word')
+            low = filter_test(names, operator.ge, literal())
+            take('word', 'and')
+            high = filter_test(names, operator.le, literal())
+            return lambda item: low(item) and high(item)
+        negated = peek('word', 'not')
+        if negated:
+            take('word')
+        take('word', 'in')
+        take('bracket', '(')
+        tests = [filter_test(names, operator.eq, literal())]
+        while peek('bracket', ','):
+            take('bracket', ',')
+            tests.append(filter_test(names, operator.eq, literal()))
+        take('bracket', ')')
+        return lambda item: any(test(item) for test in tests) != negated
+
+    def conjunction():
+        tests = [condition()]
+        while peek('word', 'and'):
+            take('word')
+            tests.append(condition())
+        return tests[0] if len(tests) == 1 else lambda item: all(test(item) for test in tests)
+
+    def disjunction():
+        tests = [conjunction()]
+        while peek('word', 'or'):
+            take('word')
+            tests.append(conjunction())
+        return tests[0] if len(tests) == 1 else lambda item: any(test(item) for test in tests)
+
+    predicate = disjunction()
+    if index < len(tokens):
+        raise ValueError('Unexpected filter text: {}'.format(tokens[index][1]))
+    return predicate, list(dict.fromkeys(fields))
+
+
+class DateConverter:
+    """Batch conversion of reference data DATE values (milliseconds since epoch)
+    to text in dateformat and back, with the same results as fromtimestamp/strftime
+    and strptime/timestamp of every single value.
+
+    Every distinct value is converted once. Without %f the text depends only on
+    the second, so values are grouped by second; for the default format the text
+    is built from the cached UTC offset of the hour and the cached date of the day
+    without localtime/strftime for every second."""
+
+    DEFAULT_FORMAT = '%Y-%m-%d %H:%M:%S'
+    DEFAULT_PATTERN = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\Z', re.ASCII)
+    CACHE_SIZE = 100000
+    EPOCH = datetime.datetime(1970, 1, 1)
+    HOURS = ['%02d:' % hour for hour in range(24)]
+    MINUTES_SECONDS = ['%02d:%02d' % divmod(second, 60) for second in range(3600)]
+
+    def __init__(self, dateformat):
+        self.dateformat = dateformat
+        # %s of glibc goes through mktime and is not stable inside DST folds
+        self.by_second = '%f' not in dateformat and '%s' not in dateformat
+        self.default = dateformat == self.DEFAULT_FORMAT
+        self.texts = {}
+        self.offsets = {}
+        self.days = {}
+        self.stamps = {}
+
+    def hour_offset(self, hour):
+        # UTC offset of the hour in seconds, None if it changes inside the hour
+        start = hour * 3600
+        offset = time.localtime(start).tm_gmtoff
+        for second in (start, start + 3599):
+            try:
+                wall = self.EPOCH + datetime.timedelta(seconds=second + offset)
+            except OverflowError:
+                return None
+            if wall.timetuple()[:6] != time.localtime(second)[:6]:
+                return None
+        return offset
+
+    def day_prefix(self, day):
+        # 'YYYY-mm-dd ' of the day since epoch, '' if the year is not four digits
+        date = self.EPOCH + datetime.timedelta(days=day)
+        return '%04d-%02d-%02d ' % (date.year, date.month, date.day) if date.year >= 1000 else ''
+
+    def format_second(self, second):
+        if self.default:
+            hour = second // 3600
+            offset = self.offsets.get(hour, False)
+            if offset is False:
+                offset = self.offsets[hour] = self.hour_offset(hour)
+            if offset is not None:
+                day, rest = divmod(second + offset, 86400)
+                prefix = self.days.get(day)
+                if prefix is None:
+                    try:
+                        prefix = self.days[day] = self.day_prefix(day)
+                    except OverflowError:
+                        prefix = ''
+                if prefix:
+                    return prefix + self.HOURS[rest // 3600] + self.MINUTES_SECONDS[rest % 3600]
+        return datetime.datetime.fromtimestamp(second).strftime(self.dateformat)
+
+    def to_text(self, values):
+        """DATE values to text, empty values are returned as they are"""
+        if len(self.texts) > self.CACHE_SIZE:
+            self.texts.clear()
+            self.offsets.clear()
+            self.days.clear()
+        if not self.by_second:
+            return [self.text(value) if value else value for value in values]
+        texts = self.texts
+        new = [value for value in dict.fromkeys(values) if value and value not in texts]
+        format_second = self.format_second
+        texts.update(zip(new, [format_second(int(value) // 1000) for value in new]))
+        return [texts[value] if value else value for value in values]
+
+    def text(self, value):
+        text = self.texts.get(value)
+        if text is None:
+            text = self.texts[value] = datetime.datetime.fromtimestamp(int(value)/1000).strftime(self.dateformat)
+        return text
+
+    def to_timestamp(self, values):
+        """Texts in dateformat to DATE values, empty values are returned as they are"""
+        if len(self.stamps) > self.CACHE_SIZE:
+            self.stamps.clear()
+        stamps = self.stamps
+        default = self.dateformat == self.DEFAULT_FORMAT
+        result = []
+        for value in values:
+            if not value:
+                result.append(value)
+                continue
+            stamp = stamps.get(value)
+            if stamp is None:
+                if default and self.DEFAULT_PATTERN.match(value):
+                    date = datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                             int(value[11:13]), int(value[14:16]), int(value[17:19]))
+                else:
+                    date = datetime.datetime.strptime(value, self.dateformat)
+                stamp = stamps[value] = '{:.0f}'.format(datetime.datetime.timestamp(date)*1000)
+            result.append(stamp)
+        return result
+
+
+def endpoint_template(uri):
+    """Path of the API request with names and ids replaced by placeholders, the label of the telemetry"""
+    path = uri.split('?', 1)[0].split(BASE_URI, 1)[-1]
+    parts = path.split('/')
+    if parts[0] == 'reference_data' and len(parts) > 2:
+        first = 4 if parts[2] == 'bulk_load' else 3
+        parts[first - 1:] = ['{name}', '{key}', '{field}'][:len(parts) - first + 1]
+    else:
+        parts = ['{id}' if any(char.isdigit() for char in part) else part for part in parts]
+    return '/'.join(parts)
+
+
+class RequestMetrics:
+    """Telemetry of the API requests of the run: latency histograms, statuses, bytes and retries by endpoint"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, host, method, uri, status, total, ttfb=0.0, bytes_in=0, bytes_out=0, retries=0, bytes_wire=None):
+        """bytes_in are the decoded bytes of the answer, bytes_wire the received ones, less for compressed answers"""
+        key = (host, method, endpoint_template(uri))
+        with self.lock:
+            item = self.endpoints.get(key)
+            if item is None:
+                item = self.endpoints[key] = {'console': host, 'method': method, 'endpoint': key[2], 'requests': 0,
+                                              'statuses': {}, 'retries': 0, 'bytes_in': 0, 'bytes_wire': 0, 'bytes_out': 0,
+                                              'latency': self.histogram(), 'ttfb': self.histogram()}
+            item['requests'] += 1
+            item['statuses'][str(status)] = item['statuses'].get(str(status), 0) + 1
+            item['retries'] += retries
+            item['bytes_in'] += bytes_in
+            item['bytes_wire'] += bytes_in if bytes_wire is None else bytes_wire
+            item['bytes_out'] += bytes_out
+            for name, value in (('latency', total), ('ttfb', ttfb)):
+                histogram = item[name]
+                histogram['sum'] += value
+                histogram['max'] = max(histogram['max'], value)
+                for n, bound in enumerate(LATENCY_BUCKETS):
+                    if value <= bound:
+                        histogram['buckets'][n] += 1
+                        break
+
+    def transferred(self):
+        """(received, decoded) bytes of all the answers"""
+        with self.lock:
+            return (sum(item['bytes_wire'] for item in self.endpoints.values()),
+                    sum(item['bytes_in'] for item in self.endpoints.values()))
+
+    def histogram(self):
+        # Counts of the buckets are not cumulative, the last one is for values above all the bounds
+        return {'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+
+    def summary(self):
+        with self.lock:
+            endpoints = json.loads(json.dumps(list(self.endpoints.values())))
+        for item in endpoints:
+            for name in ('latency', 'ttfb'):
+                histogram = item[name]
+                histogram['p50'] = self.quantile(histogram['buckets'], 0.5, histogram['max'])
+                histogram['p95'] = self.quantile(histogram['buckets'], 0.95, histogram['max'])
+                histogram['bounds'] = LATENCY_BUCKETS
+        return {'script': SCRIPT_NAME, 'started': self.started, 'duration': round(time.time() - self.started, 3),
+                'requests': sum(item['requests'] for item in endpoints), 'endpoints': endpoints}
+
+    def quantile(self, buckets, q, highest):
+        # Upper bound of the bucket with the quantile, the largest value for the last bucket
+        rank = q * sum(buckets)
+        seen = 0
+        for n, count in enumerate(buckets):
+            seen += count
+            if count and seen >= rank:
+                return LATENCY_BUCKETS[n] if n < len(LATENCY_BUCKETS) else highest
+        return 0.0
+
+    def write(self, filename):
+        """JSON or, for *.prom, Prometheus text format for the textfile collector, replaced atomically"""
+        summary = self.summary()
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            if filename.endswith('.prom'):
+                f.write(self.prometheus(summary))
+            else:
+                json.dump(summary, f, indent=2)
+        os.replace(tmp_filename, filename)
+
+    def prometheus(self, summary):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append('# HELP qapi_{} {}'.format(name, help_text))
+            lines.append('# TYPE qapi_{} {}'.format(name, kind))
+
+        def labels(item, **extra):
+            pairs = [('console', item['console']), ('method', item['method']), ('endpoint', item['endpoint'])] + sorted(extra.items())
+            return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}'
+
+        for name, help_text in (('latency', 'Total time of the API requests'), ('ttfb', 'Time to the first byte of the API answers')):
+            metric = 'request_{}_seconds'.format('duration' if name == 'latency' else name)
+            header(metric, 'histogram', help_text)
+            for item in summary['endpoints']:
+                histogram = item[name]
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], histogram['buckets']):
+                    cumulative += count
+                    lines.append('qapi_{}_bucket{} {}'.format(metric, labels(item, le=bound), cumulative))
+                lines.append('qapi_{}_sum{} {}'.format(metric, labels(item), round(histogram['sum'], 6)))
+                lines.append('qapi_{}_count{} {}'.format(metric, labels(item), item['requests']))
+        header('requests_total', 'counter', 'API requests by answer status, "error" - no answer')
+        for item in summary['endpoints']:
+            for status, count in sorted(item['statuses'].items()):
+                lines.append('qapi_requests_total{} {}'.format(labels(item, status=status), count))
+        header('request_retries_total', 'counter', 'Requests sent again after failed or throttled attempts')
+        for item in summary['endpoints']:
+            lines.append('qapi_request_retries_total{} {}'.format(labels(item), item['retries']))
+        header('request_bytes_total', 'counter', 'Bytes of the request and answer bodies')
+        for item in summary['endpoints']:
+            for direction in ('in', 'out'):
+                lines.append('qapi_request_bytes_total{} {}'.format(labels(item, direction=direction), item['bytes_' + direction]))
+        header('response_wire_bytes_total', 'counter', 'Bytes of the answers as received, before decompression')
+        for item in summary['endpoints']:
+            lines.append('qapi_response_wire_bytes_total{} {}'.format(labels(item), item['bytes_wire']))
+        header('last_run_timestamp_seconds', 'gauge', 'Unix time of the end of the run')
+        lines.append('qapi_last_run_timestamp_seconds {}'.format(int(time.time())))
+        return '\n'.join(lines) + '\n'
+
+
+# Telemetry of all the clients of the run, written by --metrics
+telemetry = RequestMetrics()
+
+
+class ApiError(Exception):
+    """Failed API request of a checkpointed run, the work done so far is kept in the journal"""
+
+
+class Journal:
+    """Checkpoint of a long export or import.
+
+    Completed Range windows or import chunks are appended to <file>.journal,
+    items of exported windows to <file>.part. The first line of the journal
+    describes the run, so a resumed run with other options is refused."""
+
+    def __init__(self, filename, signature, resume, logger):
+        self.path = filename + '.journal'
+        self.part = filename + '.part'
+        self.logger = logger
+        self.done = set()
+        self.state = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(self.path):
+            with open(self.path, mode='r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('signature') != signature:
+                    error(logger, 'Journal ' + self.path + ' was written by a run with other options')
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line is incomplete if the run was killed while writing it
+                        break
+                    if 'done' in entry:
+                        self.done.add(entry['done'])
+                    self.state.update(entry.get('state', {}))
+            logger.info('Resuming from {}: {} parts already done'.format(self.path, len(self.done)))
+        else:
+            if resume:
+                logger.info('Journal ' + self.path + ' is not found, starting from the beginning')
+            with open(self.path, mode='w', encoding='utf-8') as f:
+                f.write(json.dumps({'signature': signature}) + '\n')
+            if os.path.exists(self.part):
+                os.remove(self.part)
+
+    def append(self, filename, entry):
+        with open(filename, mode='a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def set_state(self, key, value):
+        with self.lock:
+            self.state[key] = value
+            self.append(self.path, {'state': {key: value}})
+
+    def commit(self, key, items=None):
+        """Mark window or chunk as done, items are saved before the mark"""
+        with self.lock:
+            if items is not None:
+                self.append(self.part, {'key': key, 'items': items})
+            self.append(self.path, {'done': key})
+            self.done.add(key)
+
+    def items(self):
+        """Saved items of the done windows in the order of their keys"""
+        pages = {}
+        if os.path.exists(self.part):
+            with open(self.part, mode='r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if entry['key'] in self.done:
+                        pages[entry['key']] = entry['items']
+        return [pages[key] for key in sorted(pages)]
+
+    def close(self):
+        for filename in (self.path, self.part):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+class TokenBucket:
+    """Rate limit shared by threads: rate tokens per second, up to burst at once."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class JsonStream:
+    """JSON answer decoded while it is read by chunks. Arrays and objects of the first two levels are decoded
+    member by member, so only the text of one element (an asset, an event, a row of a table) is kept,
+    not the text of the whole answer."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.finished = False
+        # Decoded bytes of the answer
+        self.size = 0
+
+    def fill(self):
+        # The decoded text is dropped from the buffer before the next chunk is added
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.size += len(chunk)
+                self.buffer += self.text.decode(chunk)
+                return
+        self.buffer += self.text.decode(b'', final=True)
+        self.finished = True
+
+    def peek(self):
+        """Next character after spaces, empty at the end of the answer"""
+        while True:
+            self.position = JSON_SPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer) or self.finished:
+                return self.buffer[self.position:self.position + 1]
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected "{}" in the answer, found "{}"'.format(char, self.buffer[self.position:self.position + 20]))
+        self.position += 1
+
+    def decode(self):
+        value = self.value(0)
+        if self.peek():
+            raise ValueError('Extra data after the answer')
+        return value
+
+    def value(self, level):
+        char = self.peek()
+        if char == '[' and level < 2:
+            self.position += 1
+            items = []
+            while self.peek() != ']':
+                if items:
+                    self.expect(',')
+                items.append(self.value(2))
+            self.position += 1
+            return items
+        if char == '{' and level < 2:
+            self.position += 1
+            members = {}
+            first = True
+            while self.peek() != '}':
+                if not first:
+                    self.expect(',')
+                first = False
+                key = self.element()
+                self.expect(':')
+                members[key] = self.value(level + 1)
+            self.position += 1
+            return members
+        return self.element()
+
+    def element(self):
+        """Value decoded by json, more chunks are read while it is not complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.finished:
+                    raise
+                self.fill()
+                continue
+            # A number at the end of the buffer can go on in the next chunk, "1." or "1e" of "1.5" or "1e5"
+            # are decoded as 1 and stop before the rest of the number
+            if not self.finished and (end == len(self.buffer) or (
+                    isinstance(value, (int, float)) and not isinstance(value, bool) and self.buffer[end] in JSON_NUMBER_TAIL)):
+                self.fill()
+                continue
+            self.position = end
+            return value
+
+
+class Rows:
+    """Table of one schema: the column names are kept once, every row is a tuple of values.
+    Iteration gives a dict for every row, for the code that works with the rows by names."""
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns=(), rows=None):
+        self.columns = list(columns)
+        self.rows = [] if rows is None else rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def __getitem__(self, index):
+        return dict(zip(self.columns, self.rows[index]))
+
+
+class RowWriter:
+    """Output written by pages while the next pages are read: CSV, JSON Lines or Parquet.
+    Pages of the collections exported concurrently are written under a lock. Parquet (pyarrow,
+    loaded only for it) keeps the date columns as timestamps, the other columns as text."""
+
+    FORMATS = ['csv', 'jsonl', 'parquet']
+
+    def __init__(self, filename, format, columns, separator=',', date_columns=()):
+        self.format = format
+        self.columns = list(columns)
+        self.lock = threading.Lock()
+        self.count = 0
+        # Parquet takes the dates as milliseconds, the other formats as text
+        self.native_dates = format == 'parquet'
+        self.file = None
+        if format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            self.pyarrow = pyarrow
+            self.schema = pyarrow.schema([(column, pyarrow.timestamp('ms', tz='UTC') if column in date_columns else pyarrow.string())
+                                          for column in self.columns])
+            self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+        else:
+            self.file = open(filename, 'w', encoding='utf-8', newline='')
+            if format == 'csv':
+                self.writer = csv.writer(self.file, delimiter=separator)
+                self.writer.writerow(self.columns)
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.format == 'parquet':
+            pyarrow = self.pyarrow
+            arrays = []
+            for field, column in zip(self.schema, zip(*rows)):
+                if pyarrow.types.is_string(field.type):
+                    column = [value if value is None or isinstance(value, str) else str(value) for value in column]
+                arrays.append(pyarrow.array(column, field.type))
+            table = pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        elif self.format == 'jsonl':
+            columns = self.columns
+            text = ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+        with self.lock:
+            if self.format == 'csv':
+                self.writer.writerows(rows)
+            elif self.format == 'jsonl':
+                self.file.write(text)
+            else:
+                self.writer.write_table(table)
+            self.count += len(rows)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        else:
+            self.writer.close()
+
+
 class RestApiClient:
-    def __init__(self, qradar_ip, token, endpoint, logger, filter='', fields='', records='', refname='', dateformat='%Y-%m-%d %H:%M:%S', rowbyrow=False, aql=''):
+    def __init__(self, qradar_ip, token, endpoint, logger, filter='', fields='', records='', refname='', dateformat='%Y-%m-%d %H:%M:%S', rowbyrow=False, aql='', ipselect='first',
+                 workers=4, rate=10, retries=3, diff=True, force=False, page_size=None, limits=throttle.DEFAULT_LIMITS):
         """Initialize the object for peroforming requests to QRadar API,
         storing and processing results."""
         # Setup logger
@@ -165,9 +1080,28 @@ class RestApiClient:
 
         self.dateformat = dateformat
         self.rowbyrow = rowbyrow
+        self.ipselect = ipselect
+        # Settings of the concurrent asset updates
+        self.workers = max(1, workers)
+        self.rate = rate
+        self.retries = retries
+        self.diff = diff
+        # Stage networks even if the hierarchy is not changed
+        self.force = force
+        # Range window of exports and chunk of imports, progress is checkpointed to the journal
+        self.page_size = page_size
+        self.journal = None
+        self.converter = DateConverter(dateformat)
+        # Results of the import: rows sent and statuses of assets
+        self.count = 0
+        self.report_counts = {}
+        # Connection pool and concurrency limits of all requests to the console
+        self.session = requests.session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=self.workers))
+        self.controller = throttle.Controller(self.workers, limits)
 
         # Setup method
-        if (endpoint['method'] == 'export'):
+        if (endpoint['method'] in ['export', 'count']):
             self.method = 'GET'
         elif (endpoint['method'] in ['import', 'delete']):
             self.method = endpoint['http']
@@ -180,6 +1114,7 @@ class RestApiClient:
         else:
             self.headers = {b'Accept': 'application/json'}
         self.headers['Version'] = '11.0'  # Change this if API version updates
+        self.headers['Accept-Encoding'] = ACCEPT_ENCODING
         if self.method == 'DELETE':
             self.headers['Content-Type'] = 'application/json'
         else:
@@ -202,17 +1137,17 @@ class RestApiClient:
         # For assets read the list of porpertis and store in corresponding lists
         self.fields = endpoint['fields']
         self.date_fields = []
-        if endpoint['object'] == 'assets':
+        # Counts need no metadata of the objects
+        counting = endpoint['method'] == 'count'
+        if endpoint['object'] == 'assets' and not counting:
             self.asset_properties = []
             self.asset_properties = self.get_asset_properties()
-            for property in self.asset_properties:
-                asset_property_names.append(property['name'])
+            asset_property_names = [property['name'] for property in self.asset_properties]
             self.logger.debug(
                 'Read following asset properties:{}'.format(asset_property_names))
-            self.fields = endpoint.get('fields')
-            self.fields.extend(asset_property_names)
+            self.fields = endpoint.get('fields') + asset_property_names
 
-        if endpoint['object'] in ['reftable']:
+        if endpoint['object'] in ['reftable'] and not counting:
             if endpoint['method'] != 'delete':
                 self.endpoint = self.endpoint.format(id=refname)
             else:
@@ -227,29 +1162,135 @@ class RestApiClient:
                 if ref_fields[0].get('key_name_types').get(field) == 'DATE':
                     self.date_fields.extend([field])
 
-        if filter or fields:
-            self.endpoint += '?'
-            if filter and fields:
-                self.endpoint += 'filter=' + \
-                    quote(filter.encode())+'&fields='+quote(fields.encode())
-            elif filter:
-                self.endpoint += 'filter='+quote(filter.encode())
-            elif fields:
-                self.endpoint += 'fields='+quote(fields.encode())
+        if endpoint['object'] in ELEMENT_OBJECTS and not counting and ',' not in refname:
+            # Several collections are read by export_elements() with their own URLs
+            self.endpoint = self.endpoint.format(id=quote(refname, safe=''))
+
+        # Filter is sent to the API, the objects whose API does not take it are filtered by the script
+        self.filter = filter
+        self.local_filter = None
+        self.filter_fields = []
+        if filter and endpoint['object'] in LOCAL_FILTER_OBJECTS:
+            try:
+                self.local_filter, self.filter_fields = compile_filter(filter)
+            except ValueError as e:
+                error(logger, 'Wrong filter: {}'.format(e))
+        elif filter and not counting:
+            self.endpoint += '?filter=' + quote(filter.encode())
+        # Fields are the output columns in the given order, the API fields are derived from them by project()
         if fields:
-            self.fields = list(
-                set(endpoint['filter_fields']) & set(fields.split(',')))
+            names = [field.strip() for field in fields.split(',')]
+            columns = [field for field in names if field in self.fields]
+            if endpoint['object'] == 'reftable' and self.fields[0] not in columns:
+                # The key column is needed to build the rows
+                columns.insert(0, self.fields[0])
+            if not columns:
+                error(logger, 'None of the fields {} can be exported, available: {}'.format(fields, ', '.join(self.fields)))
+            self.fields = columns
 
-        self.session = requests.session()
         self.response = None
         self.result = u''
         self.dict = []
         logger.debug('RestAPIClient initialized:')
         logger.debug(self)
 
+    def api_fields(self, endpoint):
+        """fields= of the API for the output columns and the filter applied by the script,
+        empty for the objects that are not projected"""
+        names = EXPORT_FIELDS.get(endpoint)
+        if names is None:
+            return ''
+        default = ASSET_PROPERTY_FIELDS if endpoint == 'assets' else None
+        fields = [names.get(field, default or field) for field in self.fields]
+        if self.local_filter:
+            # The filter reads the objects of the answer, nested fields are requested whole
+            fields += [name.split('.')[0] for name in self.filter_fields]
+        return ','.join(dict.fromkeys(fields))
+
+    def project(self, endpoint):
+        """Request only the API fields of the output columns"""
+        fields = self.api_fields(endpoint)
+        if fields:
+            self.endpoint += ('&' if '?' in self.endpoint else '?') + 'fields=' + quote(fields.encode())
+            self.logger.debug('Fields requested: ' + fields)
+        return fields
+
+    @property
+    def result(self):
+        """Text of the last answer, made from the decoded answer only where the text is needed"""
+        if self.text is None:
+            self.text = '' if self.answer is None else json.dumps(self.answer, ensure_ascii=False)
+        return self.text
+
+    @result.setter
+    def result(self, text):
+        self.text = text
+        self.answer = None
+
+    def decoded(self):
+        """Last answer as JSON value, the text is parsed once"""
+        if self.answer is None and self.text:
+            self.answer = json.loads(self.text)
+        return self.answer
+
+    def set_answer(self, answer):
+        self.text = None
+        self.answer = answer
+
+    def filter_answer(self):
+        """Apply the filter to the answer of the objects whose API does not take it"""
+        answer = self.decoded()
+        if self.local_filter and answer is not None:
+            kept = [item for item in answer if self.local_filter(item)]
+            self.logger.debug('Filter kept {} of {} objects'.format(len(kept), len(answer)))
+            self.set_answer(kept)
+        return self.answer
+
+    def request(self, method, uri, retries=None, attempt=1, **kwargs):
+        """Request through the concurrency controller, traced in the debug log and counted in the telemetry.
+        attempt > 1 counts the request as a retry of the caller."""
+        started = time.perf_counter()
+        body = kwargs.get('data') or b''
+        try:
+            response = self.controller.request(self.session, method, uri, retries=retries, verify=False, **kwargs)
+        except requests.exceptions.RequestException:
+            telemetry.record(self.server_ip, method, uri, 'error', time.perf_counter() - started, bytes_out=len(body), retries=int(attempt > 1))
+            raise
+        response.started = started
+        response.retried = attempt > 1
+        # Streamed answers are counted by read_answer() when they are read
+        if not kwargs.get('stream'):
+            self.record(method, uri, response, len(response.content), len(body))
+        return response
+
+    def record(self, method, uri, response, bytes_in, bytes_out=0):
+        total = time.perf_counter() - response.started
+        ttfb = response.elapsed.total_seconds()
+        retries = getattr(response, 'attempts', 1) - 1 + response.retried
+        try:
+            # Bytes read from the connection, before decompression
+            bytes_wire = response.raw.tell()
+        except AttributeError:
+            bytes_wire = bytes_in
+        telemetry.record(self.server_ip, method, uri, response.status_code, total, ttfb, bytes_in, bytes_out, retries, bytes_wire)
+        self.logger.debug('Request {} {} status={} total={:.3f}s ttfb={:.3f}s in={} wire={} out={} retries={}'.format(
+            method, endpoint_template(uri), response.status_code, total, ttfb, bytes_in, bytes_wire, bytes_out, retries))
+
+    def read_answer(self, response, uri):
+        """Decode the JSON answer while it arrives, compressed answers are decompressed chunk by chunk"""
+        stream = JsonStream(response.iter_content(STREAM_CHUNK))
+        try:
+            if not stream.peek():
+                return None
+            return stream.decode()
+        finally:
+            response.close()
+            self.record('GET', uri, response, stream.size)
+
     def __str__(self):
         return('IP:{}, AUTH:{}, ENDPOINT:{}, METHOD:{}, FIELDS:{}'.format(self.server_ip, self.auth, self.endpoint, self.method, self.fields))
 
+    @phased('call_api')
     def call_api(self, endpoint=None, method=None, headers=None, data=None):
         if not endpoint:
             endpoint = self.endpoint
@@ -270,98 +1311,434 @@ class RestApiClient:
         self.logger.debug(self.headers)
         if method == 'GET':
             try:
-                self.response = self.session.get(
-                    full_uri, headers=headers, verify=False)
+                self.response = self.request(
+                    'GET', full_uri, headers=headers, stream=True)
                 self.logger.debug('Server answer: ' +
                                   str(self.response.status_code)+' : '+responses[self.response.status_code])
                 if self.response.status_code != requests.codes.ok:
+                    self.response.close()
                     self.response.raise_for_status()
                 else:
-                    self.result = self.response.text
-                    if not self.result:
+                    try:
+                        answer = self.read_answer(self.response, full_uri)
+                    except ValueError as e:
+                        error(self.logger, 'Answer is not valid JSON: {}'.format(e))
+                    if answer is None:
                         self.logger.error('Result is empty')
                         exit(1)
-                return self.result
-            except requests.exceptions.HTTPError as e:
+                    self.set_answer(answer)
+                return self.answer
+            except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
                 self.logger.error(e)
+                if self.journal:
+                    raise ApiError(e)
                 exit(1)
                 return e
 
         elif method == 'POST':
             try:
                 self.logger.debug('-----POST Data:\n' + str(data))
-                self.response = self.session.post(
-                    full_uri, headers=headers, verify=False, data=data.encode('utf-8'))
+                self.response = self.request(
+                    'POST', full_uri, headers=headers, data=data.encode('utf-8'))
                 self.logger.debug('Server answer: ' +
                                   str(self.response.status_code)+' : '+responses[self.response.status_code])
                 if self.response.status_code != requests.codes.ok:
                     self.response.raise_for_status()
                 self.result = self.response.text
                 return self.result
-            except requests.exceptions.HTTPError as e:
+            except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
                 self.logger.error(e)
+                if self.journal:
+                    raise ApiError(e)
                 exit(1)
                 return e
 
         elif method == 'PUT':
             try:
                 self.logger.debug('-----PUT Data:\n' + str(data))
-                with open('data.json', mode='w', encoding='utf-8') as file:
-                    file.write(str(data))
-                self.response = requests.put(
-                    full_uri, headers=headers, verify=False, data=data.encode('utf-8'))
+                self.response = self.request(
+                    'PUT', full_uri, headers=headers, data=data.encode('utf-8'))
                 self.logger.debug('Server answer: ' +
                                   str(self.response.status_code)+' : '+responses[self.response.status_code])
                 if self.response.status_code != requests.codes.ok:
                     self.response.raise_for_status()
                 self.result = self.response.text
                 return self.result
-            except requests.exceptions.HTTPError as e:
+            except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
                 self.logger.error(e)
+                if self.journal:
+                    raise ApiError(e)
                 exit(1)
                 return e
         elif method == 'DELETE':
             try:
-                self.response = requests.delete(
-                    full_uri, headers=headers, verify=False)
+                self.response = self.request(
+                    'DELETE', full_uri, headers=headers)
                 self.logger.debug('Server answer: ' +
                                   str(self.response.status_code)+' : '+responses[self.response.status_code])
                 if self.response.status_code != requests.codes.ok:
                     self.response.raise_for_status()
-            except requests.exceptions.HTTPError as e:
+            except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
                 self.logger.error(e)
+                if self.journal:
+                    raise ApiError(e)
                 exit(1)
                 return e
 
-    def write_api(self, endpoint):
+    def batches(self, items):
+        """(offset, list) of page_size items, BATCH_SIZE by default"""
+        size = self.page_size or BATCH_SIZE
+        offset = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == size:
+                yield offset, batch
+                offset += size
+                batch = []
+        if batch:
+            yield offset, batch
+
+    def read_csv(self, filename, separator=','):
+        """Rows of CSV file one by one, the file is not loaded into memory"""
+        with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
+            for row in csv.DictReader(csv_file, delimiter=separator):
+                yield row
+
+    def stream(self, endpoint, rows):
+        """Import pipeline: rows are read, converted and sent by batches,
+        so only one batch is kept in memory and the first batch is sent before
+        the rest of the file is read"""
+        for offset, batch in self.batches(rows):
+            yield offset, self.jsonify_rows(endpoint, batch)
+
+    @phased('import')
+    def write_api(self, endpoint, batches=None, report_filename=None, separator=','):
+        """Send the converted rows: batches of the import pipeline or self.dict"""
+        if batches is None:
+            batches = self.batches(self.dict)
+        self.count = 0
         if self.method == 'POST':
             if endpoint.get('object') == 'assets':
-                for row in self.dict:
-                    id = row.get(endpoint['id'])
-                    row.pop(endpoint['id'])
-                    data = json.dumps(row, ensure_ascii=False)
-                    endpoint_item = self.endpoint.format(id=id)
-                    self.logger.debug('Writing POST data to ' + endpoint_item)
-                    self.call_api(endpoint=endpoint_item, data=data)
+                self.update_assets(endpoint, batches, report_filename, separator)
             elif endpoint.get('object') in ['reftable', 'refmap', 'refset', 'refmapset']:
-                if self.rowbyrow:
-                    for row in self.dict:
-                        data = json.dumps(row)
-                        self.call_api(data=data)
-                else:
-                    data = {}
-                    for row in self.dict:
-                        data.update(row)
-                    data = json.dumps(data)
-                    self.call_api(data=data)
+                done = self.journal.done if self.journal else set()
+                for offset, batch in batches:
+                    if self.rowbyrow:
+                        for n, row in enumerate(batch, offset):
+                            if n not in done:
+                                self.call_api(data=json.dumps(row))
+                                if self.journal:
+                                    self.journal.commit(n)
+                    elif offset not in done:
+                        data = {}
+                        for row in batch:
+                            data.update(row)
+                        self.call_api(data=json.dumps(data))
+                        if self.journal:
+                            self.journal.commit(offset)
+                    self.count += len(batch)
+                    self.logger.debug('{} records sent'.format(self.count))
             else:
                 not_implemented(self.logger)
         elif self.method == 'PUT':
+            if endpoint.get('object') == 'networks' and not self.check_hierarchy():
+                return
             data = json.dumps(self.dict, ensure_ascii=False)
             self.call_api(data=data)
+            self.count = len(self.dict)
         else:
             not_implemented(self.logger)
 
+    @phased('export')
+    def export_pages(self, endpoint):
+        """Export by Range windows of page_size items, done windows are taken from the journal.
+        The merged answer is stored in self.answer as if it was read by one request."""
+        journal = self.journal
+        done = journal.done if journal else set()
+        state = journal.state if journal else {}
+        pages = journal.items() if journal else []
+        total = state.get('total')
+        meta = state.get('meta')
+        first = 0
+        while total is None or first < total:
+            if first not in done:
+                headers = dict(self.headers)
+                headers['Range'] = 'items={}-{}'.format(first, first + self.page_size - 1)
+                answer = self.call_api(headers=headers)
+                if endpoint == 'events':
+                    items = answer.get('events')
+                elif endpoint in ['reftable', 'refmap', 'refset', 'refmapset']:
+                    items = answer.pop('data', None) or {}
+                    if meta is None:
+                        meta = answer
+                        if journal:
+                            journal.set_state('meta', meta)
+                else:
+                    items = answer
+                content_range = self.response.headers.get('Content-Range', '')
+                if total is None and '/' in content_range:
+                    total = int(content_range.rsplit('/', 1)[1])
+                elif total is None and len(items) < self.page_size:
+                    total = first + len(items)
+                if journal:
+                    if 'total' not in state and total is not None:
+                        journal.set_state('total', total)
+                    journal.commit(first, items)
+                pages.append(items)
+                self.logger.debug('Window {}-{} of {} exported'.format(first, first + self.page_size - 1, total))
+                if not items:
+                    break
+            first += self.page_size
+
+        if endpoint in ['reftable', 'refmap', 'refset', 'refmapset']:
+            if pages and isinstance(pages[0], list):
+                data = [item for items in pages for item in items]
+            else:
+                data = {}
+                for items in pages:
+                    data.update(items)
+            answer = dict(meta or {}, data=data)
+        else:
+            answer = [item for items in pages for item in items]
+            if endpoint == 'events':
+                answer = {'events': answer}
+        self.set_answer(answer)
+        return self.answer
+
+    @phased('export')
+    def export_elements(self, objects, endpoint, names, writer):
+        """Export the elements of the collections into the writer page by page, the collections are read
+        concurrently and every page is written before the next one is requested.
+        Returns {name: rows written}, None for the collections that failed."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, len(names))) as executor:
+            counts = list(executor.map(lambda name: self.export_collection(objects, endpoint, name, writer), names))
+        return dict(zip(names, counts))
+
+    def export_collection(self, objects, endpoint, name, writer):
+        """Rows written of one collection read by Range windows, None if a request failed"""
+        uri = 'https://' + self.server_ip + self.base_uri + endpoint['endpoint'].format(id=quote(name, safe=''))
+        if self.filter:
+            uri += '?filter=' + quote(self.filter.encode())
+        # Converters are not shared by the threads, their caches are not locked
+        converter = DateConverter(self.dateformat)
+        named = 'name' in writer.columns
+        size = self.page_size or ELEMENT_PAGE_SIZE
+        first = written = 0
+        total = None
+        while total is None or first < total:
+            headers = dict(self.headers)
+            headers['Range'] = 'items={}-{}'.format(first, first + size - 1)
+            try:
+                response = self.request('GET', uri, headers=headers, stream=True)
+                if response.status_code != requests.codes.ok:
+                    response.close()
+                    response.raise_for_status()
+                answer = self.read_answer(response, uri) or {}
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.logger.error('Export of {} {} failed: {}'.format(objects, name, e))
+                return None
+            data = answer.get('data') or ([] if objects == 'refset' else {})
+            rows = self.flatten_elements(objects, data, answer.get('element_type'), converter, writer.native_dates)
+            if named:
+                rows = [(name,) + row for row in rows]
+            writer.write(rows)
+            written += len(rows)
+            content_range = response.headers.get('Content-Range', '')
+            if total is None and '/' in content_range:
+                total = int(content_range.rsplit('/', 1)[1])
+            elif total is None and len(data) < size:
+                total = first + len(data)
+            self.logger.debug('{} {}: window {}-{} of {} exported'.format(objects, name, first, first + size - 1, total))
+            if not data:
+                break
+            first += size
+        self.logger.info('{} {}: {} rows exported'.format(objects, name, written))
+        return written
+
+    @phased('count')
+    def count_objects(self, objects, names=None):
+        """Rows (objects, name, count) of every object, the probes are sent concurrently.
+        Reference data of the given names is counted one by one, without names all collections of the type.
+        Count is None when the probe failed."""
+        targets = []
+        for name in objects:
+            endpoint = next(item for item in endpoints if item['object'] == name and item['method'] == 'count')
+            if 'listing' in endpoint and names:
+                targets.extend((endpoint, refname) for refname in names)
+            else:
+                targets.append((endpoint, None))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, len(targets))) as executor:
+            counted = list(executor.map(lambda target: self.probe(*target), targets))
+        self.dict = Rows(['objects', 'name', 'count'], [row for rows in counted for row in rows])
+        return self.dict
+
+    def probe(self, endpoint, refname=None):
+        """[(objects, name, count)] of one count endpoint: only the first item is requested,
+        the total is taken from Content-Range or from number_of_elements of reference data"""
+        headers = dict(self.headers)
+        headers['Range'] = 'items=0-0'
+        if refname:
+            uri = endpoint['endpoint'].format(id=quote(refname, safe=''))
+        elif 'listing' in endpoint:
+            # The listing has the sizes of all collections, it is read whole
+            uri = endpoint['listing']
+            headers.pop('Range')
+        else:
+            uri = endpoint['endpoint']
+        if self.filter and not refname:
+            uri += '&filter=' + quote(self.filter.encode())
+        try:
+            response = self.request('GET', 'https://' + self.server_ip + self.base_uri + uri, headers=headers)
+            response.raise_for_status()
+            answer = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.error('Count of {} {} failed: {}'.format(endpoint['object'], refname or '', e))
+            return [(endpoint['object'], refname or '', None)]
+        if refname:
+            return [(endpoint['object'], refname, answer.get('number_of_elements'))]
+        if 'listing' in endpoint:
+            return [(endpoint['object'], item.get('name'), item.get('number_of_elements')) for item in answer]
+        content_range = response.headers.get('Content-Range', '')
+        if '/' in content_range:
+            return [(endpoint['object'], '', int(content_range.rsplit('/', 1)[1]))]
+        # Range is not supported by the endpoint, the whole list was sent
+        return [(endpoint['object'], '', len(answer))]
+
+    @phased('mirror')
+    def read_mirror(self, filename):
+        """Read the reference table from the local SQLite mirror (refmirror.py),
+        the table is downloaded only if its listing changed since the last run"""
+        import refmirror
+        mirror = refmirror.RefMirror(filename)
+        stats = mirror.refresh(refmirror.Api(self.server_ip, self.auth['SEC']), ['tables'], [self.refname],
+                               page_size=self.page_size or 10000)
+        self.logger.info('Mirror {}: {} downloaded'.format(filename, 'table' if stats['downloaded'] else 'nothing'))
+        content = mirror.content('tables', self.refname)
+        mirror.close()
+        if content is None:
+            error(self.logger, 'Reference table ' + self.refname + ' is not found')
+        self.set_answer(content)
+        return self.answer
+
+    @phased('validate')
+    def check_hierarchy(self):
+        """Validate the networks to import and compare them with the deployed hierarchy.
+        Returns False when there is nothing to stage."""
+        invalid, duplicates, overlaps = check_networks(self.dict)
+        for network in invalid:
+            self.logger.error('Invalid CIDR {} of network {}'.format(network.get('cidr'), network.get('name')))
+        for first, second in duplicates:
+            self.logger.error('Duplicate CIDR {} of networks {} and {}'.format(first.get('cidr'), first.get('name'), second.get('name')))
+        for outer, nested in overlaps:
+            self.logger.debug('Network {} ({}) is nested in {} ({})'.format(
+                nested.get('name'), nested.get('cidr'), outer.get('name'), outer.get('cidr')))
+        ids = [network.get('id') for network in self.dict]
+        if len(set(ids)) != len(ids):
+            self.logger.error('Network ids are not unique')
+        if invalid or duplicates or len(set(ids)) != len(ids):
+            error(self.logger, 'Network hierarchy is not valid, nothing was staged')
+        self.logger.info('{} networks checked, {} nested'.format(len(self.dict), len(overlaps)))
+
+        export_endpoint = next(item for item in endpoints if item['object'] == 'networks' and item['method'] == 'export')
+        self.call_api(endpoint=export_endpoint['endpoint'], method='GET')
+        added, removed, changed = diff_networks(self.decoded(), self.dict)
+        self.logger.info('Networks added: {}, removed: {}, changed: {}'.format(len(added), len(removed), len(changed)))
+        if not (added or removed or changed) and not self.force:
+            self.logger.info('Network hierarchy is not changed, staging skipped')
+            return False
+        return True
+
+    @phased('metadata')
+    def current_assets(self):
+        """Current property values of all assets: {id: {type_id: value}}"""
+        headers = dict(self.headers)
+        headers[b'Accept'] = 'application/json'
+        headers.pop('Range', None)
+        self.call_api(endpoint='asset_model/assets?fields=' + quote('id,properties'), method='GET', headers=headers)
+        current = {}
+        for asset in self.decoded():
+            values = current.setdefault(str(asset.get('id')), {})
+            for property in asset.get('properties') or []:
+                values[property.get('type_id')] = property.get('value')
+        return current
+
+    @phased('call_api')
+    def post_asset(self, id, data, bucket):
+        """Send one asset update, retrying throttled and failed requests.
+        Returns the report row of the asset."""
+        full_uri = 'https://' + self.server_ip + self.base_uri + self.endpoint.format(id=id)
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        status = ''
+        message = ''
+        for attempt in range(1, self.retries + 2):
+            bucket.acquire()
+            delay = min(2 ** attempt, 30)
+            try:
+                response = self.request('POST', full_uri, retries=0, attempt=attempt, headers=self.headers, data=body)
+                status = response.status_code
+                if status < 300:
+                    if self.journal:
+                        self.journal.commit(str(id))
+                    return {'id': id, 'status': 'updated', 'http_status': status, 'attempts': attempt, 'error': ''}
+                message = responses.get(status, '')
+                if status not in RETRY_STATUSES:
+                    break
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+            except requests.exceptions.RequestException as e:
+                message = str(e)
+            if attempt <= self.retries:
+                self.logger.debug('Asset {} attempt {} failed ({} {}), retry in {}s'.format(id, attempt, status, message, delay))
+                time.sleep(delay)
+        self.logger.error('Asset {} was not updated: {} {}'.format(id, status, message))
+        return {'id': id, 'status': 'failed', 'http_status': status, 'attempts': attempt, 'error': message}
+
+    def update_assets(self, endpoint, batches, report_filename=None, separator=','):
+        """Update asset properties concurrently with a rate limit.
+        Rows equal to the current state of the asset are skipped.
+        Results are counted in self.report_counts and written to the report file by batches."""
+        current = self.current_assets() if self.diff else {}
+        counts = self.report_counts = {}
+        report_file = None
+        try:
+            if report_filename:
+                report_file = open(report_filename, 'w', encoding='utf-8', newline='')
+                writer = csv.DictWriter(report_file, fieldnames=['id', 'status', 'http_status', 'attempts', 'error'], delimiter=separator)
+                writer.writeheader()
+            bucket = TokenBucket(self.rate)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for offset, batch in batches:
+                    report = []
+                    futures = []
+                    for row in batch:
+                        id = row.get(endpoint['id'])
+                        data = {key: value for key, value in row.items() if key != endpoint['id']}
+                        values = current.get(str(id))
+                        if self.journal and str(id) in self.journal.done:
+                            report.append({'id': id, 'status': 'resumed', 'http_status': '', 'attempts': 0, 'error': ''})
+                        elif values is not None and all(values.get(property['type_id']) == property['value'] for property in data.get('properties', [])):
+                            report.append({'id': id, 'status': 'unchanged', 'http_status': '', 'attempts': 0, 'error': ''})
+                        else:
+                            futures.append(executor.submit(self.post_asset, id, data, bucket))
+                    for future in futures:
+                        report.append(future.result())
+                    for item in report:
+                        counts[item['status']] = counts.get(item['status'], 0) + 1
+                    if report_file:
+                        writer.writerows(report)
+                    self.count += len(batch)
+                    self.logger.debug('{} assets processed'.format(self.count))
+        except IOError:
+            error(self.logger, 'Cannot write the report into file')
+        finally:
+            if report_file:
+                report_file.close()
+        self.logger.info('Assets update results: ' + ', '.join('{} {}'.format(key, value) for key, value in sorted(counts.items())))
+        return counts
+
+    @phased('delete')
     def delete(self, endpoint):
         if self.method == 'DELETE':
             if endpoint.get('object') == 'reftable':
@@ -373,7 +1750,7 @@ class RestApiClient:
                     not_implemented(self.logger)
                 self.call_api(endpoint=export_endpoint['endpoint'].format(
                     id=self.refname), method=export_endpoint['http'])
-                data = json.loads(self.result).get('data')
+                data = self.decoded().get('data')
                 for row in self.dict:
                     key = next(iter(row))
                     for item in data.get(key):
@@ -386,17 +1763,18 @@ class RestApiClient:
         else:
             not_implemented(self.logger)
 
+    @phased('write')
     def save_json(self, filename):
-        if self.result:
-            json_text = json.loads(self.result)
+        answer = self.decoded()
+        if answer is not None:
             if filename:
-                # Writing JSON data
+                # Writing JSON data, json.dump writes it by parts without the text of the whole answer
                 try:
                     with open(filename, mode='w', encoding='utf-8') as f:
-                        json.dump(json_text, f, ensure_ascii=False)
+                        json.dump(answer, f, ensure_ascii=False)
                         f.close()
                         self.logger.debug('Json data saved {} objects in the {}'.format(
-                            len(json.loads(self.result)), filename))
+                            len(answer), filename))
                 except IOError as e:
                     self.logger.error(
                         'Cannot write the JSON into file: {}'.format(e))
@@ -404,6 +1782,7 @@ class RestApiClient:
             self.logger.error('No data for export')
             exit(1)
 
+    @phased('read')
     def load_json(self, filename):
         with open(filename, mode='r', encoding='utf-8') as json_file:
             try:
@@ -416,19 +1795,15 @@ class RestApiClient:
         json_file.close()
         return self.result
 
+    @phased('write')
     def save_csv(self, filename, separator=','):
         if self.dict:
-            # print(self.dict)
             # Open CSV-file to export data
             try:
                 with open(filename, 'w', encoding='utf-8', newline='') as csvfile:
-                    writer = csv.DictWriter(
-                        csvfile, fieldnames=self.dict[0].keys(), restval='', extrasaction='ignore', delimiter=separator)
-                    writer.writeheader()
-                    for data in self.dict:
-                        # print(data)
-                        writer.writerow(data)
-                    csvfile.close()
+                    writer = csv.writer(csvfile, delimiter=separator)
+                    writer.writerow(self.dict.columns)
+                    writer.writerows(self.dict.rows)
                     self.logger.debug('{} lines saved to CSV file {}'.format(
                         len(self.dict), filename))
             except IOError:
@@ -437,13 +1812,13 @@ class RestApiClient:
             self.logger.error('No data for export')
             exit(1)
 
+    @phased('read')
     def load_csv(self, filename, separator=','):
         with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
             try:
-                self.dict.clear()
-                csvdata = csv.DictReader(csv_file, delimiter=separator)
-                for row in csvdata:
-                    self.dict.append(dict(row))
+                reader = csv.reader(csv_file, delimiter=separator)
+                columns = next(reader, [])
+                self.dict = Rows(columns, [tuple(row) for row in reader if row])
                 self.logger.debug('{} lines loaded from CSV file {}'.format(
                     len(self.dict), filename))
             except ValueError as e:
@@ -459,122 +1834,47 @@ class RestApiClient:
         self.dict = [row]
         return self.dict
 
+    @phased('write')
     def show(self):
         if self.dict:
             self.logger.debug('Trying to print data on screen')
-            return tabulate(self.dict, headers='keys', tablefmt='github')
+            # tabulate is loaded only when printing is really requested
+            from tabulate import tabulate
+            return tabulate(self.dict.rows, headers=self.dict.columns, tablefmt='github')
         else:
             self.logger.error('No data for printing')
             exit(1)
 
+    @phased('parse')
     def parse_json(self, endpoint):
-        if self.result:
-            self.dict.clear()
-            self.dict=[]
+        if self.answer is not None or self.text:
+            self.dict = Rows()
             try:
                 if endpoint in ['reftable', 'refmap', 'refset', 'refmapset']:
-                    full_list = json.loads(self.result).get('data')
+                    full_list = self.decoded().get('data') or ([] if endpoint == 'refset' else {})
                 elif  endpoint == 'events':
-                    full_list = json.loads(self.result).get('events')
+                    full_list = self.decoded().get('events')
                 else:
-                    full_list = json.loads(self.result)
-                for item in full_list:
-                    item_dict = {}
-                    if endpoint == 'networks':
-                        if 'id' in self.fields:
-                            item_dict.update({'id': item.get('id')})
-                        if 'name' in self.fields:
-                            item_dict.update({'name': item.get('name')})
-                        if 'cidr' in self.fields:
-                            item_dict.update({'cidr': item.get('cidr')})
-                        if 'country_code' in self.fields:
-                            item_dict.update(
-                                {'country_code': item.get('country_code')})
-                        if 'group' in self.fields:
-                            item_dict.update({'group': item.get('group')})
-                        if ('coord_x' in self.fields) or ('coord_y' in self.fields):
-                            coord = item.get('location')
-                            if coord:
-                                coord = coord.get('coordinates')
-                                if coord:
-                                    x = coord[0]
-                                    y = coord[1]
-                                else:
-                                    x = y = 0
-                            else:
-                                x = y = 0
-                            if 'coord_x' in self.fields:
-                                item_dict.update({'coord_x': x})
-                            if 'coord_y' in self.fields:
-                                item_dict.update({'coord_y': y})
-                        if 'description' in self.fields:
-                            item_dict.update(
-                                {'description': item.get('description')})
-                            desc = re.compile(
-                                r"^(?P<vlan>\<\d+\>)?\s*(?P<crit>\[Critical VLAN\])?\s*(?P<wf>\[Wireless\])?\s*(?P<address>.*)$")
-                            m = desc.match(item.get('description'))
-                            if m:
-                                vlan = m.group('vlan')
-                                vlan = vlan[1:-1] if vlan else ''
-                                crit = 1 if m.group('crit') else 0
-                                wf = 1 if m.group('wf') else 0
-                                address = m.group('address')
-                            else:
-                                vlan = address = ''
-                                crit = wf = 0
-                            if 'vlan' in self.fields:
-                                item_dict.update({'vlan': vlan})
-                            if 'critical' in self.fields:
-                                item_dict.update({'critical': crit})
-                            if 'wireless' in self.fields:
-                                item_dict.update({'wireless': wf})
-                            if 'address' in self.fields:
-                                item_dict.update({'address': address})
-                    elif endpoint == 'assets':
-                        if 'id' in self.fields:
-                            item_dict.update({'id': item.get('id')})
-                        if 'IP' in self.fields:
-                            ips = self.getips(item.get('interfaces'))
-                            ip = 'none'
-                            if ips:
-                                ip = ips[0]
-                            item_dict.update({'IP': ip})
-                        properties = item.get('properties')
-                        for property in properties:
-                            if property['name'] in self.fields:
-                                item_dict.update(
-                                    {property['name']: property['value']})
-                    elif endpoint in ['reftables', 'refmaps', 'refsets', 'refmapsets']:
-                        if 'name' in self.fields:
-                            item_dict.update({'name': item.get('name')})
-                        if 'type' in self.fields:
-                            item_dict.update(
-                                {'type': item.get('element_type')})
-                        if 'elements' in self.fields:
-                            item_dict.update(
-                                {'elements': item.get('number_of_elements')})
-                    elif endpoint in ['reftable', 'refmap', 'refset', 'refmapset']:
-                        for field in self.fields:
-                            if field == self.fields[0]:
-                                item_dict.update({field: item})
-                            else:
-                                content = full_list.get(item)
-                                value = ''
-                                if content:
-                                    content = content.get(field)
-                                    if content:
-                                        content = content.get('value')
-                                        if content:
-                                            value = content
-                                if value and field in self.date_fields:
-                                    value = datetime.datetime.fromtimestamp(
-                                        int(value)/1000).strftime(self.dateformat)
-                                item_dict.update({field: value})
-                    elif endpoint=='events':
-                        item_dict.update(item)
-                    else:
-                        not_implemented(self.logger)
-                    self.dict.append(item_dict)
+                    full_list = self.decoded()
+                if endpoint == 'assets':
+                    self.flatten_assets(full_list)
+                elif endpoint == 'reftable':
+                    self.flatten_reference(full_list)
+                elif endpoint in ELEMENT_OBJECTS:
+                    self.dict = Rows(self.fields, self.flatten_elements(endpoint, full_list, self.decoded().get('element_type')))
+                elif endpoint == 'networks':
+                    self.flatten_networks(full_list)
+                elif endpoint in ['reftables', 'refmaps', 'refsets', 'refmapsets']:
+                    listing = dict(LISTING_COLUMNS)
+                    listed = [(column, listing[column]) for column in self.fields if column in listing]
+                    self.dict = Rows([column for column, field in listed],
+                                     [tuple(item.get(field) for column, field in listed) for item in full_list])
+                elif endpoint == 'events':
+                    # Events of one search have the same columns, the union covers the odd ones
+                    columns = list(dict.fromkeys(itertools.chain.from_iterable(full_list)))
+                    self.dict = Rows(columns, [tuple(map(item.get, columns)) for item in full_list])
+                elif full_list:
+                    not_implemented(self.logger)
                 self.logger.debug(
                     'JSON parser successfully processed {} lines'.format(len(self.dict)))
             except Exception as e:
@@ -585,63 +1885,11 @@ class RestApiClient:
             exit(1)
         return self.dict
 
+    @phased('serialise')
     def jsonify(self, endpoint):
         if self.dict:
             self.result = ''
-            jsoned = []
-            for item in self.dict:
-                item_json = {}
-                if endpoint == 'networks':
-                    item_json.update({'id': int(item.get('id'))})
-                    item_json.update({'name': item.get('name')})
-                    item_json.update({'cidr': item.get('cidr')})
-                    if item.get('country_code') != '':
-                        item_json.update(
-                            {'country_code': item.get('country_code')})
-                    item_json.update({'group': item.get('group')})
-                    if (item.get('coord_x') != '0')and(item.get('coord_y') != '0'):
-                        item_json.update({'location': {'coordinates': [float(
-                            item.get('coord_x')), float(item.get('coord_y'))], 'type': 'Point'}})
-                    if item.get('description') != '':
-                        description = item.get('description')
-                    vlan = item.get('vlan')
-                    critical = int(item.get('critical'))
-                    wireless = int(item.get('wireless'))
-                    address = item.get('address')
-                    if not description and (vlan or critical or wireless or address):
-                        description = ''
-                        if vlan:
-                            description = '<'+str(vlan)+'>'
-                        if critical == 1:
-                            description += '[Critical VLAN]'
-                        if wireless == 1:
-                            description += '[Wireless]'
-                        description += address
-                    item_json.update({'description': description})
-                elif endpoint == 'assets':
-                    item_json.update({'id': item.get('id')})
-                    properties = []
-                    for property in self.asset_properties:
-                        if (property['name'] in item.keys()) and (item.get(property['name']) != ''):
-                            properties.append(
-                                {'type_id': property['id'], 'value': item.get(property['name'])})
-                    item_json.update({'properties': properties})
-                elif endpoint in ['reftable', 'refmap', 'refset', 'refmapset']:
-                    temp_json = {}
-                    key = item.pop(self.fields[0])
-                    for field in item.keys():
-                        value = item.get(field)
-                        if field in['Average window','Average MB rate']:
-                            value= value.replace(",",".")
-                        if value and value != '':
-                            if field in self.date_fields:
-                                value = '{:.0f}'.format(datetime.datetime.timestamp(
-                                    datetime.datetime.strptime(value, self.dateformat))*1000)
-                            temp_json.update({field: value})
-                    item_json.update({key: temp_json})
-                else:
-                    not_implemented(self.logger)
-                jsoned.append(item_json)
+            jsoned = self.jsonify_rows(endpoint, self.dict)
             self.dict = jsoned
             self.result = json.dumps(jsoned, ensure_ascii=False)
             self.logger.debug(
@@ -651,6 +1899,202 @@ class RestApiClient:
             exit(1)
         return self.dict
 
+    @phased('serialise')
+    def jsonify_rows(self, endpoint, rows):
+        """Rows of CSV/inline data to objects of the import API"""
+        if endpoint in ['reftable', 'refmap', 'refset', 'refmapset']:
+            return self.jsonify_reference(rows)
+        jsoned = []
+        for item in rows:
+            item_json = {}
+            if endpoint == 'networks':
+                item_json.update({'id': int(item.get('id'))})
+                item_json.update({'name': item.get('name')})
+                item_json.update({'cidr': item.get('cidr')})
+                if item.get('country_code') != '':
+                    item_json.update(
+                        {'country_code': item.get('country_code')})
+                item_json.update({'group': item.get('group')})
+                if (item.get('coord_x') != '0')and(item.get('coord_y') != '0'):
+                    item_json.update({'location': {'coordinates': [float(
+                        item.get('coord_x')), float(item.get('coord_y'))], 'type': 'Point'}})
+                if item.get('description') != '':
+                    description = item.get('description')
+                vlan = item.get('vlan')
+                critical = int(item.get('critical'))
+                wireless = int(item.get('wireless'))
+                address = item.get('address')
+                if not description and (vlan or critical or wireless or address):
+                    description = ''
+                    if vlan:
+                        description = '<'+str(vlan)+'>'
+                    if critical == 1:
+                        description += '[Critical VLAN]'
+                    if wireless == 1:
+                        description += '[Wireless]'
+                    description += address
+                item_json.update({'description': description})
+            elif endpoint == 'assets':
+                item_json.update({'id': item.get('id')})
+                properties = []
+                for property in self.asset_properties:
+                    if (property['name'] in item.keys()) and (item.get(property['name']) != ''):
+                        properties.append(
+                            {'type_id': property['id'], 'value': item.get(property['name'])})
+                item_json.update({'properties': properties})
+            else:
+                not_implemented(self.logger)
+            jsoned.append(item_json)
+        return jsoned
+
+    def flatten_reference(self, data):
+        """Reference table data to rows, DATE columns are converted by batches"""
+        converter = self.converter
+        keys = list(data)
+        columns = {self.fields[0]: keys}
+        for field in self.fields[1:]:
+            if field in columns:
+                continue
+            column = []
+            for key in keys:
+                content = data.get(key)
+                value = ''
+                if content:
+                    content = content.get(field)
+                    if content:
+                        value = content.get('value') or ''
+                column.append(value)
+            if field in self.date_fields:
+                column = converter.to_text(column)
+            columns[field] = column
+        self.dict = Rows(columns, list(zip(*columns.values())))
+        return self.dict
+
+    def flatten_elements(self, objects, data, element_type=None, converter=None, native_dates=False):
+        """Elements of a refset, refmap or refmapset to rows of the output columns. first_seen, last_seen
+        and the values of DATE collections are converted by columns, native_dates leaves first_seen
+        and last_seen in milliseconds for the writers that store dates as they are."""
+        if objects == 'refset':
+            pairs = [('', element) for element in data]
+        elif objects == 'refmap':
+            pairs = list(data.items())
+        else:
+            pairs = [(key, element) for key, elements in data.items() for element in elements]
+        converter = converter or self.converter
+        columns = []
+        for field in self.fields:
+            if field == 'key':
+                columns.append([key for key, element in pairs])
+                continue
+            dated = field in ELEMENT_DATE_FIELDS
+            column = [element.get(field, None if dated and native_dates else '') for key, element in pairs]
+            if (dated and not native_dates) or (field == 'value' and element_type == 'DATE'):
+                column = converter.to_text(column)
+            columns.append(column)
+        return list(zip(*columns))
+
+    def flatten_networks(self, data):
+        """Networks to rows of the NETWORK_COLUMNS that are in the fields, in the order of the fields.
+        The description is parsed when it or any of the columns parsed from it is in the fields."""
+        keep = [NETWORK_COLUMNS.index(field) for field in self.fields if field in NETWORK_COLUMNS]
+        described = any(pos >= NETWORK_COLUMNS.index('description') for pos in keep)
+        project = keep != list(range(len(NETWORK_COLUMNS)))
+        rows = []
+        for item in data:
+            coord = item.get('location')
+            coord = coord.get('coordinates') if coord else None
+            x, y = (coord[0], coord[1]) if coord else (0, 0)
+            description = vlan = address = ''
+            crit = wf = 0
+            if described:
+                description = item.get('description') or ''
+                m = NETWORK_DESCRIPTION.match(description)
+                if m:
+                    vlan = m.group('vlan')
+                    vlan = vlan[1:-1] if vlan else ''
+                    crit = 1 if m.group('crit') else 0
+                    wf = 1 if m.group('wf') else 0
+                    address = m.group('address')
+            row = (item.get('id'), item.get('name'), item.get('cidr'), item.get('country_code'), item.get('group'),
+                   x, y, description, vlan, crit, wf, address)
+            rows.append(tuple(row[pos] for pos in keep) if project else row)
+        self.dict = Rows([NETWORK_COLUMNS[pos] for pos in keep], rows)
+        return self.dict
+
+    def jsonify_reference(self, items):
+        """Rows to bulk_load objects {key: {field: value}}, DATE columns are converted by batches"""
+        converter = self.converter
+        # Rows give a new dict for every row, other rows are copied before the key is popped
+        copy = not isinstance(items, Rows)
+        rows = []
+        for item in items:
+            if copy:
+                item = dict(item)
+            key = item.pop(self.fields[0])
+            for field in DECIMAL_COMMA_FIELDS:
+                if isinstance(item.get(field), str):
+                    item[field] = item[field].replace(',', '.')
+            rows.append((key, item))
+        for field in self.date_fields:
+            column = converter.to_timestamp([item[field] for key, item in rows if item.get(field)])
+            column.reverse()
+            for key, item in rows:
+                if item.get(field):
+                    item[field] = column.pop()
+        return [{key: {field: value for field, value in item.items() if value}} for key, item in rows]
+
+    def flatten_assets(self, full_list):
+        """Flatten asset objects into rows of id, IP and property columns.
+
+        Property names are mapped to column positions once, every asset is
+        written into a preallocated list of slots. Columns of properties that
+        no asset has are dropped."""
+        positions = {}
+        for field in self.fields:
+            positions.setdefault(field, len(positions))
+        columns = list(positions)
+        width = len(columns)
+        used = [False] * width
+        id_pos = positions.get('id')
+        ip_pos = positions.get('IP')
+        for pos in (id_pos, ip_pos):
+            if pos is not None:
+                used[pos] = True
+        position = positions.get
+        select_ip = self.select_ip
+        rows = []
+        for item in full_list:
+            slots = [''] * width
+            if id_pos is not None:
+                slots[id_pos] = item.get('id')
+            if ip_pos is not None:
+                slots[ip_pos] = select_ip(item.get('interfaces') or [])
+            for property in item.get('properties') or []:
+                pos = position(property['name'])
+                if pos is not None:
+                    slots[pos] = property['value']
+                    used[pos] = True
+            rows.append(tuple(slots))
+        keep = [pos for pos in range(width) if used[pos]]
+        if len(keep) < width:
+            # Rows are replaced one by one, so the full and the narrow rows are not kept together
+            for number, row in enumerate(rows):
+                rows[number] = tuple(row[pos] for pos in keep)
+        self.dict = Rows([columns[pos] for pos in keep], rows)
+        return self.dict
+
+    def select_ip(self, interfaces):
+        """Value of the IP column: first address, all addresses or first IPv4 one."""
+        if self.ipselect == 'all':
+            return ' '.join(self.getips(interfaces)) or 'none'
+        for interface in interfaces:
+            for ip in interface.get('ip_addresses', []):
+                value = ip['value']
+                if (value[0:2] != '127') and (value[0] != ':'):
+                    if self.ipselect == 'first' or ':' not in value:
+                        return value
+        return 'none'
+
     def getips(self, interfaces):
         ips = []
         for interface in interfaces:
@@ -660,6 +2104,7 @@ class RestApiClient:
                         ips.append(ip['value'])
         return ips
 
+    @phased('metadata')
     def get_asset_properties(self):
         full_uri = 'https://' + self.server_ip + self.base_uri + \
             'asset_model/properties?fields=id%2C%20name'
@@ -669,7 +2114,7 @@ class RestApiClient:
         headers.update(self.auth)
         self.logger.debug('Sending GET request to: ' + full_uri)
         try:
-            response = requests.get(full_uri, headers=headers, verify=False)
+            response = self.request('GET', full_uri, headers=headers)
             self.logger.debug('Server answer: ' +
                               str(response.status_code))
             if response.status_code != requests.codes.ok:
@@ -681,6 +2126,7 @@ class RestApiClient:
             self.logger.error(e)
             return e
 
+    @phased('metadata')
     def get_ref_fields(self, refname):
         full_uri = 'https://' + self.server_ip + self.base_uri + \
             'reference_data/tables?filter=name%3D%22'+quote(refname)+'%22'
@@ -690,7 +2136,7 @@ class RestApiClient:
         headers.update(self.auth)
         self.logger.debug('Sending GET request to: ' + full_uri)
         try:
-            response = requests.get(full_uri, headers=headers, verify=False)
+            response = self.request('GET', full_uri, headers=headers)
             self.logger.debug('Server answer: ' +
                               str(response.status_code))
             if response.status_code != requests.codes.ok:
@@ -702,6 +2148,7 @@ class RestApiClient:
             self.logger.error(e)
             return e
 
+    @phased('aql')
     def prepare_aql(self, endpoint):
         if self.aql:
             if self.aql[0:6].lower() == 'select'[:]:
@@ -720,15 +2167,14 @@ class RestApiClient:
                     error(self.logger, 'Configuration file "'+CONFIG_NAME +
                           '" is not found, have wrong format, section [AQLS] is missing or AQL "'+self.aql+'" is not found')
             self.call_api(endpoint=url, method='POST', data='')
-            answer = json.loads(self.result)
+            answer = self.decoded()
             search_id = answer.get('search_id')
             self.logger.debug('Search ID = '+search_id)
             progress = 0
             result = ''
             url = endpoint['endpoint']+'/'+search_id
             while not result in ['COMPLETED', 'CANCELED', 'ERROR']:
-                self.call_api(endpoint=url)
-                answer = json.loads(self.result)
+                answer = self.call_api(endpoint=url)
                 progress = answer.get('progress')
                 result = answer.get('status')
                 self.logger.info("Progress - {}%".format(progress))
@@ -746,17 +2192,18 @@ def main():
     # Parse the comand line first
     parser = argparse.ArgumentParser(
         description='Connect to QRadar API and manipulate the data')
-    parser.add_argument('operation', help='export, import, delete, fields')
+    parser.add_argument('operation', help='export, import, delete, fields, count')
     parser.add_argument(
-        'objects', help='what to manipulate: assets, networks, reftables, refmaps, refsets, refmapsets, reftable, events')
+        'objects', help='what to manipulate: assets, networks, reftables, refmaps, refsets, refmapsets, reftable, refset, refmap, refmapset, events. '
+                        'Several comma separated objects for count, reference data objects are counted by collections')
     parser.add_argument(
         '--filter',
         dest='filter',
-        help='Filter to apply to results')
+        help='Filter to apply to results, sent to the API or applied by the script for networks')
     parser.add_argument(
         '--fields',
         dest='fields',
-        help='List of fields to export (no sense for import)')
+        help='Comma separated columns to export (no sense for import), only the API fields they need are requested')
     parser.add_argument(
         '--records',
         dest='records',
@@ -764,7 +2211,8 @@ def main():
     parser.add_argument(
         '--config',
         dest='config_section',
-        help='Configuration section in ' + CONFIG_NAME + ' with QRADAR_IP/TOKEN parameters')
+        help='Configuration section in ' + CONFIG_NAME + ' with QRADAR_IP/TOKEN parameters. '
+             'Several comma separated sections or "all" export from every console into one output')
     parser.add_argument(
         '--host', dest='qradar_ip',
         help='IP Address of QRadar Appliance')
@@ -777,13 +2225,49 @@ def main():
                         help='JSON file you would like to import/export')
     parser.add_argument('--data', dest='values',
                         help='Values to save into object in format "field1=value1,field2=value2". Do not forget to place "id" first!')
+    parser.add_argument('--jsonl', dest='jsonl_filename',
+                        help='JSON Lines file to export the elements of refset, refmap, refmapset to')
+    parser.add_argument('--parquet', dest='parquet_filename',
+                        help='Parquet file to export the elements of refset, refmap, refmapset to, needs pyarrow')
     parser.add_argument('--name', dest='refname',
-                        help='Name of reference object to work with')
+                        help='Name of reference object to work with. Several comma separated names for count and for export of '
+                             'refset, refmap, refmapset elements to CSV, JSON Lines or Parquet')
     parser.add_argument('--aql', dest='aql',
                         help='AQL request to get data for Ariel DB')
+    parser.add_argument('--ip', dest='ipselect', choices=IP_SELECT, default='first',
+                        help='IP of assets to export: first (default), all (space separated) or first IPv4')
+    parser.add_argument('--workers', dest='workers', type=int, default=4,
+                        help='Number of concurrent asset updates and maximum of concurrent requests. Default - 4')
+    parser.add_argument('--limits', dest='limits', default=throttle.DEFAULT_LIMITS,
+                        help='Concurrent requests of endpoints as "METHOD:path=N,..." (METHOD: GET, POST, PUT, DELETE, write or *), '
+                             'the number of requests adapts to latency and 429/503 answers. Default - ' + throttle.DEFAULT_LIMITS),
+    parser.add_argument('--rate', dest='rate', type=float, default=10,
+                        help='Maximum asset updates per second, 0 - no limit. Default - 10')
+    parser.add_argument('--retries', dest='retries', type=int, default=3,
+                        help='Retries of a failed asset update. Default - 3')
+    parser.add_argument('--report', dest='report_filename',
+                        help='CSV file for the results of the asset import')
+    parser.add_argument('--no-diff', dest='diff', action='store_false',
+                        help='Update all assets without comparing with their current properties')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='Stage networks even if the hierarchy is not changed')
+    parser.add_argument('--page-size', dest='page_size', type=int,
+                        help='Export by Range windows / import reference data by chunks of this number of records')
+    parser.add_argument('--checkpoint', dest='checkpoint', action='store_true',
+                        help='Save progress to <file>.journal next to the CSV/JSON file to be able to resume')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Continue the checkpointed run from the last saved position')
+    parser.add_argument('--mirror', dest='mirror_filename',
+                        help='SQLite mirror of reference data (refmirror.py) to read the reference table from')
     parser.add_argument('--dateformat', dest='dateformat',
                         help='Format of the date values in python strftime notation. Default - %%Y-%%m-%%d %%H:%%M:%%S',
                         default='%Y-%m-%d %H:%M:%S')
+    parser.add_argument('--profile', dest='profile', choices=['cprofile', 'sample', 'tracemalloc'],
+                        help='Profile the run by phases: cprofile (pstats file), sample or tracemalloc (folded stacks for flame graphs)')
+    parser.add_argument('--profile-file', dest='profile_filename',
+                        help='File of the profile. Default - ' + SCRIPT_NAME + '.prof or .folded')
+    parser.add_argument('--metrics', dest='metrics_filename',
+                        help='Save telemetry of the API requests (latency histograms by endpoint) as JSON or, for *.prom, as Prometheus metrics')
     parser.add_argument('--screen', dest='screen', action='store_true',
                         help='Print on screen')
     parser.add_argument('-d', dest='debug', action='store_true',
@@ -810,6 +2294,18 @@ def main():
 
     logger.info('====== Script run: ' + str(sys.argv))
 
+    # Telemetry is saved on any exit, failed runs are the interesting ones
+    if args.metrics_filename:
+        atexit.register(telemetry.write, args.metrics_filename)
+
+    # Profiling is started before any request, the report is written at the end or on exit with an error
+    if args.profile:
+        global profiler
+        import runprofile
+        profiler = runprofile.Profiler(args.profile, args.profile_filename or SCRIPT_NAME + runprofile.EXTENSIONS[args.profile], logger)
+        atexit.register(profiler.stop)
+        profiler.start()
+
     # Check for errors in arguments
     # 1) no config or host+token
     if not (args.config_section or args.qradar_ip or args.token):
@@ -829,8 +2325,8 @@ def main():
     # 6) host without token or vise versa
     if not args.config_section and (not args.qradar_ip or not args.token):
         error(logger, 'Host or token option is missing')
-    # 7) records and filters are not supported for networks
-    if args.objects == 'networks' and (args.filter or args.records):
+    # 7) records are not supported for networks, filter is applied to the exported networks by the script
+    if 'networks' in args.objects.split(',') and (args.records or (args.filter and args.operation != 'export')):
         error(logger, 'Filter and Records options are not supported for this export')
     # 8) records, filters, fieds  are not supported for operation fields
     if args.operation == 'fields' and (args.records or args.filter or args.fields):
@@ -848,10 +2344,10 @@ def main():
     if args.tab and not args.csv_filename:
         error(logger, '-t switch can be used only along with CSV export/import')
     # 13) name can be used only with reference objects
-    if args.refname and not(args.objects in ['refmap', 'refset', 'refmapset', 'reftable']):
+    if args.refname and not all(name in ['refmap', 'refset', 'refmapset', 'reftable'] for name in args.objects.split(',')):
         error(logger, 'Name cannot be used for objects other than Reference Data')
-    # 14) for reference objects name must be used
-    if not args.refname and (args.objects in ['refmap', 'refset', 'refmapset', 'reftable']):
+    # 14) for reference objects name must be used, count without name counts all collections
+    if not args.refname and (args.objects in ['refmap', 'refset', 'refmapset', 'reftable']) and args.operation != 'count':
         error(logger, 'Name must be given for all Reference Data objects')
     # 15) -r can be used only with import and reference data
     if args.rowbyrow and not(args.objects in ['refmap', 'refset', 'refmapset', 'reftable'] and args.operation == 'import'):
@@ -862,20 +2358,64 @@ def main():
     # 17) aql can be used only with events object
     if args.objects != 'events' and args.aql:
         error(logger, 'AQL can be specified only for events')
+    # 18) report is written only for assets import
+    if args.report_filename and not (args.objects == 'assets' and args.operation == 'import'):
+        error(logger, 'Report can be saved only for import of assets')
+    # 19) checkpoints are saved next to the CSV or JSON file
+    if (args.checkpoint or args.resume) and not (args.csv_filename or args.json_filename):
+        error(logger, 'Checkpoint and resume need CSV or JSON file')
+    # 20) networks are exported and imported by one request
+    if args.objects == 'networks' and (args.page_size or args.checkpoint or args.resume):
+        error(logger, 'Page size, checkpoint and resume are not supported for networks')
+    # 21) Range windows are used only for export, chunks only for reference data import
+    if args.page_size and args.operation == 'import' and not (args.objects in ['refmap', 'refset', 'refmapset', 'reftable']):
+        error(logger, 'Page size can be used for import of Reference Data only')
+    if args.page_size and args.records:
+        error(logger, 'Page size and records options cannot be used together')
+    # 22) the mirror keeps whole reference tables
+    if args.mirror_filename and not (args.operation == 'export' and args.objects == 'reftable'):
+        error(logger, 'Mirror can be used only for export of reftable')
+    if args.mirror_filename and (args.records or args.checkpoint or args.resume):
+        error(logger, 'Mirror cannot be used together with records, checkpoint or resume options')
+
+    # 23) several consoles are exported concurrently into one output
+    fan_out = args.config_section and (',' in args.config_section or args.config_section.lower() == 'all')
+    if fan_out and args.operation != 'export':
+        error(logger, 'Several config sections can be used only for export')
+    if fan_out and (args.checkpoint or args.resume or args.mirror_filename):
+        error(logger, 'Several config sections cannot be used together with checkpoint, resume or mirror options')
+    # 24) limits of endpoints
+    try:
+        throttle.parse_limits(args.limits)
+    except ValueError:
+        error(logger, 'Wrong format of limits: ' + args.limits)
+    # 25) count sends one small request per object or collection
+    if args.operation == 'count' and (args.fields or args.records or args.page_size or args.checkpoint or args.resume
+                                      or args.mirror_filename or args.aql):
+        error(logger, 'Fields, records, page size, checkpoint, resume, mirror and AQL options cannot be used with count')
+    # 26) elements of refset, refmap and refmapset are written by pages to one CSV, JSON Lines or Parquet file
+    elements = element_output(args)
+    if (args.jsonl_filename or args.parquet_filename) and not (args.operation == 'export' and args.objects in ELEMENT_OBJECTS):
+        error(logger, 'JSON Lines and Parquet can be used only for export of refset, refmap, refmapset')
+    if len([name for name in [args.csv_filename, args.jsonl_filename, args.parquet_filename] if name]) > 1:
+        error(logger, 'Only one of CSV, JSON Lines and Parquet files is allowed')
+    if elements and (args.json_filename or args.screen):
+        error(logger, 'JSON and screen cannot be used together with CSV, JSON Lines or Parquet export of elements')
+    if elements and (args.records or args.checkpoint or args.resume or fan_out):
+        error(logger, 'Records, checkpoint, resume and several config sections are not supported for export of elements')
+    if args.refname and ',' in args.refname and args.operation != 'count' and not elements:
+        error(logger, 'Several names can be used only for count and for export of elements to CSV, JSON Lines or Parquet')
+    if args.parquet_filename:
+        try:
+            import pyarrow
+        except ImportError:
+            error(logger, 'Parquet needs pyarrow module: pip install pyarrow')
 
     # Read the config
+    consoles = []
     if args.config_section:
-        config = configparser.ConfigParser()
-        try:
-            config.read(CONFIG_NAME)
-            logger.debug('CONFIG_NAME=' + CONFIG_NAME)
-            args.qradar_ip = config[args.config_section.upper()]['QRADAR_IP']
-            logger.debug('Read from config: QRADAR_IP=' + args.qradar_ip)
-            args.token = config[args.config_section.upper()]['TOKEN']
-            logger.debug('Read from config: TOKEN=' + args.token)
-        except:
-            error(logger,
-                  'Configuration file "'+CONFIG_NAME+'" is not found, have wrong format or section ['+args.config_section.upper()+'] is missing')
+        consoles = read_consoles(args.config_section, logger)
+        args.qradar_ip, args.token = consoles[0][1], consoles[0][2]
 
     # Check CSV separator
     if args.tab:
@@ -889,19 +2429,195 @@ def main():
         if (object['object'] == args.objects) and ((object['method'] == args.operation) or ((args.operation == 'fields')and (object['method'] == 'export'))):
             endpoint = object
             found = True
+    if args.operation == 'count':
+        # The client is set up by the first object, every object must be countable
+        counted = [object for name in args.objects.split(',') for object in endpoints
+                   if object['object'] == name and object['method'] == 'count']
+        found = len(counted) == len(args.objects.split(','))
+        if found:
+            endpoint = counted[0]
     if (not found) and (args.operation != 'fields'):
         not_implemented(logger)
 
     logger.debug('Endpoint = '+endpoint['endpoint'])
 
+    if fan_out:
+        export_consoles(args, consoles, endpoint, separator, logger)
+        if profiler:
+            profiler.stop()
+        logger.info('Done')
+        exit(0)
+
     qrclient = RestApiClient(args.qradar_ip, args.token,
-                             endpoint, logger, args.filter, args.fields, args.records, args.refname, args.dateformat, args.rowbyrow, args.aql)
+                             endpoint, logger, args.filter, args.fields, args.records, args.refname, args.dateformat, args.rowbyrow, args.aql, args.ipselect,
+                             args.workers, args.rate, args.retries, args.diff, args.force, args.page_size, args.limits)
 
-    if args.operation == 'export':
-        logger.debug('Trying to export data')
+    # Journal of the checkpointed run
+    journal = None
+    if args.checkpoint or args.resume:
+        filename = args.csv_filename or args.json_filename
+        if args.operation == 'export' and not qrclient.page_size:
+            qrclient.page_size = 1000
+        signature = {'operation': args.operation, 'objects': args.objects, 'filter': args.filter, 'fields': args.fields,
+                     'name': args.refname, 'aql': args.aql, 'page_size': qrclient.page_size, 'rowbyrow': args.rowbyrow}
+        if args.operation == 'import':
+            signature['file'] = [os.path.getsize(filename), os.path.getmtime(filename)]
+        journal = Journal(filename, signature, args.resume, logger)
+        qrclient.journal = journal
+
+    try:
+        run_operation(args, qrclient, endpoint, separator, logger)
+    except ApiError as e:
+        error(logger, 'Stopped by failed request ({}). Run again with --resume to continue'.format(e))
+    for stats in qrclient.controller.stats():
+        logger.debug('Concurrency: ' + ', '.join('{}={}'.format(key, value) for key, value in stats.items()))
+    received, decoded = telemetry.transferred()
+    if decoded:
+        logger.info('Answers: {} bytes received, {} bytes decoded'.format(received, decoded))
+    if journal:
+        journal.close()
+    if profiler:
+        profiler.stop()
+    logger.info('Done')
+    exit(0)
+
+
+def read_consoles(sections, logger):
+    """(section, QRADAR_IP, TOKEN) of the comma separated config sections, all sections with QRADAR_IP for "all" """
+    config = configparser.ConfigParser()
+    try:
+        config.read(CONFIG_NAME)
+        logger.debug('CONFIG_NAME=' + CONFIG_NAME)
+        if sections.lower() == 'all':
+            names = [name for name in config.sections() if 'QRADAR_IP' in config[name]]
+        else:
+            names = [name.strip().upper() for name in sections.split(',') if name.strip()]
+        consoles = []
+        for name in names:
+            consoles.append((name, config[name]['QRADAR_IP'], config[name]['TOKEN']))
+            logger.debug('Read from config: [{}] QRADAR_IP={} TOKEN={}'.format(*consoles[-1]))
+    except:
+        error(logger,
+              'Configuration file "'+CONFIG_NAME+'" is not found, have wrong format or section ['+sections.upper()+'] is missing')
+    if not consoles:
+        error(logger, 'No consoles with QRADAR_IP in configuration file "'+CONFIG_NAME+'"')
+    return consoles
+
+
+@phased('console')
+def export_console(args, console, endpoint):
+    """Export of one console of the fan-out, returns the client with parsed rows or None if the export failed"""
+    name, qradar_ip, token = console
+    # Messages of every console go to the same log with the section in the logger name
+    logger = logging.getLogger(SCRIPT_NAME + '.' + name)
+    started = time.perf_counter()
+    try:
+        qrclient = RestApiClient(qradar_ip, token, endpoint, logger, args.filter, args.fields, args.records, args.refname, args.dateformat, args.rowbyrow, args.aql, args.ipselect,
+                                 args.workers, args.rate, args.retries, args.diff, args.force, args.page_size, args.limits)
+        if args.fields or not args.json_filename:
+            qrclient.project(args.objects)
         if args.aql:
             qrclient.prepare_aql(endpoint)
-        result = qrclient.call_api()
+        if qrclient.page_size:
+            qrclient.export_pages(args.objects)
+        else:
+            qrclient.call_api()
+        qrclient.filter_answer()
+        if args.csv_filename or args.screen:
+            qrclient.parse_json(args.objects)
+    except (Exception, SystemExit) as e:
+        # call_api and the parsers stop the script with exit(), here only this console is stopped
+        logger.error('Export from {} ({}) failed: {}'.format(name, qradar_ip, e))
+        return None
+    logger.info('Export from {} done in {:.2f} seconds'.format(name, time.perf_counter() - started))
+    return qrclient
+
+
+def export_consoles(args, consoles, endpoint, separator, logger):
+    """Run the export against every console concurrently and save one merged output.
+    CSV and screen rows get the "console" column, JSON is an object with the answer of every console."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(consoles)) as executor:
+        clients = list(executor.map(lambda console: export_console(args, console, endpoint), consoles))
+    failed = [console[0] for console, qrclient in zip(consoles, clients) if qrclient is None]
+    done = [(console[0], qrclient) for console, qrclient in zip(consoles, clients) if qrclient is not None]
+    if not done:
+        error(logger, 'Export failed for all consoles')
+
+    # The merged data is saved by the client of the first console, rows keep the order of the sections
+    merged = done[0][1]
+    if args.csv_filename or args.screen:
+        columns = list(dict.fromkeys(['console'] + [column for name, qrclient in done for column in qrclient.dict.columns]))
+        rows = []
+        for name, qrclient in done:
+            # Positions of the merged columns in the rows of this console, None for the missing ones
+            positions = [qrclient.dict.columns.index(column) if column in qrclient.dict.columns else None
+                         for column in columns[1:]]
+            for row in qrclient.dict.rows:
+                rows.append((name,) + tuple('' if pos is None else row[pos] for pos in positions))
+        merged.dict = Rows(columns, rows)
+        if args.csv_filename:
+            merged.save_csv(args.csv_filename, separator)
+        if args.screen:
+            print(merged.show())
+    if args.json_filename:
+        merged.set_answer({name: qrclient.decoded() for name, qrclient in done})
+        merged.save_json(args.json_filename)
+    logger.info('{} consoles exported'.format(len(done)))
+    if failed:
+        error(logger, 'Export failed for consoles: ' + ', '.join(failed))
+
+
+def element_output(args):
+    """(filename, format) of the export of refset, refmap, refmapset elements by pages, None for other runs"""
+    if args.operation == 'export' and args.objects in ELEMENT_OBJECTS:
+        for filename, format in zip([args.csv_filename, args.jsonl_filename, args.parquet_filename], RowWriter.FORMATS):
+            if filename:
+                return filename, format
+    return None
+
+
+def export_collections(args, qrclient, endpoint, separator, logger):
+    """Export the elements of the named collections concurrently into one file,
+    rows get the "name" column of their collection when several names are given"""
+    logger.debug('Trying to export elements')
+    filename, format = element_output(args)
+    names = [name.strip() for name in args.refname.split(',') if name.strip()]
+    columns = (['name'] if len(names) > 1 else []) + qrclient.fields
+    writer = RowWriter(filename, format, columns, separator, ELEMENT_DATE_FIELDS)
+    try:
+        counts = qrclient.export_elements(args.objects, endpoint, names, writer)
+    finally:
+        writer.close()
+    failed = [name for name, count in counts.items() if count is None]
+    logger.info('{} rows of {} collections saved to {}'.format(writer.count, len(names) - len(failed), filename))
+    if failed:
+        error(logger, 'Export failed for collections: ' + ', '.join(failed))
+
+
+def run_operation(args, qrclient, endpoint, separator, logger):
+    journal = qrclient.journal
+    if element_output(args):
+        export_collections(args, qrclient, endpoint, separator, logger)
+    elif args.operation == 'export':
+        logger.debug('Trying to export data')
+        # JSON keeps whole objects unless the fields are given
+        if args.fields or not args.json_filename:
+            qrclient.project(args.objects)
+        if args.aql:
+            if journal and journal.state.get('endpoint'):
+                # The search of the interrupted run is read again
+                qrclient.endpoint = journal.state['endpoint']
+            else:
+                qrclient.prepare_aql(endpoint)
+                if journal:
+                    journal.set_state('endpoint', qrclient.endpoint)
+        if args.mirror_filename:
+            result = qrclient.read_mirror(args.mirror_filename)
+        elif qrclient.page_size:
+            result = qrclient.export_pages(args.objects)
+        else:
+            result = qrclient.call_api()
+        qrclient.filter_answer()
         if args.csv_filename:
             qrclient.parse_json(args.objects)
             qrclient.save_csv(args.csv_filename, separator)
@@ -917,6 +2633,24 @@ def main():
         print('Fields available for export:')
         print(qrclient.fields)
 
+    if args.operation == 'count':
+        logger.debug('Counting records')
+        rows = qrclient.count_objects(args.objects.split(','), args.refname.split(',') if args.refname else None)
+        if args.csv_filename:
+            qrclient.save_csv(args.csv_filename, separator)
+        if args.json_filename:
+            qrclient.set_answer(list(rows))
+            qrclient.save_json(args.json_filename)
+        if args.screen:
+            print(qrclient.show())
+        if not (args.csv_filename or args.json_filename or args.screen):
+            for row in rows.rows:
+                print('\t'.join('' if value is None else str(value) for value in row))
+        failed = [row for row in rows.rows if row[2] is None]
+        if failed:
+            error(logger, '{} of {} counts failed'.format(len(failed), len(rows)))
+        logger.info('{} counts done'.format(len(rows)))
+
     if args.operation == 'delete':
         logger.debug('Deleting records with specified keys')
         if args.json_filename:
@@ -932,20 +2666,29 @@ def main():
 
     if args.operation == 'import':
         logger.debug('Trying to import data')
+        batches = None
         if args.json_filename:
             qrclient.load_json(args.json_filename)
             qrclient.parse_json(args.objects)
             qrclient.jsonify(args.objects)
-        if args.csv_filename:
+        if args.csv_filename and args.objects == 'networks':
+            # The hierarchy is validated and staged as a whole
             qrclient.load_csv(args.csv_filename, separator)
             qrclient.jsonify(args.objects)
+        elif args.csv_filename:
+            batches = qrclient.stream(args.objects, qrclient.read_csv(args.csv_filename, separator))
         if args.values:
             qrclient.parse_inline(args.values)
             qrclient.jsonify(args.objects)
-        qrclient.write_api(endpoint)
-        logger.info(str(len(qrclient.dict))+' records updated')
-    logger.info('Done')
-    exit(0)
+        qrclient.write_api(endpoint, batches, args.report_filename, separator)
+        if batches is not None and not qrclient.count:
+            error(logger, 'No data for import')
+        if qrclient.report_counts.get('failed'):
+            error(logger, 'Some assets were not updated')
+        if qrclient.report_counts:
+            logger.info(str(qrclient.report_counts.get('updated', 0))+' records updated')
+        else:
+            logger.info(str(qrclient.count)+' records updated')
 
 
 if __name__ == '__main__':
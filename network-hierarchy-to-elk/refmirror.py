@@ -0,0 +1,328 @@
+#!/bin/python
+# refmirror
+# Local SQLite mirror of QRadar reference data
+#
+# Reference sets, maps, maps of sets and tables are kept in an indexed SQLite
+# database. A refresh reads the listings of the collections (the same endpoints
+# that "qapi-export.py export refsets/reftables" parses) and downloads only the
+# collections whose number_of_elements or metadata changed since the last
+# refresh, so reading reference data locally costs one listing request per kind.
+# The listing does not show changes that keep the number of elements, use
+# --max-age to download collections older than that anyway.
+#
+# Usage:
+#       >   python3 refmirror.py refresh --config main --db refdata.db
+#       >   python3 refmirror.py refresh --host siem.domain.com --token TOKEN --db refdata.db --kinds sets tables --max-age 86400
+#       >   python3 refmirror.py status --db refdata.db
+#       >   python3 refmirror.py query --db refdata.db --kind sets --name "Admins" --value "jdoe"
+#       >   python3 refmirror.py diff --db refdata.db --kind sets --name "Admins HQ" --other "Admins RC"
+#
+import argparse
+import concurrent.futures
+import configparser
+import itertools
+import json
+import sqlite3
+import sys
+import time
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+# Collections of reference data, names are the ones of the API paths
+KINDS = ['sets', 'maps', 'map_of_sets', 'tables']
+
+# Connection settings are shared with qapi-export.py
+CONFIG_NAME = 'qapi-export.conf'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    number_of_elements INTEGER,
+    metadata TEXT NOT NULL,
+    refreshed REAL NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+CREATE TABLE IF NOT EXISTS elements (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT,
+    first_seen INTEGER,
+    last_seen INTEGER,
+    source TEXT,
+    position INTEGER,
+    PRIMARY KEY (kind, name, key, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS elements_value ON elements (value, kind, name);
+CREATE INDEX IF NOT EXISTS elements_position ON elements (kind, name, position);
+"""
+
+
+class Api:
+    """Minimal GET client of the reference data endpoints."""
+
+    def __init__(self, host, token, workers=4):
+        self.base = 'https://' + host + '/api/reference_data/'
+        self.headers = {'Accept': 'application/json', 'Version': '11.0', 'SEC': token}
+        self.session = requests.session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+
+    def get(self, path, first=None, last=None):
+        headers = dict(self.headers)
+        if first is not None:
+            headers['Range'] = 'items={}-{}'.format(first, last)
+        response = self.session.get(self.base + path, headers=headers, verify=False)
+        response.raise_for_status()
+        return response.json(), response.headers.get('Content-Range', '')
+
+    def listing(self, kind, name=None):
+        path = kind
+        if name is not None:
+            path += '?filter=' + quote('name="{}"'.format(name))
+        return self.get(path)[0]
+
+    def content(self, kind, name, page_size=10000):
+        """Full content of one collection, read by Range windows of page_size elements"""
+        path = kind + '/' + quote(name, safe='')
+        content = None
+        first = 0
+        while True:
+            answer, content_range = self.get(path, first, first + page_size - 1)
+            data = answer.get('data') or ([] if kind == 'sets' else {})
+            if content is None:
+                content = answer
+                content['data'] = data
+            elif kind == 'sets':
+                content['data'].extend(data)
+            else:
+                content['data'].update(data)
+            total = int(content_range.rsplit('/', 1)[1]) if '/' in content_range else None
+            first += page_size
+            if not data or len(data) < page_size or (total is not None and first >= total):
+                return content
+
+
+def text(value):
+    # Values are kept as text, a missing one is NULL
+    return None if value is None else str(value)
+
+
+def element_rows(kind, name, data):
+    """(kind, name, key, field, value, first_seen, last_seen, source, position) of the collection content,
+    position keeps the order of the API answer"""
+    position = itertools.count()
+
+    def row(key, field, element):
+        return (kind, name, key, field, text(element.get('value')), element.get('first_seen'),
+                element.get('last_seen'), element.get('source'), next(position))
+    # key and field are parts of the primary key, missing values are empty there
+    if kind == 'sets':
+        for element in data:
+            yield row(text(element.get('value')) or '', '', element)
+    elif kind == 'maps':
+        for key, element in data.items():
+            yield row(key, '', element)
+    elif kind == 'map_of_sets':
+        for key, elements in data.items():
+            for element in elements:
+                yield row(key, text(element.get('value')) or '', element)
+    else:
+        for key, fields in data.items():
+            for field, element in fields.items():
+                yield row(key, field, element)
+
+
+def metadata(item):
+    # Everything the listing says about a collection, in comparable form
+    return json.dumps(item, sort_keys=True, ensure_ascii=False)
+
+
+class RefMirror:
+    """SQLite mirror of reference data collections."""
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        # WAL lets readers query the mirror while it is refreshed
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA cache_size=-65536')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(elements)')]
+        if columns and 'position' not in columns:
+            # Mirror of an older version without the order of the elements, it is downloaded again
+            self.db.executescript('DROP TABLE elements; DROP TABLE collections;')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def collections(self, kind=None):
+        """{(kind, name): (number_of_elements, metadata, refreshed)}"""
+        query = 'SELECT kind, name, number_of_elements, metadata, refreshed FROM collections'
+        rows = self.db.execute(query + ' WHERE kind = ?', (kind,)) if kind else self.db.execute(query)
+        return {(row[0], row[1]): row[2:] for row in rows}
+
+    def stale(self, kinds, listings, full=False, max_age=None, names=None):
+        """Collections of the listings that have to be downloaded"""
+        known = self.collections()
+        now = time.time()
+        result = []
+        for kind in kinds:
+            for item in listings[kind]:
+                if names and item['name'] not in names:
+                    continue
+                stored = known.get((kind, item['name']))
+                if full or stored is None or stored[0] != item.get('number_of_elements') or stored[1] != metadata(item) or \
+                        (max_age is not None and now - stored[2] > max_age):
+                    result.append((kind, item))
+        return result
+
+    def store(self, kind, item, content):
+        """Replace the elements of one collection in one transaction"""
+        with self.db:
+            self.db.execute('DELETE FROM elements WHERE kind = ? AND name = ?', (kind, item['name']))
+            self.db.executemany('INSERT OR REPLACE INTO elements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                element_rows(kind, item['name'], content.get('data') or []))
+            self.db.execute('INSERT OR REPLACE INTO collections VALUES (?, ?, ?, ?, ?)',
+                            (kind, item['name'], item.get('number_of_elements'), metadata(item), time.time()))
+
+    def drop_missing(self, kinds, listings, names=None):
+        """Remove collections that are not in the listings any more"""
+        removed = 0
+        with self.db:
+            for (kind, name) in self.collections():
+                if kind in kinds and (not names or name in names) and name not in {item['name'] for item in listings[kind]}:
+                    self.db.execute('DELETE FROM elements WHERE kind = ? AND name = ?', (kind, name))
+                    self.db.execute('DELETE FROM collections WHERE kind = ? AND name = ?', (kind, name))
+                    removed += 1
+        return removed
+
+    def refresh(self, api, kinds=KINDS, names=None, full=False, max_age=None, workers=4, page_size=10000):
+        """Download changed collections. Returns counts of checked, downloaded and removed collections."""
+        if names and len(names) == 1:
+            # One collection is checked by a filtered listing
+            listings = {kind: api.listing(kind, names[0]) for kind in kinds}
+        else:
+            listings = {kind: api.listing(kind) for kind in kinds}
+        stale = self.stale(kinds, listings, full, max_age, names)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(api.content, kind, item['name'], page_size): (kind, item) for kind, item in stale}
+            for future in concurrent.futures.as_completed(futures):
+                kind, item = futures[future]
+                self.store(kind, item, future.result())
+        return {'checked': sum(len(items) for items in listings.values()), 'downloaded': len(stale),
+                'removed': self.drop_missing(kinds, listings, names)}
+
+    def content(self, kind, name):
+        """Collection in the shape of the API answer (reference_data/<kind>/<name>), None if it is not mirrored"""
+        row = self.db.execute('SELECT metadata FROM collections WHERE kind = ? AND name = ?', (kind, name)).fetchone()
+        if row is None:
+            return None
+        content = json.loads(row[0])
+        rows = self.db.execute('SELECT key, field, value, first_seen, last_seen, source FROM elements '
+                               'WHERE kind = ? AND name = ? ORDER BY position', (kind, name))
+        if kind == 'sets':
+            data = []
+        else:
+            data = {}
+        for key, field, value, first_seen, last_seen, source in rows:
+            element = {'value': value, 'first_seen': first_seen, 'last_seen': last_seen, 'source': source}
+            if kind == 'sets':
+                data.append(element)
+            elif kind == 'maps':
+                data[key] = element
+            elif kind == 'map_of_sets':
+                data.setdefault(key, []).append(element)
+            else:
+                data.setdefault(key, {})[field] = element
+        content['data'] = data
+        return content
+
+    def query(self, kind=None, name=None, value=None, key=None):
+        """Elements filtered by any of kind, name, key and value"""
+        conditions = []
+        params = []
+        for column, param in (('kind', kind), ('name', name), ('key', key), ('value', value)):
+            if param is not None:
+                conditions.append(column + ' = ?')
+                params.append(param)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return self.db.execute('SELECT kind, name, key, field, value FROM elements' + where + ' ORDER BY kind, name, key, field', params).fetchall()
+
+    def diff(self, kind, name, other):
+        """Keys/values of collection name that are not in other and vice versa"""
+        query = ('SELECT key, field, value FROM elements WHERE kind = ? AND name = ? EXCEPT '
+                 'SELECT key, field, value FROM elements WHERE kind = ? AND name = ? ORDER BY 1, 2')
+        only_name = self.db.execute(query, (kind, name, kind, other)).fetchall()
+        only_other = self.db.execute(query, (kind, other, kind, name)).fetchall()
+        return only_name, only_other
+
+
+def connection(args):
+    # Host and token from the command line or from the qapi-export.py configuration
+    if args.config_section:
+        config = configparser.ConfigParser()
+        config.read(CONFIG_NAME)
+        try:
+            section = config[args.config_section.upper()]
+            return section['QRADAR_IP'], section['TOKEN']
+        except KeyError:
+            sys.exit('Section [{}] with QRADAR_IP/TOKEN is not found in {}'.format(args.config_section.upper(), CONFIG_NAME))
+    if not (args.qradar_ip and args.token):
+        sys.exit('Connection data is missing: use --config or --host and --token')
+    return args.qradar_ip, args.token
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SQLite mirror of QRadar reference data')
+    parser.add_argument('operation', help='refresh, status, query, diff')
+    parser.add_argument('--db', dest='db_filename', required=True, help='SQLite database of the mirror')
+    parser.add_argument('--config', dest='config_section', help='Configuration section in ' + CONFIG_NAME + ' with QRADAR_IP/TOKEN parameters')
+    parser.add_argument('--host', dest='qradar_ip', help='IP Address of QRadar Appliance')
+    parser.add_argument('--token', dest='token', help='SEC Token')
+    parser.add_argument('--kinds', nargs='*', choices=KINDS, default=KINDS, help='collections to refresh. Default - all')
+    parser.add_argument('--kind', choices=KINDS, help='collection kind for query and diff')
+    parser.add_argument('--name', help='collection name to refresh, query or diff')
+    parser.add_argument('--other', help='second collection for diff')
+    parser.add_argument('--key', help='key to query')
+    parser.add_argument('--value', help='value to query')
+    parser.add_argument('--full', action='store_true', help='download all collections, changed or not')
+    parser.add_argument('--max-age', dest='max_age', type=float, help='download collections refreshed more than this number of seconds ago')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent downloads. Default - 4')
+    parser.add_argument('--page-size', dest='page_size', type=int, default=10000, help='elements per Range window. Default - 10000')
+    args = parser.parse_args()
+
+    mirror = RefMirror(args.db_filename)
+    if args.operation == 'refresh':
+        host, token = connection(args)
+        started = time.perf_counter()
+        stats = mirror.refresh(Api(host, token, args.workers), args.kinds, [args.name] if args.name else None,
+                               args.full, args.max_age, args.workers, args.page_size)
+        print('{checked} collections checked, {downloaded} downloaded, {removed} removed'.format(**stats) +
+              ' in {:.2f}s'.format(time.perf_counter() - started))
+    elif args.operation == 'status':
+        for (kind, name), (count, meta, refreshed) in sorted(mirror.collections().items()):
+            print('{}\t{}\t{}\t{}'.format(kind, name, count, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(refreshed))))
+    elif args.operation == 'query':
+        for row in mirror.query(args.kind, args.name, args.value, args.key):
+            print('\t'.join(str(column) for column in row))
+    elif args.operation == 'diff':
+        if not (args.kind and args.name and args.other):
+            parser.error('diff needs --kind, --name and --other')
+        only_name, only_other = mirror.diff(args.kind, args.name, args.other)
+        for prefix, rows in (('-', only_name), ('+', only_other)):
+            for key, field, value in rows:
+                print('{} {}\t{}\t{}'.format(prefix, key, field, value))
+    else:
+        parser.error('Unknown operation ' + args.operation)
+    mirror.close()
+    exit(0)
+
+
+if __name__ == '__main__':
+    main()
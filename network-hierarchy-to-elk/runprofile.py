@@ -0,0 +1,168 @@
+# runprofile
+# Profiling of qapi-export.py runs (--profile)
+#
+# The run is split into phases (metadata, call_api, aql, parse, serialise, read, write ...) by the
+# methods of RestApiClient, wall time of every phase is counted without its nested phases.
+# A phase entered again inside itself (jsonify -> jsonify_rows) is counted once.
+# Modes:
+#   cprofile    - cProfile of the whole run with the worker threads, saved as pstats (snakeviz, flameprof, gprof2dot)
+#   sample      - stacks of all threads every SAMPLE_INTERVAL seconds with the phases as root
+#                 frames, saved as folded stacks (flamegraph.pl, speedscope, inferno)
+#   tracemalloc - memory allocated by every phase and allocation sites of the data kept at
+#                 the end of the run, saved as folded stacks weighted by bytes
+#
+# The module is imported only when --profile is given, so runs without it do not pay for it.
+#
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+MODES = ['cprofile', 'sample', 'tracemalloc']
+EXTENSIONS = {'cprofile': '.prof', 'sample': '.folded', 'tracemalloc': '.folded'}
+
+# Interval between the stack samples, s
+SAMPLE_INTERVAL = 0.005
+# Frames kept for every allocation in tracemalloc mode
+TRACE_FRAMES = 5
+
+
+def frame_name(code):
+    return '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+
+
+class Profiler:
+    """Phases of the run and the profiler of the chosen mode"""
+
+    def __init__(self, mode, filename, logger):
+        self.mode = mode
+        self.filename = filename
+        self.logger = logger
+        # Phases entered by every thread: {thread id: [[name, started, nested time, memory at start]]}
+        self.stacks = {}
+        # {phase path: [calls, seconds, bytes]}
+        self.totals = {}
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.started = None
+        self.stopped = False
+        self.profile = None
+        # Profiles of the threads started during the run, merged into the report
+        self.thread_profiles = []
+        self.sampler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            # Before 3.12 cProfile sees only the thread that enabled it, since 3.12 it sees all threads
+            if sys.version_info < (3, 12):
+                threading.setprofile(self.thread_profile)
+        elif self.mode == 'sample':
+            self.sampler = threading.Thread(target=self.sample, name='profiler', daemon=True)
+            self.sampler.start()
+        elif self.mode == 'tracemalloc':
+            tracemalloc.start(TRACE_FRAMES)
+
+    def thread_profile(self, frame, event, arg):
+        # Called by the first event of every new thread, the thread gets its own profile instead
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.stacks.setdefault(threading.get_ident(), [])
+        if stack and stack[-1][0] == name:
+            yield
+            return
+        memory = tracemalloc.get_traced_memory()[0] if self.mode == 'tracemalloc' else 0
+        stack.append([name, time.perf_counter(), 0.0, memory])
+        try:
+            yield
+        finally:
+            path = ';'.join(frame[0] for frame in stack)
+            name, started, nested, memory = stack.pop()
+            elapsed = time.perf_counter() - started
+            if stack:
+                stack[-1][2] += elapsed
+            allocated = tracemalloc.get_traced_memory()[0] - memory if self.mode == 'tracemalloc' else 0
+            with self.lock:
+                total = self.totals.setdefault(path, [0, 0.0, 0])
+                total[0] += 1
+                total[1] += elapsed - nested
+                total[2] += allocated
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopped:
+            time.sleep(SAMPLE_INTERVAL)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(frame_name(frame.f_code))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                phases = [item[0] for item in list(self.stacks.get(ident, []))]
+                key = ';'.join([names.get(ident, 'thread')] + phases + frames[::-1])
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def allocations(self):
+        """Folded stacks of the memory still allocated, weighted by bytes"""
+        folded = {}
+        for statistic in tracemalloc.take_snapshot().statistics('traceback'):
+            frames = ['{}:{}'.format(os.path.basename(frame.filename), frame.lineno) for frame in statistic.traceback]
+            key = ';'.join(frames)
+            folded[key] = folded.get(key, 0) + statistic.size
+        return folded
+
+    def stop(self):
+        """Stop profiling and write the report, the second call does nothing"""
+        if self.stopped or self.started is None:
+            return
+        self.stopped = True
+        wall = time.perf_counter() - self.started
+        folded = None
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            threading.setprofile(None)
+            stats = pstats.Stats(self.profile)
+            with self.lock:
+                for profile in self.thread_profiles:
+                    # The worker threads are finished, the calls still open in them are closed here
+                    profile.create_stats()
+                    if profile.stats:
+                        stats.add(profile)
+            stats.dump_stats(self.filename)
+        elif self.mode == 'sample':
+            self.sampler.join()
+            folded = self.samples
+        elif self.mode == 'tracemalloc':
+            peak = tracemalloc.get_traced_memory()[1]
+            folded = self.allocations()
+            tracemalloc.stop()
+            self.logger.info('Profile: peak of traced memory {:.1f} MB'.format(peak / 1048576.0))
+        if folded is not None:
+            with open(self.filename, 'w', encoding='utf-8') as f:
+                for key, value in sorted(folded.items()):
+                    f.write('{} {}\n'.format(key, value))
+
+        self.logger.info('Profile ({}) of {:.3f} s run saved to {}'.format(self.mode, wall, self.filename))
+        accounted = 0.0
+        for path, (calls, seconds, allocated) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            accounted += seconds
+            line = 'Profile phase {}: {} calls, {:.3f} s'.format(path, calls, seconds)
+            if self.mode == 'tracemalloc':
+                line += ', {:+.1f} MB'.format(allocated / 1048576.0)
+            self.logger.info(line)
+        self.logger.info('Profile phase other: {:.3f} s'.format(max(0.0, wall - accounted)))
@@ -0,0 +1,204 @@
+# throttle
+# Adaptive concurrency controller shared by the scripts that call the QRadar API
+#
+# Every request goes through Controller.request(). Requests are grouped by limits:
+# the default one for all requests and optional per-endpoint ones, e.g. fewer
+# concurrent writes to reference_data than reads. A request of an endpoint with its own
+# limit takes a place in it and in the default one, so max_concurrency bounds all requests
+# and the limits of the endpoints are not above it. Every limit is an AIMD window:
+#   - each good answer adds 1/limit (about +1 per window of answers), up to the maximum
+#   - 429/503 and connection errors cut the window by DECREASE, smoothed latency above
+#     LATENCY_TOLERANCE times the lowest seen one by LATENCY_DECREASE, at most once per latency interval
+#   - Retry-After (seconds or HTTP date) stops the requests of the limit until then
+#
+# Limits are given as "METHOD:path=N" items separated by commas, METHOD is GET, POST,
+# PUT, DELETE, write (POST, PUT, PATCH, DELETE) or *, path is a part of the URL:
+#       write:reference_data=2,GET:ariel=4
+#
+# The scripts live in their own folders and import this file from the root of the repository:
+#       sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+#       import throttle
+#
+import email.utils
+import threading
+import time
+
+# Writes to reference data are serialized more than reads by default
+DEFAULT_LIMITS = 'write:reference_data=2'
+
+# Answers of an overloaded console
+OVERLOAD_STATUSES = [429, 503]
+
+WRITE_METHODS = ['POST', 'PUT', 'PATCH', 'DELETE']
+
+# Window is cut by this factor on 429/503 and errors, and by the softer one on high latency
+DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+# Smoothed latency above this multiple of the lowest one means overload
+LATENCY_TOLERANCE = 2.0
+# Weight of the last answer in the smoothed latency
+LATENCY_WEIGHT = 0.2
+# Wait before a retry of 429/503 without Retry-After, doubled by every attempt, s
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+
+def parse_limits(limits):
+    """[(method, path, maximum)] of a "METHOD:path=N,..." string or of a {"METHOD:path": N} dict"""
+    if not limits:
+        return []
+    if isinstance(limits, str):
+        items = []
+        for item in limits.split(','):
+            if item.strip():
+                key, value = item.rsplit('=', 1)
+                items.append((key, value))
+    else:
+        items = limits.items()
+    rules = []
+    for key, value in items:
+        method, _, path = key.strip().partition(':')
+        method = method.strip() or '*'
+        if method != 'write':
+            method = method.upper()
+        rules.append((method, path.strip(), int(value)))
+    return rules
+
+
+def retry_after(response):
+    """Seconds to wait from the Retry-After header, None if it is missing or wrong"""
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class Limit:
+    """AIMD window of concurrent requests of one group"""
+
+    def __init__(self, name, maximum, minimum=1):
+        self.name = name
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.blocked_until = 0
+        self.latency = None
+        self.lowest = None
+        self.decreased = 0
+        self.condition = threading.Condition()
+        # Statistics of the run
+        self.requests = 0
+        self.overloads = 0
+        self.decreases = 0
+        self.peak = 0
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+            self.requests += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self, latency, overloaded=False, block=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if block:
+                self.blocked_until = max(self.blocked_until, now + block)
+            if overloaded:
+                self.overloads += 1
+            else:
+                # Fast answers of an overloaded console would lower the latency baseline, so only good ones count
+                self.latency = latency if self.latency is None else self.latency + (latency - self.latency) * LATENCY_WEIGHT
+                if self.lowest is None or self.latency < self.lowest:
+                    self.lowest = self.latency
+                else:
+                    # The baseline follows slowly when the answers become larger
+                    self.lowest += (self.latency - self.lowest) * 0.01
+            if overloaded or self.latency > self.lowest * LATENCY_TOLERANCE:
+                if now - self.decreased > (self.latency or 0):
+                    self.limit = max(self.minimum, self.limit * (DECREASE if overloaded else LATENCY_DECREASE))
+                    self.decreased = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    def stats(self):
+        return {'limit': self.name, 'window': round(self.limit, 1), 'maximum': self.maximum, 'peak': self.peak,
+                'requests': self.requests, 'overloads': self.overloads, 'decreases': self.decreases}
+
+
+class Controller:
+    """Concurrency limits of the requests of one console, shared by all threads of the script"""
+
+    def __init__(self, max_concurrency=8, limits=DEFAULT_LIMITS, retries=3):
+        self.retries = retries
+        self.default = Limit('*', max_concurrency)
+        self.rules = []
+        for method, path, maximum in parse_limits(limits):
+            self.rules.append((method, path, Limit('{}:{}'.format(method, path), min(maximum, max_concurrency))))
+
+    def limit_for(self, method, url):
+        method = method.upper()
+        for rule_method, path, limit in self.rules:
+            if rule_method == 'write':
+                matched = method in WRITE_METHODS
+            else:
+                matched = rule_method in ['*', method]
+            if matched and path in url:
+                return limit
+        return self.default
+
+    def limits_for(self, method, url):
+        """Limits taken by the request, the limit of the endpoint first and always the default one"""
+        limit = self.limit_for(method, url)
+        return [self.default] if limit is self.default else [limit, self.default]
+
+    def request(self, session, method, url, retries=None, **kwargs):
+        """session.request() within the limit of the endpoint, 429/503 are sent again after Retry-After.
+        retries=0 leaves the retries to the caller."""
+        limits = self.limits_for(method, url)
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            # Always in the same order, so requests waiting for the default limit do not block each other
+            for limit in limits:
+                limit.acquire()
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except Exception:
+                for limit in limits:
+                    limit.release(time.monotonic() - started, overloaded=True)
+                raise
+            overloaded = response.status_code in OVERLOAD_STATUSES
+            block = None
+            if overloaded:
+                block = retry_after(response)
+                if block is None:
+                    block = min(BACKOFF * 2 ** attempt, MAX_BACKOFF)
+            # Retry-After stops the endpoint only, the other requests of the console go on
+            limits[0].release(time.monotonic() - started, overloaded, block)
+            for limit in limits[1:]:
+                limit.release(time.monotonic() - started, overloaded)
+            if not overloaded or attempt == retries:
+                break
+            # The connection of an unread streamed answer goes back to the pool only when it is closed
+            response.close()
+        # Number of requests sent, for the telemetry of the callers
+        response.attempts = attempt + 1
+        return response
+
+    def stats(self):
+        return [limit.stats() for limit in [self.default] + [rule[2] for rule in self.rules] if limit.requests]
@@ -0,0 +1,147 @@
+import os
+import argparse
+import json
+import concurrent.futures
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+
+import uc87
+import throttle
+from uc87 import metrics, log_stage, LEEF_Logger, LEEF_FIELDS, date_now
+
+__author__ = "Georgiy Akhaladze"
+__version__ = "0.1.0"
+__maintainer__ = "Georgiy Akhaladze"
+__email__ = "georgiy_akhaladze@service-team.biz"
+__status__ = "Prod"
+
+
+#Sync of many QRadar reference sets from UserVentory in one run
+# - every source (set of UserVentory filters) is fetched once, even if several refsets use it
+# - sources and refsets are fetched concurrently through one connection pool
+# - every refset gets its own plan, threshold check and apply phase (see uc87.py)
+
+
+def load_config(config_path):
+    with open(config_path, 'r') as conf_data:
+        conf_data = json.load(conf_data)
+    return conf_data
+
+def source_key(filters):
+    #The same filters in another order are the same query
+    return tuple(sorted(filters))
+
+def refset_url(base_url_qradar, name):
+    return base_url_qradar + 'reference_data/sets/' + quote(name, safe='')
+
+def collect_sources(conf_data):
+    #Unique UserVentory queries used by the refsets: {key: filters}
+    named = conf_data.get("sources", {})
+    queries = {}
+    for refset in conf_data["refsets"]:
+        for source in refset["sources"]:
+            filters = named[source] if isinstance(source, str) else source
+            queries[source_key(filters)] = filters
+    return queries
+
+def refset_users(conf_data, refset, source_users):
+    #Users of all the sources of one refset
+    named = conf_data.get("sources", {})
+    items = []
+    for source in refset["sources"]:
+        filters = named[source] if isinstance(source, str) else source
+        items += source_users[source_key(filters)]
+    return items
+
+def plan_refset(refset, users, users_qradar, conf_data, args):
+    #Plan and check the changes of one refset, the plan is saved and returned
+    max_delete_fraction = refset.get("max_delete_fraction", conf_data.get("max_delete_fraction", 0.3))
+    if args.max_delete_fraction is not None:
+        max_delete_fraction = args.max_delete_fraction
+
+    plan = uc87.plan_changes(users, users_qradar["data"])
+    refused = not args.force and not uc87.plan_is_safe(plan, max_delete_fraction)
+    plan["refset"] = refset["name"]
+    plan["max_delete_fraction"] = max_delete_fraction
+    plan["status"] = "refused" if refused else ("dry-run" if args.dry_run else "apply")
+    uc87.write_plan(plan, os.path.join(args.plan_dir, 'plan-' + quote(refset["name"], safe='') + '-' + date_now + '.json'))
+    print (refset["name"] + ': add ' + str(len(plan["add"])) + ', delete ' + str(len(plan["delete"])) + ', ' + plan["status"])
+    return plan
+
+def apply_refset(plan, conf_data):
+    url = refset_url(conf_data["base_url_qradar"], plan["refset"])
+    uc87.apply_plan(plan, url + '?value=', url, conf_data.get("source_user", ""), conf_data["SEC"], conf_data.get("bulk_add", True))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sync QRadar reference sets from UserVentory filter sets')
+    parser.add_argument('--config', dest='config_path', default='/home/user/soc_scripts/uc87/refsets.json',
+                        help='configuration with sources and refsets')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                        help='only build the change plans and save them, do not change QRadar')
+    parser.add_argument('--plan-dir', dest='plan_dir', default=uc87.temp_path,
+                        help='folder to save the change plans to')
+    parser.add_argument('--max-delete-fraction', dest='max_delete_fraction', type=float,
+                        help='override the deletion threshold of all the refsets')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='apply the plans even if they exceed the deletion threshold')
+    parser.add_argument('--workers', dest='workers', type=int,
+                        help='number of concurrent requests (config: workers, default 8)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    uc87.init_logger()
+
+    leef = LEEF_Logger('timestamp=' + date_now, LEEF_FIELDS,
+                       static_keys={'ScriptName': '"' + uc87.syslog_script_name + '"',
+                                    'ScriptFolder': '"' + uc87.syslog_script_path + '"'})
+
+    conf_data = load_config(args.config_path)
+    sec = conf_data["SEC"]
+    workers = args.workers or conf_data.get("workers", 8)
+    uc87.session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=workers))
+    #Reads and writes of the refsets share the console with the analysts, so "limits" keeps the writes lower
+    uc87.controller = throttle.Controller(workers, conf_data.get("limits", throttle.DEFAULT_LIMITS))
+
+    queries = collect_sources(conf_data)
+    print ("Loading " + str(len(queries)) + " sources and " + str(len(conf_data["refsets"])) + " refsets...")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        source_futures = {key: executor.submit(uc87.fetch_userventory, conf_data["base_url_inventory"], filters, sec, conf_data.get("page_size", 100))
+                          for key, filters in queries.items()}
+        refset_futures = {refset["name"]: executor.submit(uc87.fetch_refset, refset_url(conf_data["base_url_qradar"], refset["name"]), sec)
+                          for refset in conf_data["refsets"]}
+
+        source_users = {key: future.result() for key, future in source_futures.items()}
+        metrics.users['fetched'] = sum(len(users) for users in source_users.values())
+        log_stage(leef, "Load data from userventory (1/4)", metrics.users['fetched'])
+
+        refsets_qradar = {name: future.result() for name, future in refset_futures.items()}
+        metrics.users['qradar'] = sum(len(users["data"]) for users in refsets_qradar.values())
+        log_stage(leef, "Load data from Qradar refset (2/4)", metrics.users['qradar'])
+
+        for refset in conf_data["refsets"]:
+            uc87.save_users_qradar(refsets_qradar[refset["name"]], 'refset-' + quote(refset["name"], safe='') + '-')
+
+        plans = [plan_refset(refset, refset_users(conf_data, refset, source_users), refsets_qradar[refset["name"]], conf_data, args)
+                 for refset in conf_data["refsets"]]
+        changes = sum(len(plan["add"]) + len(plan["delete"]) for plan in plans)
+        refused = [plan["refset"] for plan in plans if plan["status"] == "refused"]
+        log_stage(leef, "Compare users list beetween Qradar and UserVentory (3/4)", changes)
+        if refused:
+            print ('Plans refused for: ' + ', '.join(refused))
+
+        apply_futures = [executor.submit(apply_refset, plan, conf_data) for plan in plans if plan["status"] == "apply"]
+        for future in apply_futures:
+            future.result()
+
+    log_stage(leef, "QRadar refset synced with UserVentory (4/4)", metrics.users['added'] + metrics.users['deleted'], final=True, failed=bool(refused))
+
+    if uc87.metrics_path:
+        metrics.write(uc87.metrics_path)
+
+
+if __name__ == "__main__":
+    main()
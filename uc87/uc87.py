@@ -1,21 +1,24 @@
-import psycopg2
-import pypyodbc
 import os
+import argparse
 from dotenv import load_dotenv
 import logging
 import logging.handlers
-from rfc5424logging import Rfc5424SysLogHandler
-import psycopg2.extras
+import queue
+import socket
+import atexit
+import time
+import threading
+import math
 import json
-import pyodbc
 import datetime
-from collections import Counter
-from heapq import merge
 import requests
-from requests.auth import HTTPBasicAuth
 import urllib3
 import sys
 
+#throttle.py is shared by the scripts of the repository and lives in its root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import throttle
+
 __author__ = "Georgiy Akhaladze"
 __version__ = "0.1.0"
 __maintainer__ = "Georgiy Akhaladze"
@@ -38,6 +41,9 @@ load_dotenv()
 
 date_now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
+#Folder for refset snapshots and change plans
+temp_path = os.getenv("TEMP_PATH", '/home/user/soc_scripts/uc87/temp')
+
 
 #Loading data and config
 def load_config():
@@ -45,11 +51,10 @@ def load_config():
         conf_data = json.load(conf_data)
     return conf_data
     
-def load_users_qradar():
-    with open('/home/user/soc_scripts/uc87/users-qradar.json', 'r') as users_qradar:
-        os.system('cp /home/user/soc_scripts/uc87/users-qradar.json /home/user/soc_scripts/uc87/temp/users-qradar' + date_now + '.json')
-        users_qradar = json.load(users_qradar)
-    return users_qradar
+def save_users_qradar(users_qradar, name='users-qradar'):
+    #Snapshot of the refset content before the sync
+    with open(os.path.join(temp_path, name + date_now + '.json'), 'w') as snapshot:
+        json.dump(users_qradar, snapshot)
 
 def load_users_userventory(domain):
     with open('/home/user/soc_scripts/uc87/users-userventory-' + domain + '.json', 'r') as users_userventory:
@@ -59,49 +64,206 @@ def load_users_userventory(domain):
 def adduser(base_url_qradar_adduser, value, source_user, sec):
     #command_add_user_from_qradar_refset = 'curl -S -X POST -H "SEC: 81b9f7a3-6b09-4187-b3b7-800a30aec7da" -H "Version: 17.0" -H "Accept: application/json" "https://soc-siem.hq.gng.ua/api/reference_data/sets/RD%253AUC87-3-Accounts%2520with%2520the%2520privileges%2520of%2520viewing%2520the%2520attributes%2520of%2520the%2520LAPS?value=' + value +  '&source=GAkhaladzeScript" -k'
     #os.system(command_add_user_from_qradar_refset)
-    result = requests.post(base_url_qradar_adduser + value + source_user, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
-    return 0
+    result = http_request("POST", base_url_qradar_adduser + value + source_user, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+    return result
     
 def deluser(base_url_qradar_deluser, value, source_user, sec):
     #command_del_user_from_qradar_refset = 'curl -S -X DELETE -H "SEC: 81b9f7a3-6b09-4187-b3b7-800a30aec7da" -H "Version: 17.0" -H "Accept: application/json" "https://soc-siem.hq.gng.ua/api/reference_data/sets/RD%253AUC87-3-Accounts%2520with%2520the%2520privileges%2520of%2520viewing%2520the%2520attributes%2520of%2520the%2520LAPS?value=' + value +  '" -k'
     #os.system(command_del_user_from_qradar_refset)
-    result = requests.delete(base_url_qradar_deluser + '/' + value, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+    result = http_request("DELETE", base_url_qradar_deluser + '/' + value, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
     return result
 
+def fetch_userventory(base_url_inventory, filters, sec, page_size=100):
+    #All the users matching the filters, read page by page until "total" is reached
+    items = []
+    total = None
+    while total is None or len(items) < total:
+        response = http_request("GET", base_url_inventory, params = {"start": len(items), "size": page_size, "sortBy": "name", "filter": list(filters)}, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
+        response.raise_for_status()
+        user_data = response.json()
+        total = user_data["total"]
+        if not user_data["items"]:
+            break
+        items += user_data["items"]
+    return items
+
+def fetch_refset(base_url_qradar_refset, sec, page_size=1000):
+    #Values of the reference set in {"number_of_elements": N, "data": [{"value": ...}]} form, read by Range windows
+    data = []
+    total = None
+    while total is None or len(data) < total:
+        headers = {"SEC": sec, "Version": "16.0", "accept": "application/json",
+                   "Range": "items=" + str(len(data)) + "-" + str(len(data) + page_size - 1)}
+        response = http_request("GET", base_url_qradar_refset, params = {"fields": "number_of_elements, data (value)"}, headers = headers, verify=False)
+        response.raise_for_status()
+        refset = response.json()
+        total = refset.get("number_of_elements", 0)
+        if not refset.get("data"):
+            break
+        data += refset["data"]
+    return {"number_of_elements": total, "data": data}
+
+def http_request(method, url, **kwargs):
+    #Request through the shared session and concurrency controller with latency, size and status accounted in the run metrics
+    started = time.monotonic()
+    try:
+        response = controller.request(session, method, url, **kwargs)
+    except Exception:
+        metrics.record_http(time.monotonic() - started, error=True)
+        raise
+    body = response.request.body or b''
+    metrics.record_http(time.monotonic() - started, len(response.content), len(body), error=response.status_code >= 400)
+    return response
+
 
 #Initializing logger
 
 syslog_server = os.getenv("SYSLOG_SRV")
 syslog_port = os.getenv("SYSLOG_PORT")
+#udp (default) - one datagram per message, tcp - batched messages with octet-counting framing
+syslog_proto = os.getenv("SYSLOG_PROTO", "udp").lower()
+syslog_batch_size = int(os.getenv("SYSLOG_BATCH_SIZE", "20"))
+syslog_timeout = float(os.getenv("SYSLOG_TIMEOUT", "3"))
 log_file_path = os.getenv("LOGS_PATH")
 syslog_script_path = os.getenv("SYSLOG_SCRIPT_PATH")
 syslog_script_name = os.getenv("SYSLOG_SCRIPT_NAME")
 rootLogger = logging.getLogger('')
 rootLogger.setLevel(logging.INFO)
 
-sh = Rfc5424SysLogHandler(address=(syslog_server, syslog_port), utc_timestamp=True)
+LOG_QUEUE_SIZE = 10000
+
+#RFC5424 severities for python logging levels
+SYSLOG_SEVERITY = {logging.CRITICAL: 2, logging.ERROR: 3, logging.WARNING: 4, logging.INFO: 6, logging.DEBUG: 7}
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Rfc5424TcpBatchHandler(logging.Handler):
+    """Send RFC5424 messages to syslog over TCP in batches
+
+    Messages are framed with octet counting and sent with one sendall() per batch.
+    When the server cannot be reached the batch is dropped and no new connection
+    is tried during retry_interval, so a dead server costs at most one timeout.
+    """
+
+    def __init__(self, address, appname=None, batch_size=20, timeout=3, retry_interval=60):
+        logging.Handler.__init__(self)
+        self.address = address
+        self.appname = appname or '-'
+        self.hostname = socket.gethostname()
+        self.procid = str(os.getpid())
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.sock = None
+        self.down_until = 0
+        self.buffer = []
+
+    def build_msg(self, record):
+        pri = 8 + SYSLOG_SEVERITY.get(record.levelno, 6)
+        timestamp = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        msg = '<{}>1 {} {} {} {} - - {}'.format(pri, timestamp, self.hostname, self.appname, self.procid, self.format(record)).encode('utf-8')
+        return str(len(msg)).encode('ascii') + b' ' + msg
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.build_msg(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self.buffer:
+                return
+            batch = b''.join(self.buffer)
+            count = len(self.buffer)
+            self.buffer = []
+            if time.monotonic() < self.down_until:
+                return
+            try:
+                if self.sock is None:
+                    self.sock = socket.create_connection(self.address, timeout=self.timeout)
+                self.sock.sendall(batch)
+            except OSError as e:
+                self._disconnect()
+                self.down_until = time.monotonic() + self.retry_interval
+                sys.stderr.write('Syslog server {}:{} is unreachable, {} messages dropped: {}\n'.format(self.address[0], self.address[1], count, e))
+        finally:
+            self.release()
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def close(self):
+        self.flush()
+        self._disconnect()
+        logging.Handler.close(self)
+
+
+def init_logger():
+    #Handlers do the file and network I/O in the listener thread, rootLogger.info only puts the record into the queue
+    handlers = [logging.FileHandler(log_file_path)]
+
+    if syslog_proto == "tcp":
+        handlers.append(Rfc5424TcpBatchHandler((syslog_server, int(syslog_port)), appname=syslog_script_name, batch_size=syslog_batch_size, timeout=syslog_timeout))
+    else:
+        #rfc5424logging is imported here so that importing the module does not pay for it
+        from rfc5424logging import Rfc5424SysLogHandler
+        handlers.append(Rfc5424SysLogHandler(address=(syslog_server, syslog_port), utc_timestamp=True))
 
-rootLogger.addHandler(logging.FileHandler(log_file_path))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    rootLogger.addHandler(DroppingQueueHandler(log_queue))
 
-rootLogger.addHandler(sh)
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(stop_logger, listener)
+    return listener
+
+
+def stop_logger(listener):
+    #Sends everything left in the queue and closes the handlers, called once at exit
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
 
 
 class LEEF_Logger:
     """LEEF LOGGER"""
 
-    # LEEF Headers
-    product_vendor = None
-    
-
-    def __init__(self, product_vendor, delimiter=" "):
-        """ Define the LEEF Headers for the application logging """
+    def __init__(self, product_vendor, fields, static_keys=None, delimiter=" "):
+        """ Define the LEEF Headers for the application logging
 
-        self.product_vendor = product_vendor
-        
+        The header, the static part of the payload and the order of the event
+        fields are computed once here, logEvent only joins the event values.
+        """
 
         #if delimiter not in ['\t', '|', '^']:
             #raise ValueError("Delimeter must be '\\t', '|' or '^'")
         self.delimiter = delimiter
+        self.header = "{0} ".format(product_vendor)
+
+        static_keys = static_keys or {}
+        self.static_payload = delimiter.join(str(k) + "=" + str(static_keys[k]) for k in sorted(static_keys))
+        self.fields = [(str(k), str(k) + "=") for k in fields if k not in static_keys]
 
     def logEvent(self, event_id, keys):
         """
@@ -110,31 +272,248 @@ class LEEF_Logger:
         return self._createEventString(event_id, keys)
 
     def _createEventString(self, event_id, keys):
-        header = self._createHeader(event_id)
-
-        values = sorted([(str(k) + "=" + str(v))
-                         for k, v in iter(keys.items())])
-
-        payload = ' '.join(values)
-        #payload = '\t'.join(values)
-
-        return (header + payload)
+        values = [prefix + str(keys[k]) for k, prefix in self.fields if k in keys]
+        if self.static_payload:
+            values.insert(0, self.static_payload)
+
+        return self.header + event_id + self.delimiter.join(values)
+
+
+#Metrics output: *.prom - Prometheus textfile collector format, anything else - JSON
+metrics_path = os.getenv("METRICS_PATH")
+
+
+def percentile(values, pct):
+    #Nearest-rank percentile of a list of numbers, 0 for an empty list
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+class SyncMetrics:
+    """Timings, HTTP statistics and user counters of one sync run"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stage_started = self.started
+        self.stage_first_call = 0
+        self.latencies = []
+        self.http_errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_bytes = 0
+        self.stage_errors = 0
+        self.users = {'fetched': 0, 'qradar': 0, 'added': 0, 'deleted': 0}
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def record_http(self, latency, bytes_in=0, bytes_out=0, error=False):
+        with self.lock:
+            self.latencies.append(latency)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.stage_bytes += bytes_in + bytes_out
+            if error:
+                self.http_errors += 1
+                self.stage_errors += 1
+
+    def count_users(self, kind, count=1):
+        with self.lock:
+            self.users[kind] += count
+
+    def end_stage(self, name, count):
+        #Closes the current stage and returns its statistics, the next stage starts now
+        now = time.monotonic()
+        latencies = self.latencies[self.stage_first_call:]
+        stage = {'name': name,
+                 'duration_ms': int((now - self.stage_started) * 1000),
+                 'items': count,
+                 'http_calls': len(latencies),
+                 'http_errors': self.stage_errors,
+                 'latency_p50_ms': int(percentile(latencies, 50) * 1000),
+                 'latency_p95_ms': int(percentile(latencies, 95) * 1000),
+                 'latency_max_ms': int(max(latencies, default=0) * 1000),
+                 'bytes': self.stage_bytes}
+        self.stages.append(stage)
+        self.stage_started = now
+        self.stage_first_call = len(self.latencies)
+        self.stage_bytes = 0
+        self.stage_errors = 0
+        return stage
+
+    def summary(self):
+        return {'script': syslog_script_name,
+                'timestamp': date_now,
+                'duration_ms': int((time.monotonic() - self.started) * 1000),
+                'http_calls': len(self.latencies),
+                'http_errors': self.http_errors,
+                'latency_p50_ms': int(percentile(self.latencies, 50) * 1000),
+                'latency_p90_ms': int(percentile(self.latencies, 90) * 1000),
+                'latency_p99_ms': int(percentile(self.latencies, 99) * 1000),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'users': self.users,
+                'stages': self.stages}
+
+    def write(self, path):
+        #The file is replaced atomically so that node_exporter never reads a half written file
+        summary = self.summary()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            if path.endswith('.prom'):
+                metrics_file.write(self._prometheus(summary))
+            else:
+                json.dump(summary, metrics_file, indent=2)
+        os.replace(tmp_path, path)
+
+    def _prometheus(self, summary):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP uc87_{} {}'.format(name, help_text))
+            lines.append('# TYPE uc87_{} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('uc87_{}{} {}'.format(name, labels, value))
+
+        metric('run_duration_seconds', 'gauge', 'Wall time of the sync run', [('', summary['duration_ms'] / 1000.0)])
+        metric('stage_duration_seconds', 'gauge', 'Wall time of the sync stage',
+               [('{{stage="{}"}}'.format(n + 1), st['duration_ms'] / 1000.0) for n, st in enumerate(summary['stages'])])
+        metric('stage_http_calls', 'gauge', 'HTTP calls made by the sync stage',
+               [('{{stage="{}"}}'.format(n + 1), st['http_calls']) for n, st in enumerate(summary['stages'])])
+        metric('http_calls', 'gauge', 'HTTP calls made by the run', [('', summary['http_calls'])])
+        metric('http_errors', 'gauge', 'HTTP calls failed or answered with status >= 400', [('', summary['http_errors'])])
+        metric('http_latency_seconds', 'gauge', 'HTTP latency percentiles of the run',
+               [('{{quantile="{}"}}'.format(q), summary['latency_p{}_ms'.format(p)] / 1000.0) for q, p in (('0.5', 50), ('0.9', 90), ('0.99', 99))])
+        metric('bytes', 'gauge', 'Bytes transferred by HTTP calls',
+               [('{direction="in"}', summary['bytes_in']), ('{direction="out"}', summary['bytes_out'])])
+        metric('users', 'gauge', 'Users fetched from UserVentory, read from QRadar, added and deleted',
+               [('{{kind="{}"}}'.format(k), v) for k, v in sorted(summary['users'].items())])
+        metric('last_run_timestamp_seconds', 'gauge', 'Unix time of the end of the run', [('', int(time.time()))])
+        return '\n'.join(lines) + '\n'
+
+
+metrics = SyncMetrics()
+
+#One connection pool for all the calls of the run
+session = requests.Session()
+
+#Concurrency of the calls adapts to latency and 429/503, Retry-After is respected
+controller = throttle.Controller()
+
+
+#Order of the stage event fields, fixed for all the events of the run
+LEEF_FIELDS = ['ScriptStage', 'StageDuration', 'ItemsCount', 'HttpCalls', 'HttpErrors',
+               'HttpLatencyP50', 'HttpLatencyP95', 'HttpLatencyMax', 'BytesTransferred',
+               'UsersFetched', 'UsersAdded', 'UsersDeleted', 'TotalDuration']
+
+
+def log_stage(leef, stage, count, final=False, failed=False):
+    #Emits the LEEF event of a finished stage with its duration (ms), processed items and HTTP statistics
+    stats = metrics.end_stage(stage, count)
+    event = {'ScriptStage': '"' + stage + '"',
+             'StageDuration': stats['duration_ms'],
+             'ItemsCount': count,
+             'HttpCalls': stats['http_calls'],
+             'HttpErrors': stats['http_errors'],
+             'HttpLatencyP50': stats['latency_p50_ms'],
+             'HttpLatencyP95': stats['latency_p95_ms'],
+             'HttpLatencyMax': stats['latency_max_ms'],
+             'BytesTransferred': stats['bytes']}
+    if final:
+        summary = metrics.summary()
+        event.update({'UsersFetched': metrics.users['fetched'],
+                      'UsersAdded': metrics.users['added'],
+                      'UsersDeleted': metrics.users['deleted'],
+                      'TotalDuration': summary['duration_ms']})
+    status = 'ScriptStatus="Error" ' if stats['http_errors'] or failed else 'ScriptStatus="Success" '
+    rootLogger.info(leef.logEvent(status, event))
+
+
+def plan_changes(user_data_items, qradar_data):
+    #Full change set: users present only in UserVentory are added, users present only in QRadar are deleted
+    uv_users = set()
+    for user_ventory_user in user_data_items:
+        uv_user = user_ventory_user["name"]["default"]
+        uv_users.add('@'.join(uv_user.split('@')[:-1]))
+    qr_users = set(qradar_user["value"] for qradar_user in qradar_data)
+    return {"timestamp": date_now,
+            "uv_total": len(uv_users),
+            "qradar_total": len(qr_users),
+            "add": sorted(uv_users - qr_users),
+            "delete": sorted(qr_users - uv_users)}
+
+def write_plan(plan, plan_path):
+    with open(plan_path, 'w') as plan_file:
+        json.dump(plan, plan_file, indent=2)
+
+def plan_is_safe(plan, max_delete_fraction):
+    #A truncated UserVentory answer looks like mass deletion, such a plan must not be applied
+    if not plan["qradar_total"]:
+        return True
+    return len(plan["delete"]) <= plan["qradar_total"] * max_delete_fraction
+
+def bulk_adduser(base_url_qradar_refset, values, sec):
+    #One bulk_load call instead of one POST per user: .../reference_data/sets/bulk_load/<name>
+    base_url, name = base_url_qradar_refset.split('?')[0].rsplit('/', 1)
+    return http_request("POST", base_url + '/bulk_load/' + name, data=json.dumps(values), headers = {"SEC": sec, "accept": "application/json", "Content-Type": "application/json"}, verify=False)
+
+def apply_plan(plan, base_url_qradar_adduser, base_url_qradar_deluser, source_user, sec, bulk_add=True):
+    for qr_user in plan["delete"]:
+        print ('Delete User from RefSet ' + qr_user)
+        try:
+            req_del = deluser(base_url_qradar_deluser, qr_user, source_user, sec)
+            if req_del.status_code < 400:
+                metrics.count_users('deleted')
+            else:
+                print('Error: ' + str(req_del.status_code) + ' on delete of ' + qr_user)
+        except Exception as e:
+            print('Error: ' + str(e))
+
+    if bulk_add and len(plan["add"]) > 1:
+        print ('Add ' + str(len(plan["add"])) + ' users to RefSet')
+        try:
+            req_add = bulk_adduser(base_url_qradar_deluser, plan["add"], sec)
+            if req_add.status_code < 400:
+                metrics.count_users('added', len(plan["add"]))
+            else:
+                print('Error: ' + str(req_add.status_code) + ' on bulk load')
+        except Exception as e:
+            print('Error: ' + str(e))
+    else:
+        for uv_user in plan["add"]:
+            print ('Add User to RefSet ' + uv_user)
+            try:
+                req_add = adduser(base_url_qradar_adduser, uv_user, source_user, sec)
+                if req_add.status_code < 400:
+                    metrics.count_users('added')
+                else:
+                    print('Error: ' + str(req_add.status_code) + ' on add of ' + uv_user)
+            except Exception as e:
+                print('Error: ' + str(e))
 
-    def _createHeader(self, event_id):
-        return "{0} {1}". \
-               format(self.product_vendor, event_id )
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sync privileged users from UserVentory to QRadar reference set')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                        help='only build the change plan and save it, do not change QRadar')
+    parser.add_argument('--plan', dest='plan_path', default=os.path.join(temp_path, 'plan-' + date_now + '.json'),
+                        help='file to save the change plan to')
+    parser.add_argument('--max-delete-fraction', dest='max_delete_fraction', type=float,
+                        help='refuse to apply the plan when it deletes more than this fraction of the refset (config: max_delete_fraction, default 0.3)')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='apply the plan even if it exceeds the deletion threshold')
+    return parser.parse_args()
 
 
 def main():
-    leef = LEEF_Logger('timestamp=' + date_now, delimiter="  ")
-    event = {'ScriptName' : '"' + syslog_script_name + '"', 
-             'ScriptFolder' : '"' + syslog_script_path + '"', 
-             'ScriptStage' : '"Load data from userventory (1/4)"'}
-             
-    msg = leef.logEvent('ScriptStatus="Success" ', event)
-    rootLogger.info(msg)
-    
+    args = parse_args()
+    init_logger()
+
+    leef = LEEF_Logger('timestamp=' + date_now, LEEF_FIELDS,
+                       static_keys={'ScriptName': '"' + syslog_script_name + '"',
+                                    'ScriptFolder': '"' + syslog_script_path + '"'})
 
     conf_data=load_config()
     base_url_inventory=conf_data["base_url_inventory"]
@@ -144,6 +523,7 @@ def main():
     source_user=conf_data["source_user"]
     base_url_qradar_adduser=conf_data["base_url_qradar_adduser"]
     base_url_qradar_deluser=conf_data["base_url_qradar_deluser"]
+    max_delete_fraction = args.max_delete_fraction if args.max_delete_fraction is not None else conf_data.get("max_delete_fraction", 0.3)
     
     user_data = []
     user_data_items = []
@@ -157,30 +537,26 @@ def main():
         member_of_group=config_domain["member_of_group"]
         domain=config_domain["domain"]
        
-        response = requests.get(base_url_inventory, params = {"start": 0,"size":100, "sortBy":"name", "filter": {member_of_group, domain}}, headers = {"SEC": sec, "accept": "application/json"}, verify=False)
-        
-        print(response.request.url)
+        user_data = fetch_userventory(base_url_inventory, [member_of_group, domain], sec)
         
         
         #print(response.request.body)
         #print(response.request.headers)
         #exit()
         
-        user_data = response.json()
         print ("Domain: " + domain + " Groups: " + member_of_group)
-        print("Total Users Counter " + str(user_data["total"]))
+        print("Total Users Counter " + str(len(user_data)))
         
         
         
         
         #print ('NUMBER' + str(ii))
-        for user_data_item in user_data["items"]:    
+        for user_data_item in user_data:    
             print(user_data_item["name"]["default"])
         
         
         
         
-        user_data = user_data["items"]
         user_data_items += user_data
         
         
@@ -189,94 +565,44 @@ def main():
     
     #Logging stage userventory data downloaded
     
-    leef = LEEF_Logger('timestamp=' + date_now, delimiter="  ")
-    event = {'ScriptName' : '"' + syslog_script_name + '"', 
-             'ScriptFolder' : '"' + syslog_script_path + '"', 
-             'ScriptStage' : '"Load data from Qradar refset (2/4)"'}
-             
-    msg = leef.logEvent('ScriptStatus="Success" ', event)
-    rootLogger.info(msg)
+    metrics.users['fetched'] = len(user_data_items)
+    log_stage(leef, "Load data from userventory (1/4)", len(user_data_items))
 
 
     
     
     
-    command_get_users_from_qradar = 'curl -S -X GET -H "Range: items=0-200" -H "Version: 16.0" -H "SEC: 81b9f7a3-6b09-4187-b3b7-800a30aec7da" -H "Accept: application/json" "https://soc-siem.hq.gng.ua/api/reference_data/sets/RD%253AUC87-3-Accounts%2520with%2520the%2520privileges%2520of%2520viewing%2520the%2520attributes%2520of%2520the%2520LAPS?fields=number_of_elements%2C%20data%20%28value%29" -k > users-qradar.json'
-    os.system(command_get_users_from_qradar)
-
-
+    users_qradar = fetch_refset(base_url_qradar_deluser, sec)
+    save_users_qradar(users_qradar)
 
-    #print ("Iteration user QRadar...")
-    users_qradar=load_users_qradar()
+    #Logging stage QRadar refset downloaded
 
+    metrics.users['qradar'] = len(users_qradar.get("data", []))
+    log_stage(leef, "Load data from Qradar refset (2/4)", metrics.users['qradar'])
 
-
-#Iterate users in QRadar and compare with users in Userventory    
-    for qradar_user in users_qradar["data"]:
-        qr_user=qradar_user["value"]
-        
-    
-        for user_ventory_user in user_data_items:
-            uv_user=user_ventory_user["name"]["default"]
-            uv_user = '@'.join(uv_user.split('@')[:-1])
-       
-            if (uv_user == qr_user):
-                #print ('match ' + uv_user)
-                break
-        else:
-            print ('Delete User from RefSet ' + qr_user)
-            
-            try:
-                req_del = deluser(base_url_qradar_deluser, qr_user, source_user, sec)
-           
-            except Exception as e:
-                print('Error:' + e + req_del.status_code)
-                print('Success delete record')
-            
+#Compare users in Userventory and QRadar, nothing is changed in QRadar until the plan is checked
+    plan = plan_changes(user_data_items, users_qradar["data"])
+    refused = not args.force and not plan_is_safe(plan, max_delete_fraction)
+    plan["max_delete_fraction"] = max_delete_fraction
+    plan["status"] = "refused" if refused else ("dry-run" if args.dry_run else "apply")
+    write_plan(plan, args.plan_path)
+    print ('Plan saved to ' + args.plan_path + ': add ' + str(len(plan["add"])) + ', delete ' + str(len(plan["delete"])))
 
     #Logging stage iteration users acros QRadar and Userventory
     
-    leef = LEEF_Logger('timestamp=' + date_now, delimiter="  ")
-    event = {'ScriptName' : '"' + syslog_script_name + '"', 
-             'ScriptFolder' : '"' + syslog_script_path + '"', 
-             'ScriptStage' : '"Compare users list beetween Qradar and UserVentory (3/4)"'}
-             
-    msg = leef.logEvent('ScriptStatus="Success" ', event)
-    rootLogger.info(msg)
+    log_stage(leef, "Compare users list beetween Qradar and UserVentory (3/4)", len(plan["add"]) + len(plan["delete"]))
 
-                   
+    if refused:
+        print ('Plan refused: ' + str(len(plan["delete"])) + ' of ' + str(plan["qradar_total"]) + ' users would be deleted, allowed fraction is ' + str(max_delete_fraction))
+    elif not args.dry_run:
+        apply_plan(plan, base_url_qradar_adduser, base_url_qradar_deluser, source_user, sec, conf_data.get("bulk_add", True))
 
-#Iterate users in Userventory and compare with users in QRadar    
-    for user_ventory_user in user_data_items:
-        uv_user=user_ventory_user["name"]["default"]
-        uv_user = '@'.join(uv_user.split('@')[:-1])
-        present_in_qradar=0
-            
-
-
-        for qradar_user in users_qradar["data"]:
-            qr_user=qradar_user["value"]
-            
-            if (uv_user == qr_user):
-                #print ('match ' + uv_user)
-                present_in_qradar=1
-                break
-            
-        if (present_in_qradar==0):
-            
-            adduser(base_url_qradar_adduser, uv_user, source_user, sec)
-            print ('Add User to RefSet ' + uv_user)
-
-    
     #Logging stage: QRadar refset synced with UserVentory
     
-    leef = LEEF_Logger('timestamp=' + date_now, delimiter="  ")
-    event = {'ScriptName' : '"' + syslog_script_name + '"', 
-             'ScriptFolder' : '"' + syslog_script_path + '"', 
-             'ScriptStage' : '"QRadar refset synced with UserVentory (4/4)"'}
-             
-    msg = leef.logEvent('ScriptStatus="Success" ', event)
-    rootLogger.info(msg)   
+    log_stage(leef, "QRadar refset synced with UserVentory (4/4)", metrics.users['added'] + metrics.users['deleted'], final=True, failed=refused)
+
+    if metrics_path:
+        metrics.write(metrics_path)
            
     
 